@@ -1,16 +1,18 @@
 import customtkinter as ctk  
 from tkinter import filedialog, messagebox 
-from threading import Thread  
 from LCPeer import LCPClient  
-import time  
+from history_store import open_history_store
+from lcp_logging import configure_logging, dump_on_signal, get_logger
+from progress import describe
 import threading 
-import json  
 import os  
 from datetime import datetime  
 
+logger = get_logger("gui")
+
 
 class LCPGUI:
-    def __init__(self, root):
+    def __init__(self, root, history_backend="jsonl"):
         self.root = root
         self.root.title("LCPeer - Chat y Transferencia de Archivos")
         self.root.geometry("900x600")
@@ -22,76 +24,41 @@ class LCPGUI:
         self.client = None
         self.current_peer = None
         self.is_updating = False
+        self._last_event_seq = 0
+        self.transfer_rows = {}  # transfer_id -> (frame, barra, etiqueta)
         self.history_dir = "chat_history"
         self._create_history_dir()
+        self.history = open_history_store(self.history_dir, history_backend)
         self._build_login()
 
     def _create_history_dir(self):
         """Crea el directorio para guardar los historiales si no existe"""
         if not os.path.exists(self.history_dir):
             os.makedirs(self.history_dir)
-            print(f"Directorio de historial creado: {self.history_dir}")
-
-        # Crear archivo para mensajes broadcast si no existe
-        broadcast_file = os.path.join(self.history_dir, "Broadcast.json")
-        if not os.path.exists(broadcast_file):
-            with open(broadcast_file, "w") as f:
-                json.dump([], f)
-            print(f"Archivo de historial de broadcasts creado: {broadcast_file}")
-
-    def _get_history_file(self, peer_id):
-        """Devuelve la ruta del archivo de historial para un peer específico"""
-        return os.path.join(self.history_dir, f"{peer_id}.json")
+            logger.info("Directorio de historial creado: %s", self.history_dir)
 
     def _save_message(self, peer_id, sender, message, timestamp=None):
         """Guarda un mensaje en el historial del peer especificado"""
         if timestamp is None:
             timestamp = datetime.now().isoformat()
 
-        history_file = self._get_history_file(peer_id)
-        history = self._load_peer_history(peer_id)
-
-        # Evitar duplicados verificando si el mensaje ya existe
-        for msg in history:
-            if (
-                msg.get("timestamp") == timestamp
-                and msg.get("sender") == sender
-                and msg.get("message") == message
-            ):
-                return  
-
-        # Añadir el nuevo mensaje al historial
-        history.append({"timestamp": timestamp, "sender": sender, "message": message})
-
-        with open(history_file, "w") as f:
-            json.dump(history, f, indent=2)
-
-    def _load_peer_history(self, peer_id):
-        """Carga el historial de mensajes con un peer específico"""
-        history_file = self._get_history_file(peer_id)
-
-        if not os.path.exists(history_file):
-            return []
-
-        try:
-            with open(history_file, "r") as f:
-                return json.load(f)
-        except:
-            return []
+        # Añadir el nuevo mensaje al final del historial, sin reescribirlo;
+        # el almacén descarta los duplicados con su índice de resúmenes
+        self.history.append(
+            peer_id, {"timestamp": timestamp, "sender": sender, "message": message}
+        )
 
     def _display_peer_history(self, peer_id):
         """Muestra el historial de mensajes con un peer en el área de chat"""
-        history = self._load_peer_history(peer_id)
+        # Solo se leen los últimos mensajes, no el historial completo
+        messages_to_show = self.history.tail(peer_id, 10)
         self.chat_area.configure(state="normal")
         self.chat_area.delete("1.0", "end")
 
-        if not history and peer_id == "Broadcast":
+        if not messages_to_show and peer_id == "Broadcast":
             self.chat_area.insert("end", "No hay mensajes broadcast aún.\n")
             self.current_peer = "Broadcast"
         else:
-    
-            messages_to_show = history[-10:] if len(history) > 10 else history
-
             for msg in messages_to_show:
                 timestamp = datetime.fromisoformat(msg["timestamp"]).strftime(
                     "%Y-%m-%d %H:%M:%S"
@@ -136,14 +103,17 @@ class LCPGUI:
             messagebox.showerror("Error", "El ID de usuario no puede estar vacío.")
             return
 
-        self.client = LCPClient(user_id)  
+        self.client = LCPClient(
+            user_id, peer_cache=os.path.join(self.history_dir, ".peers_cache.json")
+        )
         
         try:
-            self.client.register_message_callback(self._on_message_received)
+            self.client.register_event_callback(self._on_history_event)
         except Exception as e:
-            print(f"Error registrando callback: {e}")
+            logger.error("Error registrando callback: %s", e)
         self.login_frame.destroy()  
         self._build_main_interface()  
+        self.client.register_progress_callback(self._on_transfer_progress)
 
     def _build_main_interface(self):
         self.root.grid_columnconfigure(1, weight=1)
@@ -259,7 +229,12 @@ class LCPGUI:
         )
         self.broadcast_btn.grid(row=0, column=2, padx=5, sticky="we")
 
-        Thread(target=self._auto_refresh_history, daemon=True).start()
+        # Una barra por cada archivo que se está enviando o recibiendo
+        self.transfers_frame = ctk.CTkFrame(self.right_frame, fg_color="transparent")
+        self.transfers_frame.grid(row=4, column=0, padx=10, pady=(0, 5), sticky="we")
+
+        # Mostrar de entrada los peers recuperados de la caché
+        self.update_peers()
 
     def send_broadcast(self):
         """Envía el mensaje actual como broadcast a todos los peers"""
@@ -279,7 +254,7 @@ class LCPGUI:
 
         try:
             threading.Thread(
-                target=self.client.uno_a_muchos, args=(message,), daemon=True
+                target=self._broadcast_thread, args=(message,), daemon=True
             ).start()
 
             self.show_broadcast_history()
@@ -289,6 +264,17 @@ class LCPGUI:
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo enviar el broadcast: {str(e)}")
 
+    def _broadcast_thread(self, message):
+        report = self.client.uno_a_muchos(message)
+        if report and report.failed:
+            failed = ", ".join(report.failed)
+            self.root.after(
+                0,
+                lambda: messagebox.showwarning(
+                    "Broadcast incompleto", f"No confirmaron el mensaje: {failed}"
+                ),
+            )
+
     def update_peers(self):
         for widget in self.peer_listbox.winfo_children():
             widget.destroy()
@@ -337,7 +323,7 @@ class LCPGUI:
                 elif isinstance(widget, ctk.CTkFrame):
                     widget.configure(fg_color="transparent")
             except Exception as e:
-                print(f"Error al limpiar widget: {e}")
+                logger.debug("Error al limpiar widget: %s", e)
 
         for widget in self.peer_listbox.winfo_children():
             try:
@@ -348,7 +334,7 @@ class LCPGUI:
                         self._display_peer_history(peer_id)
                         return
             except Exception as e:
-                print(f"Error al procesar widget: {e}")
+                logger.debug("Error al procesar widget: %s", e)
 
         self.current_peer = peer_id
         self._display_peer_history(peer_id)
@@ -359,7 +345,6 @@ class LCPGUI:
 
     def show_broadcast_history(self):
         """Muestra el historial de mensajes broadcast"""
-        print("Mostrando historial de mensajes broadcast")
         self.current_peer = "Broadcast"
 
         for widget in self.peer_listbox.winfo_children():
@@ -374,18 +359,9 @@ class LCPGUI:
                                     widget.configure(fg_color=("#3B8ED0", "#1F538D"))
                                     break
                             except Exception as e:
-                                print(f"Error al verificar texto del hijo: {e}")
+                                logger.debug("Error al verificar texto del hijo: %s", e)
             except Exception as e:
-                print(f"Error al configurar widget en broadcast history: {e}")
-
-        # Asegurarse de que existe un archivo de historial para broadcasts
-        history_file = self._get_history_file("Broadcast")
-        if not os.path.exists(os.path.dirname(history_file)):
-            os.makedirs(os.path.dirname(history_file))
-
-        if not os.path.exists(history_file):
-            with open(history_file, "w") as f:
-                json.dump([], f)
+                logger.debug("Error al configurar widget en broadcast history: %s", e)
 
         # Mostrar el historial
         self._display_peer_history("Broadcast")
@@ -406,22 +382,16 @@ class LCPGUI:
     def _send_message_thread(self, peer_id, message):
         try:
             self._set_interaction_state(False)
-            timestamp = datetime.now()
-            self.client.send_message(peer_id, message)
-            self.root.after(0, lambda: self.message_entry.delete(0, "end"))
-
-            # Mostrar en el chat
-            self.chat_area.configure(state="normal")
-            self.chat_area.insert("end", f"[Tú]: {message}\n")
-            self.chat_area.configure(state="disabled")
-
-            # Guardar en historial
-            self._save_message(
-                peer_id,
-                self.client.user_id.decode("utf-8").strip(),
-                message,
-                timestamp.isoformat(),
-            )
+            # El evento "sent" del cliente se encarga de guardarlo y mostrarlo
+            if self.client.send_message(peer_id, message):
+                self.root.after(0, lambda: self.message_entry.delete(0, "end"))
+            else:
+                self.root.after(
+                    0,
+                    lambda: messagebox.showwarning(
+                        "Mensaje no enviado", f"No se pudo entregar el mensaje a {peer_id}."
+                    ),
+                )
 
         except Exception as e:
             messagebox.showerror("Error al enviar mensaje", str(e))
@@ -445,10 +415,17 @@ class LCPGUI:
         try:
             self._set_interaction_state(False)
             timestamp = datetime.now()
-            self.client.send_file(peer_id, filepath)
+            filename = os.path.basename(filepath)
+            if not self.client.send_file(peer_id, filepath):
+                self.root.after(
+                    0,
+                    lambda: messagebox.showwarning(
+                        "Archivo no enviado", f"No se pudo enviar {filename} a {peer_id}."
+                    ),
+                )
+                return
 
             # Guardar en historial
-            filename = os.path.basename(filepath)
             self._save_message(
                 peer_id,
                 self.client.user_id.decode("utf-8").strip(),
@@ -466,56 +443,49 @@ class LCPGUI:
         finally:
             self._set_interaction_state(True)
 
-    def _refresh_history(self):
-        """Actualiza el historial cuando llegan nuevos mensajes"""
-        for peer_id in self.client.peers:
-            peer_messages = [
-                msg
-                for msg in self.client.message_history
-                if msg[0] == peer_id or msg[0] == self.client.normalizar(peer_id)
-            ]
-            existing_history = self._load_peer_history(peer_id)
-
-            new_messages = []
-            for msg_data in peer_messages:
-                sender, message_text, timestamp = msg_data
-                is_new = True
-
-                for existing_msg in existing_history:
-                    if (
-                        existing_msg.get("message") == message_text
-                        and existing_msg.get("sender") == sender
-                    ):
-                        is_new = False
-                        break
-
-                if is_new:
-                    new_messages.append(msg_data)
-
-            if new_messages:
-                for sender, message, timestamp in new_messages:
-                    self._save_message(peer_id, sender, message, timestamp.isoformat())
-
-                if self.current_peer and self.current_peer == peer_id:
-                    self._display_peer_history(peer_id)
-
-    def _auto_refresh_history(self):
-        while True:
-            self._refresh_history()
-            time.sleep(1)
-
-    def _on_message_received(self, sender_id, message):
-        """Callback que se ejecuta cuando se recibe un mensaje nuevo"""
+    def _on_transfer_progress(self, progress):
+        """Recibe el progreso de una transferencia desde el hilo de callbacks"""
+        self.root.after(0, lambda: self._show_transfer_progress(progress))
+
+    def _show_transfer_progress(self, progress):
+        """Actualiza la barra de una transferencia; la quita poco después de terminar"""
+        row = self.transfer_rows.get(progress.transfer_id)
+        if row is None:
+            if progress.state != "active":
+                return
+            frame = ctk.CTkFrame(self.transfers_frame, fg_color="transparent")
+            frame.pack(fill="x", pady=2)
+            bar = ctk.CTkProgressBar(frame, width=200)
+            bar.pack(side="left", padx=5)
+            label = ctk.CTkLabel(frame, text="", font=("Helvetica", 11), anchor="w")
+            label.pack(side="left", fill="x", expand=True, padx=5)
+            row = self.transfer_rows[progress.transfer_id] = (frame, bar, label)
+
+        frame, bar, label = row
+        bar.set(progress.fraction)
+        label.configure(text=describe(progress))
+        if progress.state != "active":
+            del self.transfer_rows[progress.transfer_id]
+            self.root.after(3000, frame.destroy)
+
+    def _on_history_event(self, event):
+        """Persiste y muestra un mensaje nuevo a partir del evento del cliente
+
+        Los eventos llegan en orden de seq, así que solo se aplica el delta
+        desde el último evento procesado.
+        """
         try:
-            timestamp = datetime.now()
-            print(f"CALLBACK - Mensaje recibido de {sender_id}: {message}")
+            if event.seq <= self._last_event_seq:
+                return
+            self._last_event_seq = event.seq
+            own_id = self.client.user_id.decode("utf-8").strip()
 
-            if sender_id == "Broadcast" or sender_id == "Broadcast:Enviado":
-                is_sent = sender_id == "Broadcast:Enviado"
-                display_sender = "Tú (Broadcast)" if is_sent else "Broadcast"
+            if event.kind in ("broadcast", "broadcast_sent"):
+                is_sent = event.kind == "broadcast_sent"
+                display_sender = "Tú (Broadcast)" if is_sent else event.sender
 
                 self._save_message(
-                    "Broadcast", display_sender, message, timestamp.isoformat()
+                    "Broadcast", display_sender, event.message, event.timestamp.isoformat()
                 )
 
                 if not is_sent:
@@ -523,32 +493,38 @@ class LCPGUI:
                         0,
                         lambda: messagebox.showinfo(
                             "Mensaje Broadcast",
-                            f"Broadcast recibido: {message[:100]}...",
+                            f"Broadcast recibido: {event.message[:100]}...",
                         ),
                     )
 
                 if self.current_peer == "Broadcast":
                     self.root.after(0, lambda: self._display_peer_history("Broadcast"))
             else:
-                self._save_message(sender_id, sender_id, message, timestamp.isoformat())
-                if self.current_peer == sender_id:
+                self._save_message(
+                    event.peer_id, event.sender, event.message, event.timestamp.isoformat()
+                )
+                if self.current_peer == event.peer_id:
+                    label = "Tú" if event.sender == own_id else event.sender
                     self.root.after(
-                        0, lambda: self._update_chat_display(sender_id, message)
+                        0,
+                        lambda: self._update_chat_display(
+                            label, event.message, event.peer_id
+                        ),
                     )
-                else:
+                elif event.kind == "received":
                     self.root.after(
                         0,
                         lambda: messagebox.showinfo(
                             "Nuevo mensaje",
-                            f"Mensaje recibido de {sender_id}:\n{message[:50]}...",
+                            f"Mensaje recibido de {event.sender}:\n{event.message[:50]}...",
                         ),
                     )
         except Exception as e:
-            print(f"Error procesando mensaje recibido: {e}")
+            logger.error("Error procesando mensaje recibido: %s", e)
 
-    def _update_chat_display(self, sender_id, message):
+    def _update_chat_display(self, sender_id, message, peer_id=None):
         """Actualiza la visualización del chat con un nuevo mensaje"""
-        if self.current_peer == sender_id:
+        if self.current_peer == (peer_id or sender_id):
             self.chat_area.configure(state="normal")
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             self.chat_area.insert("end", f"[{timestamp}] {sender_id}: {message}\n")
@@ -565,10 +541,14 @@ class LCPGUI:
     def shutdown(self):
         if self.client:
             self.client.shutdown()
+        self.history.close()
         self.root.destroy()
 
 
 if __name__ == "__main__":
+    configure_logging()
+    # kill -USR1 <pid> vuelca los últimos eventos del protocolo en stderr
+    dump_on_signal()
     root = ctk.CTk()
     app = LCPGUI(root)
     root.mainloop()
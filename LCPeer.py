@@ -1,56 +1,138 @@
+import asyncio
+import contextlib
 import socket
 import threading
 import uuid
 import os
 from datetime import datetime
-import queue
-import struct
-import subprocess
-import re
 import ipaddress
 import time
-import platform
+
+from compression import (
+    choose_codec,
+    codec_for,
+    compress_message,
+    receive_blocks,
+    send_blocks,
+)
+from fanout import DeliveryReport, FanOutCollector
+from file_stream import FileStream, preallocate, pwrite_all
+from integrity import DIGEST_NAMES, DIGEST_SIZE, new_digest, sendfile_hashed
+from fragments import (
+    FRAGMENT_PAYLOAD,
+    FRAGMENT_PREFIX,
+    FragmentSender,
+    Reassembly,
+    parse_fragment,
+)
+from lcp_extensions import (
+    CAP_DIGEST,
+    CAP_FRAGMENT,
+    CAP_RESUME,
+    CAP_SESSION,
+    CAP_STRIPE,
+    HDR_FRAGMENTED,
+    HDR_SESSION,
+    HDR_STRIPED,
+    fragment_ack,
+    header_caps,
+    header_compression,
+    header_digest,
+    header_flags,
+    header_transfer_key,
+    response_caps,
+    session_ack,
+    session_fields,
+    set_header_ext,
+    set_compression,
+    set_digest,
+    set_response_body_id,
+    set_fragment_ack,
+    set_response_caps,
+    set_session_ack,
+    set_transfer_key,
+)
+from lcp_logging import configure_logging, dump_events, get_logger
+from message_history import MessageHistory
+from metrics import MetricsRegistry, serve_metrics
+from network_interfaces import InterfaceInventory
+from peer_registry import PeerRegistry
+from progress import ProgressTracker
+from response_router import ResponseRouter
+from resumable import (
+    PartialStore,
+    encode_busy_offer,
+    read_offer,
+    transfer_key,
+    verify_offer,
+)
+from striping import (
+    STRIPE_MIN_SIZE,
+    StripedFile,
+    StripeScheduler,
+    decode_range,
+    encode_range,
+)
+from sessions import SessionReceiver, SessionSender
+from timer_wheel import TimerWheel
+from transfers import TransferRegistry
+
+logger = get_logger("peer")
+
+# Tiempo que se conserva un cuerpo pendiente (o ya entregado) para cubrir
+# todos los reintentos del emisor
+BODY_TTL = 30
+UDP_RCVBUF = 4 * 1024 * 1024
+
+# Cuerpos fragmentados: tamaño máximo de un mensaje, memoria total para
+# reensamblar y tiempo máximo sin recibir fragmentos
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+REASSEMBLY_BUDGET = 32 * 1024 * 1024
+REASSEMBLY_TIMEOUT = 10
+# Lo que cabe en un único datagrama UDP tras el BodyId
+MAX_DATAGRAM_BODY = 65507 - 8
+
+# Intentos de un envío de archivo reanudable; cada uno sigue donde quedó el anterior
+FILE_ATTEMPTS = 3
+# Buffer que cada conexión de archivos reserva para recibir el contenido
+FILE_READ_SIZE = 1024 * 1024
+# Espera antes de volver a ofrecer un archivo a un receptor saturado; crece
+# con cada rechazo
+FILE_BUSY_DELAY = 1
+# Tiempo que una conexión rechazada descarta lo que envía el emisor antes de
+# cerrarse (cerrar con datos sin leer provocaría un RST)
+REFUSE_LINGER = 5
+
+# El descubrimiento empieza rápido y se espacia mientras el conjunto de peers
+# no cambia; vuelve al mínimo ante cualquier cambio de topología
+DISCOVERY_MIN_INTERVAL = 1
+DISCOVERY_MAX_INTERVAL = 60
+PEER_CHECK_INTERVAL = 5
+
+# Reintentos de envío a un peer sano y a uno que no responde
+MAX_ATTEMPTS = 5
+SUSPECT_MAX_ATTEMPTS = 2
+
+# Una sesión de emisión sin envíos durante SESSION_IDLE segundos se cierra; el
+# receptor conserva la suya más tiempo para que nunca caduque antes
+SESSION_IDLE = 10
+SESSION_TTL = BODY_TTL
+
+# Reenvíos unicast simultáneos tras un broadcast, y espera mínima de ACKs
+FANOUT_PARALLELISM = 8
+FANOUT_MIN_WAIT = 0.1
+
+
+# Inventario compartido por las funciones de módulo
+_inventory = InterfaceInventory()
 
 
 def get_ip_and_mask():
-    try:
-        # Método para obtener IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-
-        # Detección de máscara 
-        if platform.system() == "Windows":
-            return get_windows_mask(local_ip)
-
-    except Exception:
+    """IP y máscara de la interfaz principal, desde el inventario en caché"""
+    interface = _inventory.primary()
+    if interface is None:
         return None, None
-
-
-def get_windows_mask(local_ip):
-    """Obtiene máscara en Windows usando ipconfig"""
-    try:
-        result = subprocess.run(
-            ["ipconfig"], capture_output=True, text=True, shell=True
-        )
-        output = result.stdout
-
-        # Buscar la interfaz con la IP local
-        for line in output.split("\n"):
-            if f"IPv4 Address. . . . . . . . . . . : {local_ip}" in line:
-                # La máscara 
-                mask_line = next(
-                    l
-                    for l in output.split("\n")[output.split("\n").index(line) :]
-                    if "Subnet Mask" in l
-                )
-                mask = re.search(r": (\d+\.\d+\.\d+\.\d+)", mask_line).group(1)
-                return local_ip, mask
-
-    except Exception:
-        pass
-    return local_ip, "255.255.255.0"  # Fallback
+    return interface.address, interface.netmask
 
 
 def calcular_broadcast(ip, mask):
@@ -60,371 +142,1259 @@ def calcular_broadcast(ip, mask):
     return None
 
 
-class LCPClient:
-    def __init__(self, user_id, max_history_size=100):
-        self.user_id = user_id.ljust(20)[:20].encode("utf-8")  
-        self.peers = {}  
-        self.running = True
-        self.message_history = []
-        self.max_history_size = (
-            max_history_size  
+class _UDPProtocol(asyncio.DatagramProtocol):
+    """Entrega cada datagrama recibido al motor LCP"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        try:
+            self.client._process_udp_packet(data, addr)
+        except Exception as e:
+            logger.error("Error en UDP listener: %s", e)
+
+    def error_received(self, exc):
+        logger.error("Error en UDP listener: %s", exc)
+
+
+class AsyncLCPClient:
+    """Motor LCP sobre asyncio
+
+    Un único event loop atiende el socket UDP, el servidor TCP de archivos y el
+    descubrimiento, en lugar de un hilo por conexión. Habla el mismo formato de
+    cable que LCP v1.0.
+    """
+
+    def __init__(
+        self,
+        user_id,
+        max_history_size=100,
+        port=9990,
+        peer_cache=None,
+        partial_dir=".lcp_partial",
+        file_streams=4,
+        compression="zlib",
+        file_digest=None,
+        max_transfers=8,
+        max_connections=32,
+        tcp_backlog=64,
+        progress_interval=0.5,
+        metrics=False,
+        metrics_port=None,
+        log_level=None,
+    ):
+        # Registro de eventos (lcp_logging): sin log_level se respeta la
+        # configuración de logging de la aplicación
+        if log_level is not None:
+            configure_logging(log_level)
+        self.user_id = user_id.ljust(20)[:20].encode("utf-8")
+        self.port = port
+        self.peers = PeerRegistry()
+        # Archivo donde se guardan los peers entre ejecuciones (opcional)
+        self.peer_cache = peer_cache
+        self.running = False
+        self.message_history = MessageHistory(max_history_size)
+        self.max_history_size = max_history_size
+
+        # Transacciones en vuelo, indexadas por (dirección, BodyId)
+        self._router = ResponseRouter()
+        # Los pares v1.0 no indican el BodyId en sus respuestas: con cada uno
+        # solo hay una transacción en vuelo a la vez, por dirección
+        self._legacy_locks = {}
+
+        # Cuerpos de mensaje pendientes tras ACKear su header, y cuerpos ya
+        # entregados cuyo ACK final pudo perderse, indexados por (addr, BodyId)
+        self._pending_bodies = {}
+        self._completed_bodies = {}
+        self._timers = TimerWheel()
+
+        # Envíos fragmentados en curso, por (addr, BodyId), y bytes reservados
+        # por los reensamblados entrantes
+        self._fragment_senders = {}
+        self._reassembly_bytes = 0
+
+        # Transferencias de archivo entrantes, indexadas por (IP remitente, FileId)
+        # Con max_transfers en curso, los headers de archivo nuevos se
+        # rechazan con status 2 y el emisor vuelve a intentarlo más tarde
+        # Progreso de los archivos entrantes y salientes, notificado a los
+        # callbacks de progreso como mucho cada progress_interval segundos
+        self.progress = ProgressTracker(self._notify_progress, progress_interval)
+        self.transfers = TransferRegistry(
+            self._timers, max_transfers=max_transfers, tracker=self.progress
         )
-        self.response_queue = queue.Queue()  
+        # Archivos recibidos a medias, para reanudarlos
+        self.partials = PartialStore(partial_dir)
+        # Conexiones TCP máximas para enviar un archivo grande por rangos
+        self.file_streams = file_streams
+        # Códec preferido para comprimir mensajes y archivos ("zlib", "bz2",
+        # "lzma" o None); solo se usa con peers que lo anuncian
+        self.compression = compression
+        # Digest de integridad para los archivos enviados ("blake2b", "sha256"
+        # o None); solo se usa con peers que lo soportan
+        self.file_digest = file_digest
+
+        # Sesiones de mensajes con peers que las soportan: emisoras por
+        # dirección y receptoras por (dirección, id de sesión)
+        self._sessions = {}
+        self._session_receivers = {}
+        self._acks_due = set()
+
+        self.interfaces = InterfaceInventory()
+
+        self._loop = None
+        self._udp_transport = None
+        self._tcp_server = None
+        # Conexiones TCP atendidas a la vez; las demás esperan con la lectura
+        # en pausa, y con tcp_backlog esperando se rechazan las siguientes
+        self.max_connections = max_connections
+        self.tcp_backlog = tcp_backlog
+        self._tcp_slots = None
+        self._tcp_queued = 0
+        self._tasks = set()
+
+        # Métricas del nodo; con metrics_port se sirven en formato Prometheus
+        # en http://127.0.0.1:<metrics_port>/metrics
+        self.metrics_port = metrics_port
+        self._metrics_server = None
+        self._init_metrics(metrics or metrics_port is not None)
 
         # Para manejar callbacks de mensajes
         try:
             from message_handler import MessageHandler
 
-            self.message_handler = MessageHandler()
+            self.message_handler = MessageHandler(self.metrics)
         except ImportError:
-            print("MessageHandler no disponible, operando sin callbacks")
+            logger.warning("MessageHandler no disponible, operando sin callbacks")
             self.message_handler = None
 
+    async def start(self):
+        """Abre los sockets y lanza las tareas de fondo en el loop actual"""
+        self._loop = asyncio.get_running_loop()
+        self._timers.start(self._loop)
+
         # Configurar sockets
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.udp_socket.bind(("0.0.0.0", 9990)) 
-        self.udp_socket.setsockopt(
-            socket.SOL_SOCKET, socket.SO_RCVBUF, 65507
-        )  
-
-        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.tcp_socket.bind(("0.0.0.0", 9990))
-        self.tcp_socket.listen(5)
-
-        
-        threading.Thread(target=self._udp_listener, daemon=True).start()
-        threading.Thread(target=self._tcp_listener, daemon=True).start()
-        threading.Thread(target=self._discovery_broadcast, daemon=True).start()
-
-    def _discovery_broadcast(self):
-        """Envía periódicamente paquetes Echo para descubrir usuarios"""
-        while self.running:
-            print("Enviando paquete de descubrimiento...")
-            header = self._build_header(operation=0, user_to=b"\xff" * 20)
-            ip, mask = get_ip_and_mask()
-            b = calcular_broadcast(ip, mask)
-            for i in b:
-                self.udp_socket.sendto(header, (i, 9990))  # Broadcast
-            print("Paquete de descubrimiento enviado.")
-            threading.Event().wait(5)  
-
-    def _udp_listener(self):
-        """Escucha mensajes UDP entrantes"""
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        udp_socket.bind(("0.0.0.0", self.port))
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        self._udp_transport, _ = await self._loop.create_datagram_endpoint(
+            lambda: _UDPProtocol(self), sock=udp_socket
+        )
+
+        tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp_socket.bind(("0.0.0.0", self.port))
+        self._tcp_slots = asyncio.Semaphore(self.max_connections)
+        self._tcp_server = await self._loop.create_server(
+            lambda: FileStream(self._serve_tcp_connection, FILE_READ_SIZE),
+            sock=tcp_socket,
+            # asyncio acepta como mucho backlog conexiones por evento: con 0
+            # no aceptaría ninguna
+            backlog=max(self.tcp_backlog, 1),
+        )
+
+        if self.metrics_port is not None:
+            self._metrics_server = await serve_metrics(
+                self.metrics, "127.0.0.1", self.metrics_port
+            )
+
+        self.running = True
+        if self.peer_cache:
+            self._probe_cached_peers()
+        self._spawn(self._discovery_broadcast())
+        self._spawn(self._peer_maintenance())
+
+    def _init_metrics(self, enabled):
+        """Crea el registro de métricas; desactivado, sus métricas no hacen nada"""
+        m = self.metrics = MetricsRegistry(enabled)
+        self._datagrams_in = m.counter(
+            "lcp_udp_datagrams_received_total", "Datagramas UDP recibidos"
+        )
+        self._bytes_in = m.counter(
+            "lcp_udp_bytes_received_total", "Bytes recibidos por UDP"
+        )
+        self._datagrams_out = m.counter(
+            "lcp_udp_datagrams_sent_total", "Datagramas UDP enviados"
+        )
+        self._bytes_out = m.counter(
+            "lcp_udp_bytes_sent_total", "Bytes enviados por UDP"
+        )
+        self._headers_in = m.counter(
+            "lcp_headers_received_total",
+            "Headers LCP recibidos por operación",
+            ("operation",),
+        )
+        self._ack_latency = m.histogram(
+            "lcp_ack_latency_seconds", "Tiempo desde un envío hasta su ACK"
+        )
+        self._exchange_attempts = m.histogram(
+            "lcp_exchange_attempts",
+            "Intentos por intercambio confirmado o abandonado",
+            buckets=range(1, MAX_ATTEMPTS + 1),
+        )
+        self._retransmissions = m.counter(
+            "lcp_retransmissions_total", "Datagramas reenviados sin ACK positivo"
+        )
+        self._timeouts = m.counter(
+            "lcp_ack_timeouts_total", "Esperas de ACK que agotaron el RTO"
+        )
+        self._discovery_probes = m.counter(
+            "lcp_discovery_probes_total", "Echos de descubrimiento por broadcast"
+        )
+        self._discovery_responses = m.counter(
+            "lcp_discovery_responses_total", "Respuestas a Echos recibidas"
+        )
+        self._messages_sent = m.counter(
+            "lcp_messages_sent_total", "Mensajes directos enviados", ("result",)
+        )
+        self._message_seconds = m.histogram(
+            "lcp_message_send_seconds", "Duración del envío de un mensaje directo"
+        )
+        self._broadcasts = m.counter(
+            "lcp_broadcasts_total", "Mensajes uno a muchos enviados", ("result",)
+        )
+        self._broadcast_peers = m.counter(
+            "lcp_broadcast_peers_total",
+            "Peers por resultado en los envíos uno a muchos",
+            ("outcome",),
+        )
+        self._broadcast_seconds = m.histogram(
+            "lcp_broadcast_seconds", "Duración de un envío uno a muchos"
+        )
+        self._files = m.counter(
+            "lcp_files_total", "Archivos transferidos", ("direction", "result")
+        )
+        self._file_bytes = m.counter(
+            "lcp_file_bytes_total", "Bytes de archivo transferidos", ("direction",)
+        )
+        self._file_seconds = m.histogram(
+            "lcp_file_transfer_seconds",
+            "Duración de una transferencia de archivo",
+            ("direction",),
+        )
+        m.gauge("lcp_peers", "Peers conocidos", fn=lambda: len(self.peers))
+        m.gauge(
+            "lcp_transfers_pending",
+            "Transferencias entrantes anunciadas o activas",
+            fn=lambda: len(self.transfers),
+        )
+        m.gauge(
+            "lcp_tcp_connections_waiting",
+            "Conexiones TCP esperando hueco",
+            fn=lambda: self._tcp_queued,
+        )
+
+    def metrics_snapshot(self):
+        """Valores actuales de las métricas (vacío si están desactivadas)"""
+        return self.metrics.snapshot()
+
+    def dump_events(self, n=None):
+        """Los últimos n eventos del protocolo (todos los guardados si n es None)"""
+        return dump_events(n)
+
+    def _spawn(self, coro):
+        """Lanza una tarea de fondo conservando una referencia hasta que termine"""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _transaction_lock(self, peer_id, addr):
+        """Turno para abrir una transacción con addr (solo con pares v1.0)"""
+        info = self.peers.info(peer_id)
+        if info is not None and info.caps is None:
+            return self._legacy_locks.setdefault(addr, asyncio.Lock())
+        return contextlib.nullcontext()
+
+    def _sendto(self, data, addr):
+        self._udp_transport.sendto(bytes(data), addr)
+        self._datagrams_out.inc()
+        self._bytes_out.inc(len(data))
+
+    async def _discovery_broadcast(self):
+        """Envía paquetes Echo para descubrir usuarios
+
+        El intervalo se duplica en cada ronda mientras no cambien ni los peers
+        ni las interfaces, y vuelve al mínimo en cuanto algo cambia.
+        """
+        interval = DISCOVERY_MIN_INTERVAL
+        topology = None
         while self.running:
             try:
-                data, addr = self.udp_socket.recvfrom(1024)
-                self._process_udp_packet(data, addr)
+                logger.debug("Enviando paquete de descubrimiento")
+                header = self._build_header(operation=0, user_to=b"\xff" * 20)
+                for i in await self._broadcast_addresses():
+                    self._sendto(header, (i, self.port))  # Broadcast
+                    self._discovery_probes.inc()
+                logger.debug("Paquete de descubrimiento enviado")
             except Exception as e:
-                print(f"Error en UDP listener: {e}")
+                logger.warning("Error en descubrimiento: %s", e)
+
+            # Esperar, pero despertar antes si la topología cambia
+            topology = (self.peers.version, self.interfaces.version)
+            waited = 0
+            while waited < interval and self.running:
+                await asyncio.sleep(DISCOVERY_MIN_INTERVAL)
+                waited += DISCOVERY_MIN_INTERVAL
+                if (self.peers.version, self.interfaces.version) != topology:
+                    break
+
+            if (self.peers.version, self.interfaces.version) != topology:
+                interval = DISCOVERY_MIN_INTERVAL
+            else:
+                interval = min(interval * 2, DISCOVERY_MAX_INTERVAL)
+
+    def _probe_cached_peers(self):
+        """Carga la caché de peers y los sondea a todos a la vez por unicast
 
-    def _tcp_listener(self):
-        """Escucha conexiones TCP entrantes (para archivos)"""
+        Los que respondan quedan vivos en milisegundos, sin esperar al
+        descubrimiento por broadcast; el resto los retira el mantenimiento.
+        """
+        cached = self.peers.load(self.peer_cache)
+        if not cached:
+            return
+        probe = self._build_header(operation=0, user_to=b"\xff" * 20)
+        for info in cached:
+            self._sendto(probe, info.addr)
+        logger.info("Sondeando %d peers de la caché", len(cached))
+
+    async def _peer_maintenance(self):
+        """Sondea por unicast a los peers callados y elimina los que no responden"""
+        probe = self._build_header(operation=0, user_to=b"\xff" * 20)
         while self.running:
-            try:
-                conn, addr = self.tcp_socket.accept()
-                threading.Thread(
-                    target=self._handle_tcp_connection, args=(conn, addr)
-                ).start()
-            except Exception as e:
-                print(f"Error en TCP listener: {e}")
+            await asyncio.sleep(PEER_CHECK_INTERVAL)
+            to_probe, removed = self.peers.sweep()
+            for info in to_probe:
+                self._sendto(probe, info.addr)
+            for info in removed:
+                logger.info("Peer %s no responde, eliminado de la lista", info.peer_id)
+
+    async def _broadcast_addresses(self):
+        """Direcciones broadcast de todas las subredes; solo re-enumera si toca"""
+        if self.interfaces.stale():
+            await self._loop.run_in_executor(None, self.interfaces.refresh)
+        return self.interfaces.broadcast_addresses()
 
     def normalizar(self, name):
         return name.strip().rstrip("\x00")
 
     def _process_udp_packet(self, data, addr):
         """Procesa un paquete UDP recibido"""
+        self._datagrams_in.inc()
+        self._bytes_in.inc(len(data))
+        self.peers.seen(addr)
+
+        # Un cuerpo empieza con el BodyId de un header ya ACKeado
+        if len(data) >= 8:
+            key = (addr, int.from_bytes(data[:8], "big"))
+            pending = self._pending_bodies.get(key)
+            if pending is not None and pending["reassembly"] is not None:
+                self._process_fragment(pending, data, addr)
+                return
+            if pending is not None:
+                del self._pending_bodies[key]
+                self._timers.cancel(("body",) + key)
+                self._process_message_body(pending, data, addr)
+                return
+            if key in self._completed_bodies:
+                # Retransmisión: el ACK final se perdió, se repite sin reentregar
+                self._sendto(self._completed_bodies[key], addr)
+                return
+
         if len(data) == 25:
-            print("respuesta recibido")
-            self.response_queue.put(data)
+            ack = session_ack(data)
+            if ack is not None:
+                session = self._sessions.get(addr)
+                if session is not None:
+                    session.on_ack(*ack)
+                return
+            ack = fragment_ack(data)
+            if ack is not None:
+                sender = self._fragment_senders.get((addr, ack[0]))
+                if sender is not None:
+                    sender.on_ack(ack[1])
+                return
+            if not self._router.dispatch(addr, data):
+                self._process_unsolicited_response(data, addr)
             return
 
         if len(data) >= 8 and len(data) < 100:
-            print(f"Posible cuerpo de mensaje recibido ({len(data)} bytes)")
+            logger.debug("Posible cuerpo de mensaje recibido (%d bytes)", len(data))
             return
 
         if len(data) < 100:
-            print("Paquete recibido es corto, pero procesando como mensaje.")
+            logger.debug("Paquete recibido es corto, pero procesando como mensaje")
 
         user_from = data[:20].strip(b"\x00")
         user_to = data[20:40]
         operation = data[40]
+        self._headers_in.labels(str(operation)).inc()
 
-        print(
-            f"Paquete recibido de {user_from.decode('utf-8')} con operación {operation}"
-        )
+        logger.debug("Paquete recibido de %s con operación %d", user_from, operation)
 
         if operation == 0:  # Echo (descubrimiento)
             if user_from != self.user_id.strip(b"\x00"):
-                # Responder con nuestro ID
-                response = self._build_response(status=0)
-                self.udp_socket.sendto(response, addr)
-                print(f"Respondido a {user_from.decode('utf-8')} con nuestro ID.")
+                # Responder con nuestro ID y capacidades
+                response = set_response_caps(self._build_response(status=0))
+                self._sendto(response, addr)
+                logger.debug("Respondido a %s con nuestro ID", user_from)
 
                 # Actualizar lista de peers
                 peer_id = user_from.decode("utf-8")
-                self.peers[self.normalizar(peer_id)] = (addr[0], 9990)
-                print(f"Descubierto par: {peer_id} en {addr}")
+                if self.peers.touch(self.normalizar(peer_id), addr):
+                    logger.info("Descubierto par: %s en %s", peer_id, addr)
+                self.peers.set_caps(self.normalizar(peer_id), header_caps(data))
 
         elif operation == 1:  # Mensaje
             if user_to == b"\xff" * 20 or user_to == self.user_id:
                 if user_from == self.user_id.strip(b"\x00"):
-                    print("Ignorando mensaje propio")
+                    logger.debug("Ignorando mensaje propio")
+                    return
+
+                if header_flags(data) & HDR_SESSION:
+                    self._process_session_message(data, addr, user_from, user_to)
                     return
 
                 # Obtener body_id y body_length del header
                 body_id = data[41]
                 body_length = int.from_bytes(data[42:50], "big")
+                key = (addr, body_id)
 
-                # Enviar respuesta OK
-                response = self._build_response(0)  # 0 = OK
-                self.udp_socket.sendto(response, addr)
-                print(f"ACK enviado para mensaje de {user_from.decode('utf-8')}")
-
-                # Esperar el cuerpo del mensaje con timeout
-                try:
-                    original_timeout = self.udp_socket.gettimeout()
-                    self.udp_socket.settimeout(5)  
-
-                    body_data, body_addr = self.udp_socket.recvfrom(65507)
-                    if len(body_data) >= 8:
-                        received_body_id = int.from_bytes(body_data[:8], "big")
-                        message = body_data[8:].decode("utf-8", errors="replace")
+                codec = header_compression(data)
+                if codec is not None and codec_for(codec) is None:
+                    logger.warning(
+                        "Mensaje comprimido con un códec desconocido (%#x)", codec
+                    )
+                    self._sendto(self._build_response(2, body_id=body_id), addr)
+                    return
 
-                        # Verificar que el ID del cuerpo coincide con el esperado
-                        print(
-                            f"Body ID recibido: {received_body_id}, esperado: {body_id}"
+                reassembly = None
+                previous = self._pending_bodies.get(key)
+                if header_flags(data) & HDR_FRAGMENTED:
+                    if previous is not None and previous["reassembly"] is not None:
+                        # Header repetido: el buffer ya está reservado
+                        reassembly = previous["reassembly"]
+                    elif not self._reserve_reassembly(body_length):
+                        logger.warning(
+                            "Sin memoria para un mensaje de %d bytes de %s, rechazado",
+                            body_length,
+                            user_from.decode("utf-8", errors="replace"),
                         )
-
-                        # Enviar confirmación final
-                        final_response = self._build_response(0)
-                        self.udp_socket.sendto(final_response, addr)
-
-                        # Procesamos el mensaje según si es broadcast o directo
-                        sender_id = self.normalizar(user_from.decode("utf-8"))
-                        timestamp = datetime.now()
-                        is_broadcast = user_to == b"\xff" * 20
-
-                        # Para mensajes normales (no broadcast), guardamos en el historial
-                        if not is_broadcast:
-                            self.add_to_message_history(sender_id, message, timestamp)
-                            print(f"Mensaje directo recibido de {sender_id}: {message}")
-                        else:
-                            print(f"Broadcast recibido de {sender_id}: {message}")
-
-                        # Notificar a los callbacks si hay un message_handler
-                        if hasattr(self, "message_handler") and self.message_handler:
-                            if is_broadcast:
-                                print(f"Notificando mensaje BROADCAST: {message}")
-                                self.message_handler.notify_message(
-                                    "Broadcast", message
-                                )
-                            else:
-                                # Mensaje directo normal
-                                self.message_handler.notify_message(sender_id, message)
+                        self._sendto(self._build_response(2, body_id=body_id), addr)
+                        return
                     else:
-                        print(
-                            f"Datos de cuerpo recibidos con formato incorrecto ({len(body_data)} bytes)"
-                        )
+                        reassembly = Reassembly(body_length)
+                elif previous is not None:
+                    self._release_reassembly(previous)
 
-                except socket.timeout:
-                    print(
-                        f"Timeout esperando cuerpo del mensaje de {user_from.decode('utf-8')}"
-                    )
-
-                except Exception as e:
-                    print(f"Error recibiendo cuerpo del mensaje: {e}")
+                # Enviar respuesta OK
+                response = self._build_response(0, body_id=body_id)  # 0 = OK
+                self._sendto(response, addr)
+                logger.debug("ACK enviado para mensaje de %s", user_from)
 
-                finally:
-                    # Restaurar timeout original
-                    self.udp_socket.settimeout(original_timeout)
+                # Esperar el cuerpo del mensaje sin bloquear el listener
+                self._pending_bodies[key] = {
+                    "addr": addr,
+                    "user_from": user_from,
+                    "user_to": user_to,
+                    "body_id": body_id,
+                    "body_length": body_length,
+                    "reassembly": reassembly,
+                    "codec": codec,
+                }
+                self._timers.schedule(
+                    ("body",) + key,
+                    REASSEMBLY_TIMEOUT if reassembly else BODY_TTL,
+                    self._expire_pending_body,
+                    key,
+                )
 
         elif operation == 2:  # Transferencia de archivo
             if user_to == b"\xff" * 20 or user_to == self.user_id:
                 file_id = data[41]
                 file_length = int.from_bytes(data[42:50], "big")
-                self.file = {
-                    "file_length": file_length,
-                    "file_id": file_id,
-                    "user_from": user_from,
-                }
+                codec = header_compression(data)
+                if codec is not None and codec_for(codec) is None:
+                    logger.warning(
+                        "Archivo comprimido con un códec desconocido (%#x)", codec
+                    )
+                    self._sendto(self._build_response(2, body_id=file_id), addr)
+                    return
+                digest = header_digest(data)
+                if digest is not None and new_digest(digest) is None:
+                    logger.warning("Archivo con un digest desconocido (%d)", digest)
+                    self._sendto(self._build_response(2, body_id=file_id), addr)
+                    return
+                transfer = self.transfers.announce(
+                    addr[0],
+                    file_id,
+                    file_length,
+                    user_from,
+                    header_transfer_key(data),
+                    bool(header_flags(data) & HDR_STRIPED),
+                    codec,
+                    digest,
+                )
+                if transfer is None:
+                    logger.warning(
+                        "Demasiadas transferencias en curso: rechazando archivo de %s",
+                        addr,
+                    )
+                    self._sendto(self._build_response(2, body_id=file_id), addr)
+                    return
+                self._sendto(self._build_response(0, body_id=file_id), addr)
+
+    def _process_unsolicited_response(self, data, addr):
+        """Una respuesta que ninguna transacción espera: respuesta a un Echo"""
+        peer_id = self.normalizar(data[1:21].decode("utf-8", errors="replace"))
+        if data[0] != 0 or not peer_id or data[1:21] == self.user_id:
+            return
+        self._discovery_responses.inc()
+        if self.peers.touch(peer_id, addr):
+            logger.info("Descubierto par: %s en %s", peer_id, addr)
+        caps = response_caps(data)
+        if caps is not None or not data[22]:
+            self.peers.set_caps(peer_id, caps)
+
+    def _process_session_message(self, data, addr, user_from, user_to):
+        """Mensaje de sesión: header y cuerpo en un datagrama, entrega en orden"""
+        session_id, seq = session_fields(data)
+        key = (addr, session_id)
+        receiver = self._session_receivers.get(key)
+        if receiver is None:
+            receiver = self._session_receivers[key] = SessionReceiver()
+        self._timers.schedule(
+            ("session",) + key, SESSION_TTL, self._session_receivers.pop, key, None
+        )
+
+        body = (bytes(data[100:]), header_compression(data))
+        for message in receiver.receive(seq, body):
+            message = self._message_text(*message)
+            if message is not None:
+                self._deliver_message(user_from, user_to, message)
+
+        # Un único ACK acumulado por sesión y vuelta del loop
+        if key not in self._acks_due:
+            self._acks_due.add(key)
+            self._loop.call_soon(self._send_session_ack, key)
+
+    def _send_session_ack(self, key):
+        self._acks_due.discard(key)
+        receiver = self._session_receivers.get(key)
+        if receiver is None:
+            return
+        response = self._build_response(0)
+        set_session_ack(response, key[1], receiver.acked)
+        self._sendto(response, key[0])
+
+    def _expire_pending_body(self, key):
+        """Descarta un cuerpo de mensaje que no llegó a tiempo"""
+        pending = self._pending_bodies.pop(key, None)
+        if pending is not None:
+            self._release_reassembly(pending)
+            logger.warning(
+                "Timeout esperando cuerpo del mensaje de %s",
+                pending["user_from"].decode("utf-8", errors="replace"),
+            )
+
+    def _reserve_reassembly(self, length):
+        """Reserva memoria para reensamblar un cuerpo; False si no cabe"""
+        if length > MAX_MESSAGE_SIZE:
+            return False
+        if self._reassembly_bytes + length > REASSEMBLY_BUDGET:
+            return False
+        self._reassembly_bytes += length
+        return True
+
+    def _release_reassembly(self, pending):
+        if pending["reassembly"] is not None:
+            self._reassembly_bytes -= pending["reassembly"].length
+            pending["reassembly"] = None
+
+    def _process_fragment(self, pending, data, addr):
+        """Guarda un fragmento de cuerpo y lo confirma
+
+        Entrega el mensaje cuando se completa.
+        """
+        key = (addr, pending["body_id"])
+        reassembly = pending["reassembly"]
+        if len(data) < FRAGMENT_PREFIX:
+            return
+        index, count, payload = parse_fragment(data)
+        if not reassembly.add(index, count, payload):
+            logger.debug(
+                "Fragmento %d/%d inválido de %s, descartado", index, count, addr
+            )
+            return
+        self._sendto(
+            set_fragment_ack(self._build_response(0), pending["body_id"], index), addr
+        )
+
+        if not reassembly.complete:
+            self._timers.schedule(
+                ("body",) + key, REASSEMBLY_TIMEOUT, self._expire_pending_body, key
+            )
+            return
+
+        del self._pending_bodies[key]
+        self._timers.cancel(("body",) + key)
+        message = self._message_text(reassembly.data(), pending["codec"])
+        self._release_reassembly(pending)
+        if message is None:
+            self._sendto(self._build_response(1, body_id=pending["body_id"]), addr)
+            return
+        logger.debug(
+            "Mensaje de %d fragmentos reensamblado (%d caracteres)", count, len(message)
+        )
+        self._complete_message(pending, message, addr)
+
+    def _complete_message(self, pending, message, addr):
+        """Envía la confirmación final de un cuerpo y entrega el mensaje"""
+        final_response = self._build_response(0, body_id=pending["body_id"])
+        self._sendto(final_response, addr)
+        key = (addr, pending["body_id"])
+        self._completed_bodies[key] = final_response
+        self._timers.schedule(
+            ("done",) + key, BODY_TTL, self._completed_bodies.pop, key, None
+        )
+
+        self._deliver_message(pending["user_from"], pending["user_to"], message)
+
+    def _process_message_body(self, pending, body_data, addr):
+        """Procesa el cuerpo de un mensaje cuyo header ya fue confirmado"""
+        try:
+            if len(body_data) >= 8:
+                received_body_id = int.from_bytes(body_data[:8], "big")
+                message = self._message_text(body_data[8:], pending["codec"])
+                if message is None:
+                    response = self._build_response(1, body_id=pending["body_id"])
+                    self._sendto(response, addr)
+                    return
+
+                # Verificar que el ID del cuerpo coincide con el esperado
+                logger.debug(
+                    "Body ID recibido: %d, esperado: %d",
+                    received_body_id,
+                    pending["body_id"],
+                )
+
+                # Enviar confirmación final
+                self._complete_message(pending, message, addr)
+            else:
+                logger.warning(
+                    "Datos de cuerpo recibidos con formato incorrecto (%d bytes)",
+                    len(body_data),
+                )
+        except Exception as e:
+            logger.error("Error recibiendo cuerpo del mensaje: %s", e)
+
+    def _message_text(self, body, codec):
+        """Texto de un cuerpo de mensaje, descomprimido si hace falta, o None"""
+        if codec is not None:
+            try:
+                body = codec_for(codec).decompress(body, MAX_MESSAGE_SIZE)
+            except Exception as e:
+                logger.warning("Cuerpo de mensaje comprimido inválido: %s", e)
+                return None
+        return body.decode("utf-8", errors="replace")
+
+    def _deliver_message(self, user_from, user_to, message):
+        """Registra un mensaje recibido y avisa a los callbacks"""
+        # Procesamos el mensaje según si es broadcast o directo
+        sender_id = self.normalizar(user_from.decode("utf-8"))
+        timestamp = datetime.now()
+        is_broadcast = user_to == b"\xff" * 20
+
+        if not is_broadcast:
+            self.add_to_message_history(sender_id, message, timestamp)
+            logger.debug("Mensaje directo recibido de %s", sender_id)
+        else:
+            self.add_to_message_history(
+                "Broadcast", message, timestamp, sender_id, "broadcast"
+            )
+            logger.debug("Broadcast recibido de %s", sender_id)
+
+        # Notificar a los callbacks si hay un message_handler
+        if self.message_handler:
+            if is_broadcast:
+                self.message_handler.notify_message("Broadcast", message)
+            else:
+                # Mensaje directo normal
+                self.message_handler.notify_message(sender_id, message)
+
+    async def _serve_tcp_connection(self, stream):
+        """Atiende una conexión TCP cuando hay hueco entre las max_connections
+
+        Mientras espera, la lectura sigue en pausa y el control de flujo de
+        TCP frena al emisor. Si ya hay tcp_backlog esperando, se rechaza con
+        status 2.
+        """
+        if self._tcp_slots.locked() and self._tcp_queued >= self.tcp_backlog:
+            logger.warning(
+                "Demasiadas conexiones TCP: rechazando %s",
+                stream.get_extra_info("peername"),
+            )
+            await self._refuse_tcp_connection(stream)
+            return
+        self._tcp_queued += 1
+        try:
+            await self._tcp_slots.acquire()
+        finally:
+            self._tcp_queued -= 1
+        try:
+            await self._handle_tcp_connection(stream)
+        finally:
+            self._tcp_slots.release()
 
-    def _handle_tcp_connection(self, conn, addr):
+    async def _refuse_tcp_connection(self, stream):
+        """Rechaza una conexión con status 2 de modo que el emisor lo reciba
+
+        Lee el FileId para liberar el anuncio de la transferencia, responde,
+        cierra la escritura y descarta lo que siga llegando hasta que el
+        emisor cierre o pasen REFUSE_LINGER segundos.
+        """
+        addr = stream.get_extra_info("peername")
+        try:
+            file_id = await asyncio.wait_for(stream.readexactly(8), REFUSE_LINGER)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+            stream.close()
+            return
+        transfer = self.transfers.withdraw(addr[0], int.from_bytes(file_id, "big"))
+        await self._refuse_transfer(stream, transfer)
+
+    async def _refuse_transfer(self, stream, transfer):
+        """Responde status 2 (o la oferta "ocupado") a una conexión ya identificada"""
+        try:
+            if transfer is not None and transfer.resume_key is not None:
+                # El emisor de un archivo reanudable espera una oferta
+                stream.write(encode_busy_offer())
+            else:
+                stream.write(self._build_response(status=2))
+            await stream.drain()
+            stream.write_eof()
+            await asyncio.wait_for(
+                stream.receive_into(lambda view: None, 1 << 62), REFUSE_LINGER
+            )
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            stream.close()
+
+    async def _handle_tcp_connection(self, stream):
         """Maneja una conexión TCP entrante (para archivos)"""
+        addr = stream.get_extra_info("peername")
         try:
             # Recibir los primeros 8 bytes (ID del archivo)
-            file_id = conn.recv(8)
-            if not file_id:
-                print("No se recibió ID del archivo.")
+            try:
+                file_id = await stream.readexactly(8)
+            except asyncio.IncompleteReadError:
+                logger.warning("No se recibió ID del archivo")
                 return
 
-            # Confirmar que el ID del archivo coincide
-            print(file_id)
-            print(self.file["file_id"].to_bytes(8, "big"))
-            if file_id != self.file["file_id"].to_bytes(8, "big"):
-                print("ID de archivo no coincide.")
+            # Confirmar que el ID del archivo corresponde a un header anunciado
+            transfer = await self.transfers.claim(
+                addr[0], int.from_bytes(file_id, "big"), self._loop
+            )
+            if transfer is None:
+                logger.warning("ID de archivo no coincide")
                 return
+            if transfer.state == "refused":
+                # Se rechazó otra conexión de rangos: el emisor reintentará
+                await self._refuse_transfer(stream, transfer)
+                return
+            if transfer.striped:
+                # Al expirar, sink.abort cierra todas las conexiones de rangos
+                await self._receive_striped(stream, transfer)
+                return
+            transfer.on_expire = stream.close
 
             # Recibir el resto del archivo
+            file_length = transfer.file_length
+            filename = f"temp_file{time.time()}.dat"
             bythes_recibidos = 0
-            with open(f"temp_file{time.time()}.dat", "wb") as f:
-                while bythes_recibidos < self.file["file_length"]:
-                    restantes = self.file["file_length"] - bythes_recibidos
-                    chunk_size = min(restantes, 65507)
-
-                    data = conn.recv(chunk_size)
-                    if not data:
-                        print(
-                            "Conexión cerrada antes de completar la recepción del archivo."
+            verified = False
+            partial = fd = None
+            try:
+                if transfer.resume_key is not None:
+                    partial = self.partials.acquire(
+                        transfer.user_from.hex(), transfer.resume_key, file_length
+                    )
+                    if partial is None:
+                        logger.warning(
+                            "La transferencia ya está en curso en otra conexión"
                         )
-                        break
-
-                    f.write(data)
-                    bythes_recibidos += len(data)
+                        stream.write(encode_busy_offer())
+                        await stream.drain()
+                        return
+                    # Ofrecer lo que ya tenemos; el emisor elige desde dónde seguir
+                    stream.write(partial.offer())
+                    await stream.drain()
+                    start = int.from_bytes(await stream.readexactly(8), "big")
+                    if start > partial.offset:
+                        logger.warning("Offset de reanudación inválido: %d", start)
+                        return
+                    bythes_recibidos = partial.open(start)
+                    if start:
+                        logger.info(
+                            "Reanudando archivo de %s desde el byte %d", addr, start
+                        )
+                else:
+                    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                    fd = os.open(filename, flags | getattr(os, "O_BINARY", 0), 0o666)
+                    preallocate(fd, file_length)
+
+                self.transfers.resume(transfer, bythes_recibidos)
+                received, verified = await self._receive_content(
+                    stream,
+                    transfer,
+                    file_length - bythes_recibidos,
+                    fd=fd,
+                    partial=partial,
+                )
+                bythes_recibidos += received
+                if bythes_recibidos < file_length:
+                    logger.warning(
+                        "Conexión cerrada antes de completar la recepción del archivo"
+                    )
+            finally:
+                corrupt = bythes_recibidos == file_length and not verified
+                complete = bythes_recibidos == file_length and verified
+                self.transfers.finish(transfer, complete)
+                if partial is not None:
+                    if complete:
+                        partial.complete(filename)
+                    else:
+                        if corrupt:
+                            partial.reset()
+                        # Se conserva lo recibido para reanudar
+                        partial.save()
+                        partial.close()
+                elif fd is not None:
+                    if not complete:
+                        # Sin el espacio reservado que no llegó a escribirse
+                        os.ftruncate(fd, bythes_recibidos)
+                    os.close(fd)
+                    if corrupt:
+                        os.remove(filename)
 
             # Verificar si se recibió el archivo completo
-            if bythes_recibidos == self.file["file_length"]:
-                print(
-                    f"\nArchivo recibido de {addr}: guardado como temp_file{time.time()}.dat"
-                )
+            if complete:
+                logger.info("Archivo recibido de %s: guardado como %s", addr, filename)
                 # Enviar confirmación
                 response = self._build_response(status=0)
-                conn.send(response)
+            elif corrupt:
+                logger.error("El digest del archivo de %s no coincide", addr)
+                response = self._build_response(status=1)
             else:
-                print("Error: archivo recibido incompleto.")
-                response = self._build_response(status=1) 
-                conn.send(response)
+                logger.error("Archivo recibido incompleto")
+                response = self._build_response(status=1)
+            stream.write(response)
+            await stream.drain()
         except Exception as e:
-            print(f"Error handling TCP connection: {e}")
+            logger.error("Error handling TCP connection: %s", e)
         finally:
-            conn.close()
+            stream.close()
 
-    def send_message(self, peer_id, message):
+    async def _receive_striped(self, stream, transfer):
+        """Recibe rangos de un archivo en paralelo con otras conexiones"""
+        if transfer.sink is None:
+            transfer.sink = StripedFile(
+                f"temp_file{time.time()}.dat", transfer.file_length
+            )
+            transfer.on_expire = transfer.sink.abort
+        sink = transfer.sink
+        sink.add_writer(stream)
+        try:
+            while transfer.state == "active":
+                try:
+                    offset, length = decode_range(await stream.readexactly(16))
+                except asyncio.IncompleteReadError:
+                    logger.warning("Conexión de rangos cerrada sin marca de fin")
+                    return
+                if length == 0:
+                    return
+                if offset + length > sink.length:
+                    logger.warning("Rango fuera del archivo: %d+%d", offset, length)
+                    stream.write(self._build_response(status=1))
+                    return
+
+                received, verified = await self._receive_content(
+                    stream, transfer, length, fd=sink.fileno(), offset=offset
+                )
+                if received < length:
+                    logger.warning("Conexión cerrada a mitad de un rango")
+                    return
+                if not verified:
+                    # El emisor volverá a enviar el rango
+                    logger.warning("Digest del rango %d+%d no coincide", offset, length)
+                    stream.write(self._build_response(status=1))
+                    await stream.drain()
+                    continue
+
+                sink.range_done(offset, length)
+                stream.write(self._build_response(status=0))
+                await stream.drain()
+                if sink.complete and transfer.state == "active":
+                    sink.close()
+                    self.transfers.finish(transfer, True)
+                    logger.info(
+                        "Archivo recibido por rangos de %s: guardado como %s",
+                        transfer.sender,
+                        sink.path,
+                    )
+        finally:
+            sink.remove_writer(stream)
+
+    async def _receive_content(
+        self, stream, transfer, count, fd=None, offset=0, partial=None
+    ):
+        """Recibe count bytes del archivo y los escribe en fd desde offset o en partial
+
+        Si el archivo llega comprimido, cada bloque se descomprime al llegar;
+        los que vienen sin comprimir van directos al destino. Si lleva digest,
+        se calcula sobre la marcha y se compara con el que envía el emisor al
+        final. Devuelve (bytes recibidos, digest correcto o no requerido).
+        """
+        position = [offset]
+        digest = new_digest(transfer.digest) if transfer.digest is not None else None
+
+        def progress(n):
+            self.transfers.touch(transfer, n)
+
+        if partial is not None:
+            # Los CRC de cada bloque se calculan sobre los datos recibidos
+            def write(data):
+                if digest is not None:
+                    digest.update(data)
+                partial.write(data)
+                progress(len(data))
+
+        else:
+
+            def write(data):
+                if digest is not None:
+                    digest.update(data)
+                pwrite_all(fd, data, position[0])
+                position[0] += len(data)
+                progress(len(data))
+
+        async def receive_raw(n):
+            if partial is not None or digest is not None:
+                return await stream.receive_into(write, n)
+            # Sin nada que calcular, del socket al archivo directamente
+            received = await stream.receive_to_fd(fd, position[0], n, progress)
+            position[0] += received
+            return received
+
+        if transfer.codec is None:
+            received = await receive_raw(count)
+        else:
+            received = await receive_blocks(
+                stream, codec_for(transfer.codec), count, write, receive_raw
+            )
+        if digest is None or received < count:
+            return received, digest is None
+        try:
+            expected = await stream.readexactly(DIGEST_SIZE)
+        except asyncio.IncompleteReadError:
+            return received, False
+        return received, expected == digest.digest()
+
+    def transfer_stats(self):
+        """Contadores de las transferencias entrantes
+
+        Anunciadas, activas, completadas, fallidas, expiradas y rechazadas.
+        """
+        return self.transfers.stats()
+
+    async def send_message(self, peer_id, message):
         """Envía un mensaje a un peer específico con reintentos"""
-        print(f"Intentando enviar mensaje a {peer_id}: {message}")
+        started = time.monotonic()
+        sent = await self._send_message(peer_id, message)
+        self._messages_sent.labels("ok" if sent else "failed").inc()
+        self._message_seconds.observe(time.monotonic() - started)
+        return sent
+
+    async def _send_message(self, peer_id, message):
+        logger.debug("Intentando enviar mensaje a %s", peer_id)
         normalized_peer_id = self.normalizar(peer_id)
         if normalized_peer_id not in self.peers:
-            print(f"Peer {peer_id} no encontrado")
+            logger.warning("Peer %s no encontrado", peer_id)
             return False
 
-        body_id = int(time.time() * 1000) % 256
-        print(f"ID del cuerpo del mensaje generado: {body_id}")
+        addr = self.peers[normalized_peer_id]
+        # A un peer que no responde se le dan menos oportunidades
+        info = self.peers.info(normalized_peer_id)
+        max_attempts = SUSPECT_MAX_ATTEMPTS if info.state != "alive" else MAX_ATTEMPTS
+        body, codec = self._encode_body(message, info.caps)
+
+        if (
+            info.caps is not None
+            and info.caps & CAP_SESSION
+            and len(body) <= FRAGMENT_PAYLOAD
+        ):
+            sent = await self._send_session_message(
+                normalized_peer_id, message, body, codec, addr, max_attempts
+            )
+            if not sent:
+                self.peers.mark_failed(normalized_peer_id)
+            return sent
 
+        body_id = self._router.allocate(addr, int(time.time() * 1000))
+        logger.debug("ID del cuerpo del mensaje generado: %d", body_id)
+        try:
+            async with self._transaction_lock(normalized_peer_id, addr):
+                sent = await self._send_message_transaction(
+                    peer_id, message, body, codec, addr, body_id, max_attempts
+                )
+        finally:
+            self._router.release(addr, body_id)
+        if not sent:
+            self.peers.mark_failed(normalized_peer_id)
+        return sent
+
+    def _encode_body(self, message, peer_caps):
+        """Cuerpo de un mensaje y su códec (CAP_*), o None si no va comprimido"""
+        body = message.encode("utf-8")
+        codec = choose_codec(self.compression, peer_caps)
+        packed = compress_message(codec, body)
+        if packed is None:
+            return body, None
+        return packed, codec.cap
+
+    async def send_messages(self, peer_id, messages):
+        """Envía varios mensajes a un peer a la vez; devuelve un bool por mensaje
+
+        Con un peer que soporta sesiones los mensajes viajan en ventana y
+        llegan en orden; con uno v1.0 cada uno es una transacción propia.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.send_message(peer_id, message) for message in messages)
+            )
+        )
+
+    async def _send_message_session(self, peer_id, addr, max_attempts):
+        """Sesión de emisión abierta con addr, creándola si hace falta"""
+        session = self._sessions.get(addr)
+        if session is None or session.closed:
+            header = self._build_header(
+                operation=1, user_to=peer_id.ljust(20)[:20].encode("utf-8")
+            )
+            session = SessionSender(
+                self._loop,
+                self._sendto,
+                addr,
+                header,
+                rto=lambda: self.peers.rto(peer_id),
+                on_rtt=lambda sample: self.peers.record_rtt(peer_id, sample),
+                max_retries=max_attempts,
+            )
+            self._sessions[addr] = session
+            logger.info(
+                "Sesión %08x abierta con %s en %s", session.session_id, peer_id, addr
+            )
+        self._timers.schedule(
+            ("session_tx", addr), SESSION_IDLE, self._close_session, addr
+        )
+        return session
+
+    def _close_session(self, addr):
+        session = self._sessions.get(addr)
+        if session is None:
+            return
+        if session.in_flight:
+            # Sigue en uso: se revisa más tarde
+            self._timers.schedule(
+                ("session_tx", addr), SESSION_IDLE, self._close_session, addr
+            )
+            return
+        del self._sessions[addr]
+        session.close()
+
+    async def _send_session_message(
+        self, peer_id, message, body, codec, addr, max_attempts
+    ):
+        """Envía un mensaje por la sesión con el peer, sin esperar turno"""
+        session = await self._send_message_session(peer_id, addr, max_attempts)
+        if not await session.send(body, codec):
+            if self._sessions.get(addr) is session:
+                del self._sessions[addr]
+            logger.warning("Fallo enviando mensaje por sesión a %s", peer_id)
+            return False
+        self.add_to_message_history(
+            peer_id,
+            message,
+            datetime.now(),
+            self.user_id.decode("utf-8").strip(),
+            "sent",
+        )
+        return True
+
+    async def _send_message_transaction(
+        self, peer_id, message, message_bytes, codec, addr, body_id, max_attempts
+    ):
+        """Ejecuta las dos fases de Message-Response con un BodyId reservado
+
+        message_bytes es el cuerpo tal como viaja: comprimido si codec no es None.
+        """
         # Construir header
-        message_bytes = message.encode("utf-8")
+        peer_caps = self.peers.info(self.normalizar(peer_id)).caps or 0
+        # Lo que no cabe en una trama se fragmenta si el peer lo soporta
+        fragmented = (
+            peer_caps & CAP_FRAGMENT and len(message_bytes) > FRAGMENT_PAYLOAD
+        )
+        if not fragmented and len(message_bytes) > MAX_DATAGRAM_BODY:
+            logger.warning(
+                "Mensaje de %d bytes demasiado grande para %s",
+                len(message_bytes),
+                peer_id,
+            )
+            return False
         header = self._build_header(
             operation=1,
             user_to=peer_id.ljust(20)[:20].encode("utf-8"),
             body_id=body_id,
             body_length=len(message_bytes),
+            flags=HDR_FRAGMENTED if fragmented else 0,
         )
-
-        addr = self.peers[normalized_peer_id]
-        print(f"Enviando mensaje a {peer_id} en {addr}")
+        if codec is not None:
+            set_compression(header, codec)
+        logger.debug("Enviando mensaje a %s en %s", peer_id, addr)
+        peer_id = self.normalizar(peer_id)
 
         # Paso 1: Envío de header y espera de ACK con reintentos
-        header_sent = False
-        max_attempts = 5
+        if not await self._exchange(
+            peer_id, addr, body_id, header, max_attempts, "FASE 1"
+        ):
+            logger.warning(
+                "Fallo después de %d intentos de enviar header", max_attempts
+            )
+            return False
+        logger.debug("ACK recibido, procediendo a enviar cuerpo del mensaje")
 
-        # Limpiar cualquier respuesta antigua en la cola
-        while not self.response_queue.empty():
-            try:
-                self.response_queue.get_nowait()
-            except queue.Empty:
-                break
+        # Paso 2: Envío de cuerpo y espera de confirmación final con reintentos
+        if fragmented:
+            sent = await self._send_fragments(
+                peer_id, addr, body_id, message_bytes, max_attempts
+            )
+        else:
+            body = body_id.to_bytes(8, "big") + message_bytes
+            sent = await self._exchange(
+                peer_id, addr, body_id, body, max_attempts, "FASE 2"
+            )
+        if not sent:
+            logger.warning(
+                "Fallo después de %d intentos de enviar mensaje completo", max_attempts
+            )
+            return False
 
+        logger.debug("Confirmación final recibida, mensaje enviado con éxito")
+        self.add_to_message_history(
+            peer_id,
+            message,
+            datetime.now(),
+            self.user_id.decode("utf-8").strip(),
+            "sent",
+        )
+        return True
+
+    async def _send_fragments(self, peer_id, addr, body_id, payload, max_attempts):
+        """Envía un cuerpo en fragmentos y espera la confirmación final"""
+        final_ack = self._router.expect(addr, body_id, self._loop)
+        sender = FragmentSender(
+            self._loop,
+            self._sendto,
+            addr,
+            body_id,
+            payload,
+            rto=lambda: self.peers.rto(peer_id),
+            on_rtt=lambda sample: self.peers.record_rtt(peer_id, sample),
+            max_retries=max_attempts,
+        )
+        logger.debug("FASE 2 - Enviando cuerpo en %d fragmentos", sender.count)
+        # Si el ACK de algún fragmento se pierde, el ACK final también lo cubre
+        final_ack.add_done_callback(
+            lambda f: f.cancelled() or sender.finish(f.result()[0] == 0)
+        )
+        self._fragment_senders[(addr, body_id)] = sender
+        try:
+            if not await sender.run():
+                return False
+        finally:
+            del self._fragment_senders[(addr, body_id)]
+
+        # Si se pierde el ACK final, reenviar un fragmento hace que se repita
         for attempt in range(max_attempts):
             try:
-                print(
-                    f"FASE 1 - Intento {attempt + 1}/{max_attempts}: Enviando header..."
+                ack = await asyncio.wait_for(
+                    asyncio.shield(final_ack), self.peers.rto(peer_id)
                 )
-                self.udp_socket.sendto(header, addr)
-
-                # Esperar ACK con timeout
-                self.udp_socket.settimeout(5)
-                try:
-                    start_time = time.time()
-                    ack = self.response_queue.get(timeout=5)
-                    elapsed = time.time() - start_time
-                    if ack[0] == 0:  # OK
-                        print(
-                            f"ACK recibido en {elapsed:.2f}s, procediendo a enviar cuerpo del mensaje"
-                        )
-                        header_sent = True
-
-                        break
-                    else:
-                        print(
-                            f"ACK no válido recibido (status={ack[0]}), reintentando..."
-                        )
-                except queue.Empty:
-                    print("Timeout esperando ACK, reintentando...")
-            except Exception as e:
-                print(f"Error enviando header: {e}, reintentando...")
-            finally:
-                self.udp_socket.settimeout(None)
-                # Esperar un poco antes de reintentar
-                if not header_sent and attempt < max_attempts - 1:
-                    time.sleep(0.5 * (attempt + 1))
-
-        if not header_sent:
-            print(f"Fallo después de {max_attempts} intentos de enviar header")
-            return False
-
-        # Paso 2: Envío de cuerpo y espera de confirmación final con reintentos
-        body = body_id.to_bytes(8, "big") + message_bytes
-        message_sent = False
-
+                return ack[0] == 0
+            except asyncio.TimeoutError:
+                self.peers.backoff(peer_id)
+                self._sendto(sender.fragment(sender.count - 1), addr)
+        return False
+
+    async def _exchange(self, peer_id, addr, body_id, datagram, max_attempts, phase):
+        """Envía datagram hasta que el peer lo confirme, con timeout adaptativo
+
+        El timeout es el RTO del peer, que se duplica tras cada pérdida. Solo
+        se mide el RTT del primer intento: una respuesta tras una
+        retransmisión es ambigua (algoritmo de Karn). Devuelve True si el peer
+        respondió con status 0, None si respondió al último intento con otro
+        status y False si no respondió.
+        """
+        refused = False
         for attempt in range(max_attempts):
+            refused = False
+            if attempt:
+                self._retransmissions.inc()
+            timeout = self.peers.rto(peer_id)
             try:
-                print(
-                    f"FASE 2 - Intento {attempt + 1}/{max_attempts}: Enviando cuerpo del mensaje ({len(body)} bytes)..."
+                logger.debug(
+                    "%s - Intento %d/%d (%d bytes, timeout %.0f ms)",
+                    phase,
+                    attempt + 1,
+                    max_attempts,
+                    len(datagram),
+                    timeout * 1000,
                 )
-                self.udp_socket.sendto(body, addr)
+                ack_future = self._router.expect(addr, body_id, self._loop)
+                start_time = time.monotonic()
+                self._sendto(datagram, addr)
 
-                # Esperar confirmación final
-                self.udp_socket.settimeout(5)
                 try:
-                    start_time = time.time()
-                    final_ack = self.response_queue.get(timeout=5)
-                    elapsed = time.time() - start_time
-
-                    if final_ack[0] == 0:
-                        print(
-                            f"Confirmación final recibida en {elapsed:.2f}s, mensaje enviado con éxito"
-                        )
-                        self.add_to_message_history(
-                            self.user_id.decode("utf-8").strip(),
-                            message,
-                            datetime.now(),
-                        )
-                        message_sent = True
-                        break
-                    else:
-                        print(
-                            f"Confirmación no válida recibida (status={final_ack[0]}), reintentando..."
-                        )
-                except queue.Empty:
-                    print("Timeout esperando confirmación final, reintentando...")
+                    ack = await asyncio.wait_for(ack_future, timeout)
+                except asyncio.TimeoutError:
+                    logger.debug("Timeout esperando ACK, reintentando")
+                    self._timeouts.inc()
+                    self.peers.backoff(peer_id)
+                    continue
+
+                latency = time.monotonic() - start_time
+                self._ack_latency.observe(latency)
+                if attempt == 0:
+                    self.peers.record_rtt(peer_id, latency)
+                if ack[0] == 0:  # OK
+                    self._exchange_attempts.observe(attempt + 1)
+                    return True
+                refused = True
+                logger.debug(
+                    "ACK no válido recibido (status=%d), reintentando", ack[0]
+                )
             except Exception as e:
-                print(f"Error enviando cuerpo del mensaje: {e}, reintentando...")
-            finally:
-                self.udp_socket.settimeout(None)
-                # Esperar un poco antes de reintentar
-                if not message_sent and attempt < max_attempts - 1:
-                    time.sleep(0.5 * (attempt + 1))
-
-        if not message_sent:
-            print(
-                f"Fallo después de {max_attempts} intentos de enviar mensaje completo"
-            )
-            return False
+                logger.warning("Error en %s: %s, reintentando", phase, e)
 
-        return True
+            # Respuesta negativa o error: dar un RTO de margen antes de reintentar
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(self.peers.rto(peer_id))
+        self._exchange_attempts.observe(max_attempts)
+        return None if refused else False
 
-    def _build_header(self, operation, user_to, body_id=0, body_length=0):
+    def _build_header(self, operation, user_to, body_id=0, body_length=0, flags=0):
         """Construye el header de 100 bytes según especificación LCP"""
         header = bytearray(100)
         header[0:20] = self.user_id  # UserIdFrom
@@ -439,10 +1409,10 @@ class LCPClient:
             header[41] = body_id % 256
 
         header[42:50] = body_length.to_bytes(8, "big")  # BodyLength
-        # El resto (50 bytes) son reservados
-        return header
+        # Los 50 bytes reservados llevan las extensiones de LCPeer
+        return set_header_ext(header, flags=flags)
 
-    def _build_response(self, status, response_id=None):
+    def _build_response(self, status, response_id=None, body_id=None):
         """Construye una respuesta de 25 bytes según especificación LCP"""
         response = bytearray(25)
         response[0] = status  # ResponseStatus
@@ -452,20 +1422,115 @@ class LCPClient:
             response[1:21] = response_id.ljust(20)[:20].encode(
                 "utf-8"
             )  # El resto (4 bytes) son reservados
+        if body_id is not None:
+            # Permite al emisor asociar la respuesta a su transacción
+            set_response_body_id(response, body_id)
         return response
 
-    def send_file(self, peer_id, filepath):
-        """Envía un archivo a un peer específico"""
+    async def send_file(self, peer_id, filepath, streams=None, digest=None):
+        """Envía un archivo a un peer específico; devuelve True si lo confirmó
+
+        Con peers que soportan reanudación, si la conexión se corta se vuelve
+        a intentar y el envío sigue desde lo que el receptor ya tiene. Los
+        archivos grandes se envían por rangos en hasta streams conexiones
+        (por defecto file_streams) si el peer lo soporta. Con digest
+        (por defecto file_digest) el receptor comprueba el contenido con
+        blake2b o sha256 calculados durante la transferencia.
+        """
         if peer_id not in self.peers:
-            print(f"Peer {peer_id} not found")
-            return
+            logger.warning("Peer %s not found", peer_id)
+            return False
 
         if not os.path.exists(filepath):
-            print(f"File {filepath} not found")
-            return
+            logger.warning("File %s not found", filepath)
+            return False
+
+        addr = self.peers[peer_id]
+        caps = self.peers.info(peer_id).caps or 0
+        streams = self.file_streams if streams is None else streams
+        codec = choose_codec(self.compression, caps)
+        digest = self.file_digest if digest is None else digest
+        if digest not in (None, *DIGEST_NAMES):
+            raise ValueError(f"digest desconocido: {digest}")
+        algorithm = DIGEST_NAMES.get(digest) if caps & CAP_DIGEST else None
+        file_size = os.path.getsize(filepath)
+        if streams > 1 and caps & CAP_STRIPE and file_size >= STRIPE_MIN_SIZE:
+            mode = "striped"
+        elif caps & CAP_RESUME:
+            mode = "resumable"
+        else:
+            mode = "single"
 
-        # Generar ID único para el archivo
-        file_id = uuid.uuid4().int % 256  # 1 bytes
+        progress = self.progress.start("out", peer_id, file_size, filepath)
+        sent = False
+        try:
+            sent = await self._send_file_attempts(
+                peer_id, filepath, addr, mode, streams, codec, algorithm, progress
+            )
+        finally:
+            self.progress.finish(progress, sent)
+        return sent
+
+    async def _send_file_attempts(
+        self, peer_id, filepath, addr, mode, streams, codec, algorithm, progress
+    ):
+        """Intentos de envío de un archivo hasta que el receptor lo confirme"""
+        delay = 0
+        for attempt in range(FILE_ATTEMPTS):
+            if attempt:
+                logger.info(
+                    "Reintentando envío de %s (%d/%d)",
+                    filepath,
+                    attempt + 1,
+                    FILE_ATTEMPTS,
+                )
+                await asyncio.sleep(delay)
+            # ID único para el archivo entre las transacciones abiertas con el peer
+            file_id = self._router.allocate(addr, uuid.uuid4().int)
+            try:
+                sent = await self._send_file_transaction(
+                    peer_id,
+                    filepath,
+                    addr,
+                    file_id,
+                    mode,
+                    streams,
+                    codec,
+                    algorithm,
+                    progress,
+                )
+            finally:
+                self._router.release(addr, file_id)
+            if sent:
+                return True
+            if sent is None:
+                # El receptor está saturado: no se envió nada, así que
+                # cualquier modo puede reintentar cuando se libere
+                delay = FILE_BUSY_DELAY * (attempt + 1)
+                continue
+            info = self.peers.info(peer_id)
+            if mode != "resumable" or info is None or info.state != "alive":
+                break
+            delay = self.peers.rto(peer_id)
+        return False
+
+    async def _send_file_transaction(
+        self,
+        peer_id,
+        filepath,
+        addr,
+        file_id,
+        mode,
+        streams,
+        codec,
+        algorithm,
+        progress,
+    ):
+        """Anuncia el archivo por UDP y lo envía por TCP, comprimido si hay codec
+
+        Devuelve None si el receptor rechazó el header o la conexión TCP por
+        estar saturado.
+        """
         file_size = os.path.getsize(filepath)
 
         # Construir y enviar header
@@ -474,36 +1539,295 @@ class LCPClient:
             user_to=peer_id.ljust(20)[:20].encode("utf-8"),
             body_id=file_id,
             body_length=file_size,
+            flags=HDR_STRIPED if mode == "striped" else 0,
         )
+        if mode == "resumable":
+            set_transfer_key(header, transfer_key(filepath))
+        if codec is not None:
+            set_compression(header, codec.cap)
+        if algorithm is not None:
+            set_digest(header, algorithm)
+
+        if self.peers.info(peer_id).caps is not None:
+            # Los nodos LCPeer confirman el header: se reintenta según el RTO
+            accepted = await self._exchange(
+                peer_id, addr, file_id, header, MAX_ATTEMPTS, "HEADER ARCHIVO"
+            )
+            if accepted is None:
+                logger.info(
+                    "%s rechazó el archivo: demasiadas transferencias", peer_id
+                )
+                return None
+            if not accepted:
+                logger.warning("%s no confirmó el header del archivo", peer_id)
+                self.peers.mark_failed(peer_id)
+                return False
+        else:
+            # Un par v1.0 no se espera para enviar, pero su ACK se recoge aquí
+            # para que no lo tome otra transacción con él
+            async with self._transaction_lock(peer_id, addr):
+                ack = self._router.expect(addr, file_id, self._loop)
+                self._sendto(header, addr)
+                try:
+                    await asyncio.wait_for(ack, self.peers.rto(peer_id))
+                except asyncio.TimeoutError:
+                    pass
+
+        if mode == "striped":
+            return await self._send_file_striped(
+                peer_id,
+                filepath,
+                addr,
+                file_id,
+                file_size,
+                streams,
+                codec,
+                algorithm,
+                progress,
+            )
 
-        addr = self.peers[peer_id]
-        self.udp_socket.sendto(header, addr)
-
-        # Esperar ACK
         try:
-
             # Establecer conexión TCP y enviar archivo
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((addr))
+            reader, writer = await asyncio.open_connection(*addr)
+            try:
                 with open(filepath, "rb") as f:
                     # Enviar ID del archivo primero
-                    s.send(file_id.to_bytes(8, "big"))
-                    # Enviar contenido del archivo
-                    s.sendfile(f)
-
-                # Esperar confirmación final
-                s.settimeout(5)
-                final_ack = s.recv(25)
-                if final_ack[0] == 0:
-                    print(f"File sent to {peer_id}")
-                else:
-                    print(f"Failed to send file to {peer_id}")
-        except socket.timeout:
-            print(f"Timeout waiting for ACK from {peer_id}")
+                    writer.write(file_id.to_bytes(8, "big"))
+                    await writer.drain()
+
+                    start = 0
+                    if mode == "resumable":
+                        # Comprobar lo que ya tiene el receptor antes de seguir
+                        offer = await asyncio.wait_for(read_offer(reader), 5)
+                        if offer == "busy":
+                            logger.info("%s tiene el archivo ocupado", peer_id)
+                            return None
+                        offset, crcs = offer
+                        start = await self._loop.run_in_executor(
+                            None, verify_offer, filepath, offset, crcs
+                        )
+                        writer.write(start.to_bytes(8, "big"))
+                        if start:
+                            logger.info("Reanudando envío desde el byte %d", start)
+                    self.progress.rewind(progress, start)
+
+                    # Enviar contenido del archivo. Un receptor saturado
+                    # responde sin esperar al contenido: se deja de enviar en
+                    # cuanto llega la respuesta
+                    response = self._loop.create_task(reader.read(25))
+                    sending = self._loop.create_task(
+                        self._send_content(
+                            writer,
+                            f,
+                            start,
+                            file_size - start,
+                            codec is not None,
+                            codec,
+                            algorithm,
+                            lambda n: self.progress.advance(progress, n),
+                        )
+                    )
+                    try:
+                        await asyncio.wait(
+                            (response, sending), return_when=asyncio.FIRST_COMPLETED
+                        )
+                        if sending.done() and not response.done():
+                            sending.result()  # Propaga un error de envío
+
+                        # Esperar confirmación final
+                        final_ack = await asyncio.wait_for(response, 5)
+                    finally:
+                        sending.cancel()
+                        response.cancel()
+                        await asyncio.gather(sending, response, return_exceptions=True)
+
+                if final_ack and final_ack[0] == 0:
+                    logger.info("File sent to %s", peer_id)
+                    return True
+                if final_ack and final_ack[0] == 2:
+                    logger.info("%s rechazó la conexión: está saturado", peer_id)
+                    return None
+                logger.warning("Failed to send file to %s", peer_id)
+                return False
+            finally:
+                writer.close()
+        except asyncio.TimeoutError:
+            logger.warning("Timeout waiting for ACK from %s", peer_id)
         except Exception as e:
-            print(f"Error sending file: {e}")
+            logger.error("Error sending file: %s", e)
+        return False
+
+    async def _send_file_striped(
+        self,
+        peer_id,
+        filepath,
+        addr,
+        file_id,
+        file_size,
+        streams,
+        codec,
+        algorithm,
+        progress,
+    ):
+        """Envía un archivo por rangos en varias conexiones TCP en paralelo
+
+        Empieza con dos conexiones y abre más mientras el throughput mejore,
+        hasta streams. Los rangos de una conexión caída se reenvían por otra.
+        """
+        scheduler = StripeScheduler(file_size, streams)
+        workers = set()
+        failures = 0
+        refused = False
+        # Si un rango no compensa comprimirlo, los siguientes ya no lo intentan
+        compress = [codec]
+        self.progress.rewind(progress, 0)
+
+        def spawn():
+            task = self._spawn(
+                self._stripe_worker(
+                    addr,
+                    filepath,
+                    file_id,
+                    scheduler,
+                    spawn,
+                    codec,
+                    compress,
+                    algorithm,
+                    progress,
+                )
+            )
+            workers.add(task)
+
+        try:
+            for _ in range(scheduler.streams):
+                spawn()
+            while workers:
+                done, _ = await asyncio.wait(
+                    set(workers), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    workers.discard(task)
+                    if task.result():
+                        continue
+                    if task.result() is None:
+                        refused = True  # Rechazada por saturación: no se sustituye
+                        continue
+                    failures += 1
+                    if not scheduler.finished and failures < FILE_ATTEMPTS:
+                        spawn()  # Sustituir la conexión caída
         finally:
-            self.udp_socket.settimeout(None)
+            # Si se cancela el envío (o vence su timeout), las conexiones
+            # que quedan no siguen enviando rangos
+            for task in workers:
+                task.cancel()
+            if workers:
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        if scheduler.finished:
+            logger.info("File sent to %s (%d conexiones)", peer_id, scheduler.streams)
+            return True
+        if refused and not failures:
+            # Ninguna conexión falló: el receptor solo estaba saturado
+            logger.info("%s rechazó las conexiones: demasiadas conexiones", peer_id)
+            return None
+        logger.warning("Failed to send file to %s", peer_id)
+        return False
+
+    async def _stripe_worker(
+        self,
+        addr,
+        filepath,
+        file_id,
+        scheduler,
+        spawn,
+        codec,
+        compress,
+        algorithm,
+        progress,
+    ):
+        """Una conexión de un envío por rangos: envía rangos mientras queden
+
+        Con codec, los rangos van en bloques comprimidos con compress[0] (o
+        sin comprimir si es None). Devuelve None si el receptor rechaza la
+        conexión por estar saturado.
+        """
+        stripe = None
+        sent = 0  # Bytes del rango en curso ya contados en el progreso
+
+        def advance(n):
+            nonlocal sent
+            sent += n
+            self.progress.advance(progress, n)
+
+        try:
+            reader, writer = await asyncio.open_connection(*addr)
+            try:
+                with open(filepath, "rb") as f:
+                    writer.write(file_id.to_bytes(8, "big"))
+                    while True:
+                        stripe = scheduler.next_range()
+                        if stripe is None:
+                            break
+                        writer.write(encode_range(*stripe))
+                        sent = 0
+                        if not await self._send_content(
+                            writer,
+                            f,
+                            *stripe,
+                            codec is not None,
+                            compress[0],
+                            algorithm,
+                            advance,
+                        ):
+                            compress[0] = None
+                        ack = await asyncio.wait_for(reader.readexactly(25), 5)
+                        if ack[0] == 2:
+                            # El receptor no admite más conexiones: el rango
+                            # queda para las que ya tiene
+                            scheduler.requeue(stripe)
+                            self.progress.advance(progress, -sent)
+                            return None
+                        if ack[0] != 0:
+                            raise ConnectionError(f"rango rechazado (status={ack[0]})")
+                        done, stripe = stripe, None
+                        if scheduler.range_done(done):
+                            spawn()  # El throughput sigue subiendo: otra conexión
+                    writer.write(encode_range(0, 0))
+                    await writer.drain()
+                return True
+            finally:
+                writer.close()
+        except Exception as e:
+            logger.warning("Error en conexión de rangos: %s", e)
+            if stripe is not None:
+                scheduler.requeue(stripe)
+                # Se volverá a enviar por otra conexión
+                self.progress.advance(progress, -sent)
+            return False
+
+    async def _send_content(
+        self, writer, f, offset, count, framed, codec, algorithm, on_progress
+    ):
+        """Envía count bytes de f desde offset, seguidos de su digest si hay algorithm
+
+        Con framed el contenido va en bloques (comprimidos con codec si no es
+        None); si no, con sendfile. on_progress(n) recibe los bytes enviados.
+        Devuelve False si la compresión dejó de compensar.
+        """
+        digest = new_digest(algorithm) if algorithm is not None else None
+        compressed = True
+        if framed:
+            compressed = await send_blocks(
+                self._loop, writer, f, offset, count, codec, digest, on_progress
+            )
+        else:
+            await sendfile_hashed(
+                self._loop, writer.transport, f, offset, count, digest, on_progress
+            )
+        if digest is not None:
+            writer.write(digest.digest())
+        await writer.drain()
+        return compressed
 
     def register_message_callback(self, callback):
         """Registra una función que será llamada cuando se reciba un mensaje
@@ -512,105 +1836,442 @@ class LCPClient:
         - sender_id: ID del remitente
         - message: Texto del mensaje
         """
-        if hasattr(self, "message_handler") and self.message_handler:
+        if self.message_handler:
             self.message_handler.register_callback(callback)
         else:
-            print("Warning: MessageHandler no disponible, callback no registrado")
+            logger.warning("MessageHandler no disponible, callback no registrado")
 
     def unregister_message_callback(self, callback):
         """Elimina un callback previamente registrado"""
-        if hasattr(self, "message_handler") and self.message_handler:
+        if self.message_handler:
             self.message_handler.unregister_callback(callback)
 
-    def shutdown(self):
+    def register_progress_callback(self, callback):
+        """Registra una función que recibirá un TransferProgress por cada
+        actualización de un archivo entrante o saliente
+
+        Las actualizaciones de una transferencia llegan como mucho cada
+        progress_interval segundos, más una al empezar y otra al terminar.
+        """
+        if self.message_handler:
+            self.message_handler.register_progress_callback(callback)
+        else:
+            logger.warning("MessageHandler no disponible, callback no registrado")
+
+    def unregister_progress_callback(self, callback):
+        """Elimina un callback de progreso previamente registrado"""
+        if self.message_handler:
+            self.message_handler.unregister_progress_callback(callback)
+
+    def transfers_in_progress(self):
+        """TransferProgress de cada archivo que se está enviando o recibiendo"""
+        return self.progress.snapshot()
+
+    def _notify_progress(self, progress):
+        if progress.state != "active":
+            direction = progress.direction
+            self._files.labels(direction, progress.state).inc()
+            self._file_bytes.labels(direction).inc(progress.done - progress.resumed)
+            self._file_seconds.labels(direction).observe(progress.elapsed)
+        if self.message_handler:
+            self.message_handler.notify_progress(progress)
+
+    async def shutdown(self):
         """Cierra limpiamente el cliente"""
         self.running = False
-        self.udp_socket.close()
-        self.tcp_socket.close()
+        if self.peer_cache:
+            try:
+                self.peers.save(self.peer_cache)
+            except Exception as e:
+                logger.warning("No se pudo guardar la caché de peers: %s", e)
+        self._timers.stop()
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        if self._udp_transport:
+            self._udp_transport.close()
+        if self._tcp_server:
+            self._tcp_server.close()
+            await self._tcp_server.wait_closed()
+        if self._metrics_server:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+
+    async def uno_a_muchos(self, sms):
+        """Envía un mensaje broadcast a todos los peers en la red
+
+        Las respuestas al broadcast se recogen por peer. A los peers conocidos
+        que no confirman se les reenvía el mensaje por unicast, como mucho
+        FANOUT_PARALLELISM a la vez. Devuelve un DeliveryReport.
+        """
+        started = time.monotonic()
+        # Destinatarios esperados: los peers conocidos en este momento
+        targets = {addr: peer_id for peer_id, addr in self.peers.items()}
+        legacy = [a for a, p in targets.items() if self.peers.info(p).caps is None]
+        collector = FanOutCollector(self._loop, legacy)
+        # Se espera como mucho un RTO del peer más lento en cada fase
+        ack_wait = max(
+            [FANOUT_MIN_WAIT] + [self.peers.rto(p) for p in targets.values()]
+        )
 
-    def uno_a_muchos(self, sms):
-        """Envía un mensaje broadcast a todos los peers en la red"""
+        # BodyId que no usa ninguna transacción unicast en vuelo
+        body_id = self._router.allocate_broadcast(collector, int(time.time() * 1000))
+        report = DeliveryReport(body_id)
         try:
-            print(f"Iniciando envío de mensaje broadcast: {sms}")
+            logger.debug("Iniciando envío de mensaje broadcast")
             s = sms.encode("utf-8")
-            body_id = (
-                int(time.time() * 1000) % 256
-            )  
             # Construir header para broadcast
             header = self._build_header(
                 operation=1, user_to=b"\xff" * 20, body_id=body_id, body_length=len(s)
             )
 
-            print(f"Body ID generado para broadcast: {body_id}")
-
-            # Limpiar cualquier respuesta antigua en la cola
-            while not self.response_queue.empty():
-                try:
-                    self.response_queue.get_nowait()
-                except queue.Empty:
-                    break
-            ip, mask = get_ip_and_mask()
+            logger.debug("Body ID generado para broadcast: %d", body_id)
 
-            # Usar tanto broadcast como envío directo a todos los peers conocidos
-            broadcast_addrs = calcular_broadcast(ip, mask)
+            # Broadcast de todas las subredes conectadas
+            broadcast_addrs = await self._broadcast_addresses()
 
             # Paso 1: Enviar headers
-            print("Enviando headers broadcast...")
+            logger.debug("Enviando headers broadcast")
 
             # A direcciones broadcast
             for addr in broadcast_addrs:
                 try:
-                    self.udp_socket.sendto(header, (addr, 9990))
-                    print(f"Header de broadcast enviado a {addr}")
+                    self._sendto(header, (addr, self.port))
+                    logger.debug("Header de broadcast enviado a %s", addr)
                 except Exception as e:
-                    print(f"Error enviando header a {addr}: {e}")
+                    logger.warning("Error enviando header a %s: %s", addr, e)
 
-            # Esperar un momento para dar tiempo a que lleguen los ACKs
-            time.sleep(0.1)
+            # Esperar los ACKs de los peers conocidos, no un tiempo fijo
+            await collector.wait(targets, 1, ack_wait)
 
             # Paso 2: Enviar cuerpo del mensaje
-            print("Enviando cuerpo del broadcast...")
+            logger.debug("Enviando cuerpo del broadcast")
             body = body_id.to_bytes(8, "big") + s
 
             # A direcciones broadcast
             for addr in broadcast_addrs:
                 try:
-                    self.udp_socket.sendto(body, (addr, 9990))
-                    print(f"Cuerpo de broadcast enviado a {addr}")
+                    self._sendto(body, (addr, self.port))
+                    logger.debug("Cuerpo de broadcast enviado a %s", addr)
                 except Exception as e:
-                    print(f"Error enviando cuerpo a {addr}: {e}")
-
-            # Simplificar el manejo del historial para evitar duplicaciones
-            timestamp = datetime.now()
-
-            # Añadir solo como un mensaje broadcast (no duplicar para cada peer)
-            # Solo notificamos a través del callback, el cual se encargará de guardar adecuadamente
-            if hasattr(self, "message_handler") and self.message_handler:
-                # Broadcast enviado por nosotros mismos
-                self.message_handler.notify_message("Broadcast:Enviado", sms)
-
-            print(f"Broadcast completo: {sms}")
-            return True
+                    logger.warning("Error enviando cuerpo a %s: %s", addr, e)
 
+            await collector.wait(
+                [a for a in collector.responders() if collector.acks(a) == 1],
+                2,
+                ack_wait,
+            )
         except Exception as e:
-            print(f"Error en broadcast: {e}")
-            return False
+            logger.error("Error en broadcast: %s", e)
+            report.elapsed = time.monotonic() - started
+            self._record_broadcast(report)
+            return report
+        finally:
+            self._router.stop_collecting(body_id)
+
+        report.sent = True
+        self.add_to_message_history(
+            "Broadcast",
+            sms,
+            datetime.now(),
+            self.user_id.decode("utf-8").strip(),
+            "broadcast_sent",
+        )
+        if self.message_handler:
+            # Broadcast enviado por nosotros mismos
+            self.message_handler.notify_message("Broadcast:Enviado", sms)
+
+        # Paso 3: reenvío unicast a los peers conocidos que no confirmaron
+        for addr in collector.responders():
+            if collector.acks(addr) == 2:
+                report.delivered.append(
+                    targets.get(addr) or self.normalizar(collector.names[addr])
+                )
+        missing = [a for a in targets if collector.acks(a) < 2]
+        if missing:
+            limit = asyncio.Semaphore(FANOUT_PARALLELISM)
+            results = await asyncio.gather(
+                *(
+                    self._fanout_retransmit(
+                        limit, targets[a], a, header, body, collector.acks(a) == 1
+                    )
+                    for a in missing
+                )
+            )
+            for addr, ok in zip(missing, results):
+                report.retransmitted.append(targets[addr])
+                (report.delivered if ok else report.failed).append(targets[addr])
+
+        report.elapsed = time.monotonic() - started
+        logger.info("Broadcast completo: %r", report)
+        self._record_broadcast(report)
+        return report
+
+    def _record_broadcast(self, report):
+        result = "complete" if report.complete else "partial" if report else "failed"
+        self._broadcasts.labels(result).inc()
+        self._broadcast_peers.labels("delivered").inc(len(report.delivered))
+        self._broadcast_peers.labels("failed").inc(len(report.failed))
+        self._broadcast_peers.labels("retransmitted").inc(len(report.retransmitted))
+        self._broadcast_seconds.observe(report.elapsed)
+
+    async def _fanout_retransmit(
+        self, limit, peer_id, addr, header, body, header_acked
+    ):
+        """Reenvía por unicast un broadcast a un peer que no lo confirmó"""
+        async with limit:
+            info = self.peers.info(peer_id)
+            if info is None:
+                return False
+            max_attempts = (
+                SUSPECT_MAX_ATTEMPTS if info.state != "alive" else MAX_ATTEMPTS
+            )
+            body_id = header[41]
+            transaction_id = self._router.allocate(addr, body_id)
+            try:
+                async with self._transaction_lock(peer_id, addr):
+                    if header_acked and transaction_id == body_id:
+                        # El peer tiene el header: solo le falta el cuerpo
+                        ok = await self._exchange(
+                            peer_id,
+                            addr,
+                            body_id,
+                            body,
+                            max_attempts,
+                            "REENVÍO CUERPO",
+                        )
+                    else:
+                        header = bytearray(header)
+                        header[41] = transaction_id
+                        body = transaction_id.to_bytes(8, "big") + body[8:]
+                        ok = await self._exchange(
+                            peer_id,
+                            addr,
+                            transaction_id,
+                            header,
+                            max_attempts,
+                            "REENVÍO",
+                        ) and await self._exchange(
+                            peer_id,
+                            addr,
+                            transaction_id,
+                            body,
+                            max_attempts,
+                            "REENVÍO",
+                        )
+            finally:
+                self._router.release(addr, transaction_id)
+            if not ok:
+                self.peers.mark_failed(peer_id)
+            return ok
 
-    def add_to_message_history(self, peer_id, message, timestamp):
-        """Añade un mensaje al historial con control de tamaño
+    def add_to_message_history(
+        self, peer_id, message, timestamp, sender=None, kind="received"
+    ):
+        """Añade un mensaje al historial y emite su evento
 
         Args:
-            peer_id: ID del peer que envió o recibió el mensaje
+            peer_id: ID del peer (o "Broadcast") al que pertenece la conversación
             message: Contenido del mensaje
             timestamp: Marca de tiempo del mensaje
+            sender: Quién escribió el mensaje; por defecto el propio peer_id
+            kind: "received", "sent", "broadcast" o "broadcast_sent"
         """
-        # Añadir a la lista de historial
-        self.message_history.append((peer_id, message, timestamp))
+        # El buffer circular descarta el más antiguo al superar max_history_size
+        record = self.message_history.append(
+            kind, peer_id, peer_id if sender is None else sender, message, timestamp
+        )
 
-        # Si excede el límite máximo y hay un límite configurado, eliminar los más antiguos
-        if (
-            self.max_history_size > 0
-            and len(self.message_history) > self.max_history_size
-        ):
-            # Mantenemos solo los últimos max_history_size mensajes
-            self.message_history = self.message_history[-self.max_history_size :]
+        if self.message_handler:
+            self.message_handler.notify_event(record)
+
+    def events_since(self, seq):
+        """Eventos del historial en memoria con número de secuencia mayor que seq"""
+        return self.message_history.since(seq)
+
+    def recent_messages(self, peer_id, n=10):
+        """Últimos n mensajes en memoria de la conversación con peer_id"""
+        return self.message_history.recent(peer_id, n)
+
+    def register_event_callback(self, callback):
+        """Registra una función que recibirá un HistoryRecord por cada mensaje
+        que entra en el historial (recibido, enviado o broadcast)"""
+        if self.message_handler:
+            self.message_handler.register_event_callback(callback)
+        else:
+            logger.warning("MessageHandler no disponible, callback no registrado")
+
+    def unregister_event_callback(self, callback):
+        """Elimina un callback de eventos previamente registrado"""
+        if self.message_handler:
+            self.message_handler.unregister_event_callback(callback)
+
+
+class LCPClient:
+    """Fachada síncrona sobre AsyncLCPClient
+
+    Ejecuta el motor asyncio en un hilo propio y expone la API bloqueante de
+    siempre, de modo que la interfaz gráfica puede seguir llamándola desde
+    sus hilos de trabajo.
+    """
+
+    def __init__(
+        self,
+        user_id,
+        max_history_size=100,
+        port=9990,
+        peer_cache=None,
+        partial_dir=".lcp_partial",
+        file_streams=4,
+        compression="zlib",
+        file_digest=None,
+        max_transfers=8,
+        max_connections=32,
+        tcp_backlog=64,
+        progress_interval=0.5,
+        metrics=False,
+        metrics_port=None,
+        log_level=None,
+    ):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self.engine = AsyncLCPClient(
+            user_id,
+            max_history_size,
+            port,
+            peer_cache,
+            partial_dir,
+            file_streams=file_streams,
+            compression=compression,
+            file_digest=file_digest,
+            max_transfers=max_transfers,
+            max_connections=max_connections,
+            tcp_backlog=tcp_backlog,
+            progress_interval=progress_interval,
+            metrics=metrics,
+            metrics_port=metrics_port,
+            log_level=log_level,
+        )
+        try:
+            self._run(self.engine.start())
+        except Exception:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            raise
+
+    def _run(self, coro):
+        """Ejecuta una corrutina en el loop del motor y espera su resultado"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @property
+    def user_id(self):
+        return self.engine.user_id
+
+    @property
+    def peers(self):
+        return self.engine.peers
+
+    @property
+    def running(self):
+        return self.engine.running
+
+    def peer_status(self):
+        """Estado, última actividad y RTT de cada peer conocido"""
+        return self.engine.peers.snapshot()
+
+    @property
+    def message_history(self):
+        return self.engine.message_history
+
+    @property
+    def max_history_size(self):
+        return self.engine.max_history_size
+
+    @property
+    def message_handler(self):
+        return self.engine.message_handler
+
+    def normalizar(self, name):
+        return self.engine.normalizar(name)
+
+    def transfer_stats(self):
+        """Contadores de transferencias entrantes"""
+        return self.engine.transfer_stats()
+
+    def metrics_snapshot(self):
+        """Valores actuales de las métricas del nodo"""
+        return self.engine.metrics_snapshot()
+
+    def dump_events(self, n=None):
+        """Los últimos n eventos del protocolo, formateados"""
+        return self.engine.dump_events(n)
+
+    def send_message(self, peer_id, message):
+        """Envía un mensaje a un peer específico con reintentos"""
+        return self._run(self.engine.send_message(peer_id, message))
+
+    def send_messages(self, peer_id, messages):
+        """Envía varios mensajes a un peer a la vez; devuelve un bool por mensaje"""
+        return self._run(self.engine.send_messages(peer_id, messages))
+
+    def send_file(self, peer_id, filepath, streams=None, digest=None):
+        """Envía un archivo a un peer específico; devuelve True si lo confirmó"""
+        return self._run(self.engine.send_file(peer_id, filepath, streams, digest))
+
+    def uno_a_muchos(self, sms):
+        """Envía un mensaje broadcast a todos los peers; devuelve un DeliveryReport"""
+        return self._run(self.engine.uno_a_muchos(sms))
+
+    def add_to_message_history(
+        self, peer_id, message, timestamp, sender=None, kind="received"
+    ):
+        self._loop.call_soon_threadsafe(
+            self.engine.add_to_message_history,
+            peer_id,
+            message,
+            timestamp,
+            sender,
+            kind,
+        )
+
+    def register_message_callback(self, callback):
+        """Registra una función que será llamada cuando se reciba un mensaje"""
+        self.engine.register_message_callback(callback)
+
+    def register_event_callback(self, callback):
+        """Registra una función que recibirá un HistoryRecord por mensaje"""
+        self.engine.register_event_callback(callback)
+
+    def unregister_event_callback(self, callback):
+        """Elimina un callback de eventos previamente registrado"""
+        self.engine.unregister_event_callback(callback)
+
+    def events_since(self, seq):
+        """Eventos del historial en memoria con número de secuencia mayor que seq"""
+        return self.engine.events_since(seq)
+
+    def recent_messages(self, peer_id, n=10):
+        """Últimos n mensajes en memoria de la conversación con peer_id"""
+        return self.engine.recent_messages(peer_id, n)
+
+    def unregister_message_callback(self, callback):
+        """Elimina un callback previamente registrado"""
+        self.engine.unregister_message_callback(callback)
+
+    def register_progress_callback(self, callback):
+        """Registra una función que recibirá el progreso de cada transferencia"""
+        self.engine.register_progress_callback(callback)
+
+    def unregister_progress_callback(self, callback):
+        """Elimina un callback de progreso previamente registrado"""
+        self.engine.unregister_progress_callback(callback)
+
+    def transfers_in_progress(self):
+        """Progreso de cada archivo que se está enviando o recibiendo"""
+        return self.engine.transfers_in_progress()
+
+    def shutdown(self):
+        """Cierra limpiamente el cliente"""
+        self._run(self.engine.shutdown())
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import threading
+import zlib
+from collections import deque
+
+try:
+    import bz2
+except ImportError:  # Python compilado sin libbz2
+    bz2 = None
+try:
+    import lzma
+except ImportError:  # Python compilado sin liblzma
+    lzma = None
+
+from integrity import sendfile_hashed
+from lcp_extensions import CAP_BZ2, CAP_LZMA, CAP_ZLIB
+
+# Los archivos se comprimen en bloques independientes de BLOCK_SIZE bytes
+BLOCK_SIZE = 1024 * 1024
+# Un bloque (o mensaje) solo viaja comprimido si ocupa como mucho esta
+# fracción del original; si no, se envía tal cual
+MIN_RATIO = 0.9
+# Mensajes más cortos no compensan el coste de comprimir
+MESSAGE_MIN_SIZE = 256
+# Tramo máximo de un bloque sin comprimir (se envía con sendfile)
+RAW_BLOCK_MAX = 1024 * 1024 * 1024
+# Bloques que se comprimen a la vez en hilos mientras se envían los anteriores
+COMPRESS_AHEAD = min(os.cpu_count() or 1, 8)
+
+# Tipos de bloque en el flujo TCP: tipo (1) + longitud en el cable (4)
+BLOCK_RAW = 0
+BLOCK_COMPRESSED = 1
+BLOCK_HEADER_SIZE = 5
+
+
+class Codec:
+    """Compresor de la biblioteca estándar con su bit de capacidad"""
+
+    def __init__(self, name, cap, compress, decompressor):
+        self.name = name
+        self.cap = cap
+        self._compress = compress
+        self._decompressor = decompressor
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def decompress(self, data, max_length):
+        """Descomprime data, que debe dar como mucho max_length bytes"""
+        decompressor = self._decompressor()
+        out = decompressor.decompress(data, max_length)
+        if not decompressor.eof or getattr(decompressor, "unconsumed_tail", b""):
+            raise ValueError("bloque comprimido incompleto o mayor de lo anunciado")
+        return out
+
+    def __repr__(self):
+        return f"Codec({self.name})"
+
+
+# Niveles bajos: en una LAN la red rara vez es más lenta que el compresor
+CODECS = {
+    "zlib": Codec("zlib", CAP_ZLIB, lambda d: zlib.compress(d, 1), zlib.decompressobj)
+}
+if bz2 is not None:
+    CODECS["bz2"] = Codec(
+        "bz2", CAP_BZ2, lambda d: bz2.compress(d, 1), bz2.BZ2Decompressor
+    )
+if lzma is not None:
+    CODECS["lzma"] = Codec(
+        "lzma", CAP_LZMA, lambda d: lzma.compress(d, preset=1), lzma.LZMADecompressor
+    )
+_BY_CAP = {codec.cap: codec for codec in CODECS.values()}
+
+
+def choose_codec(preferred, peer_caps):
+    """Códec para enviar a un peer: el preferido o zlib, si el peer lo soporta"""
+    if not preferred or not peer_caps:
+        return None
+    for name in (preferred, "zlib"):
+        codec = CODECS.get(name)
+        if codec is not None and peer_caps & codec.cap:
+            return codec
+    return None
+
+
+def codec_for(cap):
+    """Códec indicado en un header, o None si no está disponible aquí"""
+    return _BY_CAP.get(cap)
+
+
+def compress_message(codec, data):
+    """Cuerpo de mensaje comprimido, o None si no compensa"""
+    if codec is None or len(data) < MESSAGE_MIN_SIZE:
+        return None
+    packed = codec.compress(data)
+    if len(packed) > len(data) * MIN_RATIO:
+        return None
+    return packed
+
+
+def _block_header(kind, length):
+    return bytes([kind]) + length.to_bytes(4, "big")
+
+
+async def send_blocks(
+    loop, writer, f, offset, count, codec, digest=None, on_progress=None
+):
+    """Envía count bytes de f desde offset como bloques comprimidos
+
+    El primer bloque hace de muestra; si compensa, hasta COMPRESS_AHEAD
+    bloques se comprimen en hilos mientras se envían los anteriores. En
+    cuanto uno no reduce su tamaño lo suficiente, el resto viaja sin
+    comprimir con sendfile y no se gasta más CPU en datos que ya venían
+    comprimidos. Devuelve False en ese caso. Con codec None todo va sin
+    comprimir, pero con el mismo formato de bloques. Si se pasa digest, se
+    le añaden los bytes originales en orden; on_progress(n) recibe los bytes
+    originales de cada bloque enviado.
+    """
+    lock = threading.Lock()
+
+    def pack(position, size):
+        with lock:
+            f.seek(position)
+            data = f.read(size)
+        packed = codec.compress(data)
+        return data, packed if len(packed) <= len(data) * MIN_RATIO else None
+
+    end = offset + count
+    position = offset  # Siguiente byte por leer
+    jobs = deque()
+
+    def submit():
+        nonlocal position
+        size = min(BLOCK_SIZE, end - position)
+        jobs.append(loop.run_in_executor(None, pack, position, size))
+        position += size
+
+    compressing = codec is not None
+    if compressing and position < end:
+        submit()
+    while jobs:
+        data, packed = await jobs.popleft()
+        if digest is not None:
+            digest.update(data)
+        compressing = compressing and packed is not None
+        while compressing and position < end and len(jobs) < COMPRESS_AHEAD:
+            submit()
+        if packed is not None:
+            writer.write(_block_header(BLOCK_COMPRESSED, len(packed)))
+            writer.write(packed)
+        else:
+            writer.write(_block_header(BLOCK_RAW, len(data)))
+            writer.write(data)
+        await writer.drain()
+        if on_progress is not None:
+            on_progress(len(data))
+
+    # No compensa: el resto sin comprimir
+    while position < end:
+        size = min(RAW_BLOCK_MAX, end - position)
+        writer.write(_block_header(BLOCK_RAW, size))
+        await sendfile_hashed(
+            loop, writer.transport, f, position, size, digest, on_progress
+        )
+        position += size
+    return compressing
+
+
+async def receive_blocks(stream, codec, count, write, receive_raw):
+    """Recibe count bytes originales enviados con send_blocks
+
+    Los bloques comprimidos se descomprimen en un hilo aparte y se pasan a
+    write; los que van sin comprimir los recibe receive_raw(n), que devuelve
+    los bytes recibidos. Devuelve el total de bytes originales recibidos.
+    """
+    loop = asyncio.get_running_loop()
+    done = 0
+    try:
+        while done < count:
+            head = await stream.readexactly(BLOCK_HEADER_SIZE)
+            kind, length = head[0], int.from_bytes(head[1:], "big")
+            if kind == BLOCK_RAW:
+                if length > count - done:
+                    raise ValueError(f"bloque de {length} bytes fuera del archivo")
+                received = await receive_raw(length)
+                done += received
+                if received < length:
+                    break
+            elif kind == BLOCK_COMPRESSED:
+                if length > BLOCK_SIZE:
+                    raise ValueError(f"bloque comprimido de {length} bytes")
+                packed = await stream.readexactly(length)
+                data = await loop.run_in_executor(
+                    None, codec.decompress, packed, min(BLOCK_SIZE, count - done)
+                )
+                write(data)
+                done += len(data)
+            else:
+                raise ValueError(f"tipo de bloque desconocido: {kind}")
+    except asyncio.IncompleteReadError:
+        pass
+    return done
@@ -0,0 +1,84 @@
+import asyncio
+
+from lcp_extensions import response_body_id
+
+
+class DeliveryReport:
+    """Resultado de un envío uno a muchos
+
+    delivered y failed contienen los ids de los peers que confirmaron el
+    mensaje y los que no lo hicieron ni tras los reenvíos unicast. Es
+    verdadero si el broadcast llegó a salir, como el antiguo True/False.
+    """
+
+    def __init__(self, body_id):
+        self.body_id = body_id
+        self.sent = False
+        self.delivered = []
+        self.failed = []
+        self.retransmitted = []  # Peers a los que hubo que reenviar por unicast
+        self.elapsed = 0.0
+
+    @property
+    def complete(self):
+        """True si todos los peers conocidos confirmaron la entrega"""
+        return self.sent and not self.failed
+
+    def __bool__(self):
+        return self.sent
+
+    def __repr__(self):
+        return (
+            f"DeliveryReport(delivered={len(self.delivered)}, "
+            f"failed={len(self.failed)}, retransmitted={len(self.retransmitted)}, "
+            f"elapsed={self.elapsed:.3f}s)"
+        )
+
+
+class FanOutCollector:
+    """Cuenta las respuestas de cada peer a un broadcast de mensaje
+
+    La primera respuesta de un peer confirma el header y la segunda el
+    cuerpo. Las respuestas sin BodyId solo se aceptan de las direcciones en
+    legacy (pares v1.0 que no lo indican).
+    """
+
+    def __init__(self, loop, legacy=()):
+        self._loop = loop
+        self._legacy = set(legacy)
+        self._acks = {}  # addr -> respuestas OK recibidas (máximo 2)
+        self.names = {}  # addr -> ResponseId
+        self._wanted = None
+        self._waiter = None
+
+    def __call__(self, addr, response):
+        if response_body_id(response) is None and addr not in self._legacy:
+            return False
+        if response[0] != 0:
+            return True
+        self._acks[addr] = min(self._acks.get(addr, 0) + 1, 2)
+        self.names.setdefault(addr, response[1:21].decode("utf-8", "replace"))
+        if self._waiter is not None and not self._waiter.done():
+            if all(self._acks.get(a, 0) >= self._wanted[1] for a in self._wanted[0]):
+                self._waiter.set_result(None)
+        return True
+
+    def acks(self, addr):
+        return self._acks.get(addr, 0)
+
+    def responders(self):
+        return list(self._acks)
+
+    async def wait(self, addrs, count, timeout):
+        """Espera a que cada dirección de addrs tenga count respuestas, o timeout"""
+        addrs = set(addrs)
+        if all(self.acks(a) >= count for a in addrs):
+            return
+        self._wanted = (addrs, count)
+        self._waiter = self._loop.create_future()
+        try:
+            await asyncio.wait_for(self._waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiter = None
@@ -0,0 +1,347 @@
+import asyncio
+import errno
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Con splice(2) el contenido va del socket al archivo sin pasar por Python
+SPLICE_AVAILABLE = hasattr(os, "splice")
+# Datos recibidos de más (solo con loops que leen por su cuenta, como el de
+# Windows) se guardan aparte hasta que alguien los pida
+SPILL_SIZE = 64 * 1024
+
+
+def preallocate(fd, length):
+    """Reserva length bytes en disco para fd; si no se puede, solo fija el tamaño"""
+    if length and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, length)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, max(length, os.fstat(fd).st_size))
+
+
+def pwrite(fd, data, offset):
+    """Escribe data en offset sin depender de la posición del descriptor"""
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    # Sin pwrite (Windows): el event loop no intercala otras escrituras
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+def pwrite_all(fd, data, offset):
+    """Escribe todo data en offset, aunque pwrite escriba menos de una vez"""
+    view = memoryview(data)
+    while view:
+        written = pwrite(fd, view, offset)
+        offset += written
+        view = view[written:]
+
+
+class FileStream(asyncio.BufferedProtocol):
+    """Conexión TCP de archivos que recibe en un buffer reservado de antemano
+
+    Solo lee del socket lo que se le pide: los campos de control (FileId,
+    ofertas, cabeceras de rango) con readexactly, y el contenido con
+    receive_into o receive_to_fd, que lo escribe desde un único buffer por
+    conexión o, donde el kernel lo permite, con splice sin copiarlo a Python.
+    Mientras nadie pide datos la lectura queda en pausa y el control de flujo
+    de TCP frena al emisor.
+    """
+
+    def __init__(self, handler, buffer_size=1024 * 1024):
+        self._handler = handler
+        self._buffer_size = buffer_size
+        self._buffer = None  # Se reserva con la primera recepción de contenido
+        self._target = None  # Vista que se está llenando
+        self._filled = 0
+        self._write = None  # Destino del contenido; None al leer campos de control
+        self._remaining = 0
+        self._received = 0
+        self._waiter = None
+        self._spill = bytearray()
+        self._spill_view = None
+        self._spilling = False
+        self._splice = SPLICE_AVAILABLE
+        self._pipe = None
+        self._eof = False
+        self._write_waiter = None
+        self.transport = None
+        self._loop = None
+        self._task = None
+
+    # Protocolo
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._loop = asyncio.get_running_loop()
+        transport.pause_reading()
+        self._task = self._loop.create_task(self._handler(self))
+
+    def get_buffer(self, sizehint):
+        if self._target is not None and self._filled < len(self._target):
+            return self._target[self._filled :]
+        # Nadie espera datos: el loop leyó por adelantado
+        if self._spill_view is None:
+            self._spill_view = memoryview(bytearray(SPILL_SIZE))
+        self._spilling = True
+        return self._spill_view
+
+    def buffer_updated(self, nbytes):
+        if self._spilling:
+            self._spilling = False
+            self._spill += self._spill_view[:nbytes]
+            return
+        if self._write is None:
+            self._filled += nbytes
+            if self._filled == len(self._target):
+                self._wake(bytes(self._target))
+            return
+
+        try:
+            self._write(self._target[self._filled : self._filled + nbytes])
+        except Exception as e:
+            self._fail(e)
+            return
+        self._received += nbytes
+        self._remaining -= nbytes
+        if self._remaining == 0:
+            self._wake(self._received)
+        else:
+            self._target = self._buffer[: min(len(self._buffer), self._remaining)]
+
+    def eof_received(self):
+        self._eof = True
+        self._on_closed()
+        return True  # Aún se puede responder al emisor
+
+    def connection_lost(self, exc):
+        self._eof = True
+        if self._waiter is None:
+            self._close_pipe()
+        self._on_closed()
+        if self._write_waiter is not None and not self._write_waiter.done():
+            self._write_waiter.set_result(None)
+
+    def pause_writing(self):
+        if self._write_waiter is None or self._write_waiter.done():
+            self._write_waiter = self._loop.create_future()
+
+    def resume_writing(self):
+        if self._write_waiter is not None and not self._write_waiter.done():
+            self._write_waiter.set_result(None)
+
+    # Interfaz para el manejador de la conexión
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self._write_waiter is not None:
+            await self._write_waiter
+
+    def write_eof(self):
+        self.transport.write_eof()
+
+    def close(self):
+        self.transport.close()
+
+    async def readexactly(self, n):
+        """Lee exactamente n bytes; IncompleteReadError si la conexión se cierra"""
+        if len(self._spill) >= n:
+            data = bytes(self._spill[:n])
+            del self._spill[:n]
+            return data
+        if self._eof:
+            partial = bytes(self._spill)
+            self._spill.clear()
+            raise asyncio.IncompleteReadError(partial, n)
+        buffer = bytearray(n)
+        self._target = memoryview(buffer)
+        self._filled = len(self._spill)
+        self._target[: self._filled] = self._spill
+        self._spill.clear()
+        data = await self._wait()
+        if data is None:
+            raise asyncio.IncompleteReadError(bytes(buffer[: self._filled]), n)
+        return data
+
+    async def receive_into(self, write, count):
+        """Recibe hasta count bytes pasando cada trozo a write(memoryview)
+
+        Devuelve los bytes recibidos, menos de count si la conexión se cierra.
+        La vista solo es válida durante la llamada a write.
+        """
+        received = self._take_spill(write, count)
+        if received == count or self._eof:
+            return received
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(self._buffer_size))
+        self._write = write
+        self._remaining = count - received
+        self._received = received
+        self._target = self._buffer[: min(len(self._buffer), self._remaining)]
+        self._filled = 0
+        try:
+            await self._wait()
+        finally:
+            self._write = None
+            self._target = None
+        return self._received
+
+    async def receive_to_fd(self, fd, offset, count, on_progress):
+        """Recibe hasta count bytes y los escribe en fd a partir de offset
+
+        on_progress(n) se llama tras escribir cada trozo. Devuelve los bytes
+        recibidos.
+        """
+        position = [offset]
+
+        def write_chunk(view):
+            pwrite_all(fd, view, position[0])
+            position[0] += len(view)
+            on_progress(len(view))
+
+        received = self._take_spill(write_chunk, count)
+        if received < count and not self._eof and self._splice:
+            received += await self._splice_to_fd(
+                fd, position, count - received, on_progress
+            )
+        if received < count and not self._eof:
+            received += await self.receive_into(write_chunk, count - received)
+        return received
+
+    # Internos
+
+    def _take_spill(self, write, count):
+        take = min(len(self._spill), count)
+        if take:
+            write(memoryview(self._spill)[:take])
+            del self._spill[:take]
+        return take
+
+    async def _wait(self):
+        self._waiter = self._loop.create_future()
+        self.transport.resume_reading()
+        try:
+            return await self._waiter
+        finally:
+            self._waiter = None
+            self._stop_reading()
+
+    def _wake(self, result):
+        self._stop_reading()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(result)
+
+    def _fail(self, exc):
+        self._stop_reading()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(exc)
+
+    def _stop_reading(self):
+        # Lo que llegue antes de la próxima petición va al buffer aparte
+        self._target = None
+        if not self._eof:
+            self.transport.pause_reading()
+
+    def _on_closed(self):
+        if self._write is not None:
+            self._wake(self._received)
+        else:
+            self._wake(None)
+
+    def _open_pipe(self):
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            if fcntl is not None and hasattr(fcntl, "F_SETPIPE_SZ"):
+                try:
+                    fcntl.fcntl(self._pipe[1], fcntl.F_SETPIPE_SZ, self._buffer_size)
+                except OSError:
+                    pass  # Más que pipe-max-size: se queda con el tamaño por defecto
+        return self._pipe
+
+    async def _splice_to_fd(self, fd, position, count, on_progress):
+        """Mueve count bytes del socket a fd con splice, a través de una pipe"""
+        pipe_r, pipe_w = self._open_pipe()
+        # El transporte tiene la lectura en pausa, pero su descriptor sigue
+        # registrado a su nombre: se vigila un duplicado
+        sock_fd = os.dup(self.transport.get_extra_info("socket").fileno())
+        done = self._loop.create_future()
+        state = {"received": 0}
+
+        def finish():
+            if not done.done():
+                done.set_result(None)
+
+        def ready():
+            received = state["received"]
+            try:
+                moved = os.splice(
+                    sock_fd,
+                    pipe_w,
+                    min(count - received, self._buffer_size),
+                    flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK,
+                )
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if not done.done():
+                    done.set_exception(e)
+                return
+            if moved == 0:
+                self._eof = True
+                finish()
+                return
+            try:
+                self._drain_pipe(pipe_r, fd, position, moved)
+            except OSError as e:
+                if not done.done():
+                    done.set_exception(e)
+                return
+            state["received"] = received + moved
+            on_progress(moved)
+            if state["received"] == count or not self._splice:
+                finish()
+
+        self._loop.add_reader(sock_fd, ready)
+        self._waiter = done
+        try:
+            await done
+        finally:
+            self._waiter = None
+            self._loop.remove_reader(sock_fd)
+            os.close(sock_fd)
+            if self.transport.is_closing():
+                self._close_pipe()
+        return state["received"]
+
+    def _drain_pipe(self, pipe_r, fd, position, pending):
+        while pending:
+            if self._splice:
+                try:
+                    written = os.splice(pipe_r, fd, pending, offset_dst=position[0])
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+                    # El destino no admite splice: se vacía la pipe a mano
+                    self._splice = False
+                    continue
+            else:
+                written = pwrite(fd, os.read(pipe_r, pending), position[0])
+            position[0] += written
+            pending -= written
+
+    def _close_pipe(self):
+        if self._pipe is not None:
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None
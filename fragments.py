@@ -0,0 +1,196 @@
+import time
+
+from lcp_logging import get_logger
+
+logger = get_logger("fragments")
+
+# Cabe en una trama Ethernet: 1500 - 20 (IP) - 8 (UDP) - 16 (prefijo)
+FRAGMENT_PAYLOAD = 1456
+FRAGMENT_PREFIX = 16
+# Fragmentos en vuelo por mensaje antes de esperar sus ACKs
+FRAGMENT_WINDOW = 64
+# Un ACK de un fragmento posterior delata la pérdida de los que van
+# FAST_RETRANSMIT_GAP o más por detrás (en LAN apenas hay reordenación)
+FAST_RETRANSMIT_GAP = 3
+
+
+def fragment_count(length):
+    return max(1, -(-length // FRAGMENT_PAYLOAD))
+
+
+def build_fragment(body_id, index, count, payload):
+    """Fragmento de cuerpo: BodyId (8) + índice (4) + total (4) + datos"""
+    return (
+        body_id.to_bytes(8, "big")
+        + index.to_bytes(4, "big")
+        + count.to_bytes(4, "big")
+        + payload
+    )
+
+
+def parse_fragment(data):
+    """(índice, total, datos) de un fragmento de cuerpo"""
+    return (
+        int.from_bytes(data[8:12], "big"),
+        int.from_bytes(data[12:16], "big"),
+        data[FRAGMENT_PREFIX:],
+    )
+
+
+class Reassembly:
+    """Reensamblado de un cuerpo fragmentado en un buffer de tamaño fijo
+
+    El buffer se reserva al aceptar el header, así que la memoria que usa un
+    mensaje queda acotada por el BodyLength anunciado. Los fragmentos pueden
+    llegar en cualquier orden y los duplicados se ignoran.
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.count = fragment_count(length)
+        self.missing = self.count
+        self._buffer = bytearray(length)
+        self._have = bytearray(self.count)
+
+    def add(self, index, count, payload):
+        """Guarda un fragmento; devuelve False si no encaja con el mensaje"""
+        if count != self.count or index >= self.count:
+            return False
+        offset = index * FRAGMENT_PAYLOAD
+        if len(payload) != min(FRAGMENT_PAYLOAD, self.length - offset):
+            return False
+        if not self._have[index]:
+            self._buffer[offset : offset + len(payload)] = payload
+            self._have[index] = 1
+            self.missing -= 1
+        return True
+
+    @property
+    def complete(self):
+        return self.missing == 0
+
+    def data(self):
+        return bytes(self._buffer)
+
+
+class FragmentSender:
+    """Envía un cuerpo fragmentado con repetición selectiva
+
+    Mantiene hasta window fragmentos en vuelo y cada uno se confirma por
+    separado, así que solo se reenvían los que se perdieron: tras un timeout
+    o cuando llega el ACK de un fragmento muy posterior. Tras max_retries
+    timeouts seguidos sin progreso el envío falla.
+    """
+
+    def __init__(
+        self,
+        loop,
+        sendto,
+        addr,
+        body_id,
+        payload,
+        rto,
+        on_rtt=None,
+        window=FRAGMENT_WINDOW,
+        max_retries=5,
+    ):
+        self.loop = loop
+        self.addr = addr
+        self.body_id = body_id
+        self.count = fragment_count(len(payload))
+        self.window = window
+        self.max_retries = max_retries
+        self._sendto = sendto
+        self._payload = payload
+        self._rto = rto
+        self._on_rtt = on_rtt
+        self._next = 0
+        self._acked = bytearray(self.count)
+        self._remaining = self.count
+        self._in_flight = {}  # índice -> [instante de envío, retransmitido]
+        self._done = loop.create_future()
+        self._timer = None
+        self._retries = 0
+
+    def fragment(self, index):
+        start = index * FRAGMENT_PAYLOAD
+        return build_fragment(
+            self.body_id,
+            index,
+            self.count,
+            self._payload[start : start + FRAGMENT_PAYLOAD],
+        )
+
+    async def run(self):
+        """Envía todos los fragmentos; True cuando el receptor los confirmó"""
+        self._fill_window()
+        self._arm()
+        try:
+            return await self._done
+        finally:
+            self._cancel_timer()
+
+    def on_ack(self, index):
+        """Procesa el ACK de un fragmento"""
+        if self._done.done() or index >= self.count or self._acked[index]:
+            return
+        self._acked[index] = 1
+        self._remaining -= 1
+        entry = self._in_flight.pop(index, None)
+        if entry is not None and not entry[1] and self._on_rtt is not None:
+            self._on_rtt(time.monotonic() - entry[0])  # Algoritmo de Karn
+        self._retries = 0
+
+        # Los que siguen sin confirmar muy por detrás se dan por perdidos
+        for lost, entry in self._in_flight.items():
+            if lost > index - FAST_RETRANSMIT_GAP:
+                break
+            if not entry[1]:
+                self._retransmit(lost)
+
+        if self._remaining == 0:
+            self.finish(True)
+            return
+        self._fill_window()
+        self._cancel_timer()
+        self._arm()
+
+    def finish(self, ok):
+        """Termina el envío (también si llega antes el ACK final del mensaje)"""
+        if not self._done.done():
+            self._done.set_result(ok)
+
+    def _fill_window(self):
+        while self._next < self.count and len(self._in_flight) < self.window:
+            index = self._next
+            self._next += 1
+            self._in_flight[index] = [time.monotonic(), False]
+            self._sendto(self.fragment(index), self.addr)
+
+    def _retransmit(self, index):
+        entry = self._in_flight[index]
+        entry[0] = time.monotonic()
+        entry[1] = True
+        self._sendto(self.fragment(index), self.addr)
+
+    def _on_timeout(self):
+        self._timer = None
+        self._retries += 1
+        if self._retries > self.max_retries:
+            logger.warning("Envío fragmentado a %s sin respuesta", self.addr)
+            self.finish(False)
+            return
+        # Repetición selectiva: solo los fragmentos aún sin confirmar
+        for index in list(self._in_flight):
+            self._retransmit(index)
+        self._arm()
+
+    def _arm(self):
+        self._timer = self.loop.call_later(
+            self._rto() * (2 ** self._retries), self._on_timeout
+        )
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import deque
+
+from lcp_logging import get_logger
+
+logger = get_logger("history")
+
+# Tamaño de bloque para leer los historiales JSONL desde el final
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Mensajes recientes por peer que recuerda el índice de duplicados
+DEDUP_WINDOW = 4096
+
+
+def message_digest(entry):
+    """Resumen de 8 bytes que identifica un mensaje por (timestamp, remitente, texto)"""
+    key = "\0".join(
+        str(entry.get(field)) for field in ("timestamp", "sender", "message")
+    )
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+
+
+class DedupIndex:
+    """Conjunto acotado de resúmenes de los últimos mensajes de un peer"""
+
+    def __init__(self, capacity=DEDUP_WINDOW):
+        self._order = deque()
+        self._digests = set()
+        self.capacity = capacity
+
+    def add(self, digest):
+        """Añade un resumen; devuelve False si ya estaba"""
+        if digest in self._digests:
+            return False
+        if len(self._order) >= self.capacity:
+            self._digests.discard(self._order.popleft())
+        self._order.append(digest)
+        self._digests.add(digest)
+        return True
+
+    def __contains__(self, digest):
+        return digest in self._digests
+
+
+class HistoryStore:
+    """Almacén de historial de chat por peer
+
+    Cada mensaje es un dict {"timestamp", "sender", "message"}. Los backends
+    solo añaden al final, de modo que guardar un mensaje cuesta lo mismo con
+    10 mensajes que con 10 millones. Los historiales antiguos en
+    <peer>.json se importan automáticamente la primera vez que se usan.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._imported = set()
+        self._dedup = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, peer_id, entry, dedup=True):
+        """Añade un mensaje al historial de peer_id
+
+        Con dedup, un mensaje idéntico a uno de los últimos DEDUP_WINDOW se
+        descarta en O(1) y se devuelve False.
+        """
+        with self._lock:
+            self._import_legacy(peer_id)
+            index = self._dedup_index(peer_id)
+            if not index.add(message_digest(entry)) and dedup:
+                return False
+            self._append(peer_id, [entry])
+            return True
+
+    def _dedup_index(self, peer_id):
+        """Índice de duplicados de peer_id, construido con la cola del historial
+
+        Tras un reinicio solo se leen los últimos DEDUP_WINDOW mensajes, nunca
+        el historial completo.
+        """
+        index = self._dedup.get(peer_id)
+        if index is None:
+            index = self._dedup[peer_id] = DedupIndex()
+            for entry in self._page(peer_id, index.capacity, None)[0]:
+                index.add(message_digest(entry))
+        return index
+
+    def iter_messages(self, peer_id):
+        """Recorre el historial de peer_id del más antiguo al más reciente"""
+        with self._lock:
+            self._import_legacy(peer_id)
+        return self._iter(peer_id)
+
+    def tail(self, peer_id, n):
+        """Devuelve los últimos n mensajes de peer_id sin leer el historial entero"""
+        return self.page(peer_id, n)[0]
+
+    def page(self, peer_id, limit, before=None):
+        """Devuelve hasta limit mensajes anteriores al cursor before
+
+        Retorna (mensajes, cursor) con los mensajes del más antiguo al más
+        reciente. El cursor se pasa como before para obtener la página
+        anterior; es None cuando ya no quedan mensajes más antiguos.
+        """
+        with self._lock:
+            self._import_legacy(peer_id)
+        if limit <= 0:
+            return [], before
+        return self._page(peer_id, limit, before)
+
+    def close(self):
+        pass
+
+    def _append(self, peer_id, entries):
+        raise NotImplementedError
+
+    def _iter(self, peer_id):
+        raise NotImplementedError
+
+    def _page(self, peer_id, limit, before):
+        raise NotImplementedError
+
+    def _import_legacy(self, peer_id):
+        """Importa <peer>.json (formato anterior, una lista JSON) una sola vez"""
+        if peer_id in self._imported:
+            return
+        self._imported.add(peer_id)
+
+        legacy_file = os.path.join(self.directory, f"{peer_id}.json")
+        if not os.path.exists(legacy_file):
+            return
+        try:
+            with open(legacy_file, "r") as f:
+                entries = json.load(f)
+        except Exception as e:
+            logger.warning("No se pudo importar el historial %s: %s", legacy_file, e)
+            return
+
+        if entries:
+            self._append(peer_id, entries)
+        os.replace(legacy_file, legacy_file + ".imported")
+        logger.info("Historial importado: %s (%d mensajes)", legacy_file, len(entries))
+
+
+class JSONLHistoryStore(HistoryStore):
+    """Historial en <peer>.jsonl, un mensaje JSON por línea"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self._files = {}
+
+    def path(self, peer_id):
+        return os.path.join(self.directory, f"{peer_id}.jsonl")
+
+    def _append(self, peer_id, entries):
+        f = self._files.get(peer_id)
+        if f is None:
+            f = self._files[peer_id] = open(self.path(peer_id), "a", encoding="utf-8")
+        f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+        f.flush()
+
+    def _iter(self, peer_id):
+        try:
+            with open(self.path(peer_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    # Una línea sin salto final es un append todavía en curso
+                    if not line.endswith("\n"):
+                        break
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def _page(self, peer_id, limit, before):
+        """Lee líneas hacia atrás por bloques; el cursor es un offset en bytes"""
+        try:
+            f = open(self.path(peer_id), "rb")
+        except FileNotFoundError:
+            return [], None
+
+        with f:
+            pos = self._last_line_end(f) if before is None else before
+            data = b""  # Cubre [pos, fin del segmento); termina en salto de línea
+            lines = []
+            while len(lines) < limit:
+                idx = data.rfind(b"\n", 0, len(data) - 1)
+                if idx == -1:
+                    if pos == 0:
+                        if data.strip():
+                            lines.append((0, data))
+                        break
+                    step = min(TAIL_BLOCK_SIZE, pos)
+                    pos -= step
+                    f.seek(pos)
+                    data = f.read(step) + data
+                    continue
+                if data[idx + 1 :].strip():
+                    lines.append((pos + idx + 1, data[idx + 1 :]))
+                data = data[: idx + 1]
+
+        if not lines:
+            return [], None
+        lines.reverse()
+        cursor = lines[0][0] or None
+        return [json.loads(line) for _, line in lines], cursor
+
+    @staticmethod
+    def _last_line_end(f):
+        """Offset tras el último salto de línea, ignorando un append en curso"""
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            step = min(TAIL_BLOCK_SIZE, end)
+            f.seek(end - step)
+            idx = f.read(step).rfind(b"\n")
+            if idx != -1:
+                return end - step + idx + 1
+            end -= step
+        return 0
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """Historial de todos los peers en una base SQLite (history.sqlite3)"""
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "history.sqlite3"), check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY, peer TEXT NOT NULL, timestamp TEXT, "
+            "sender TEXT, message TEXT)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS messages_peer ON messages (peer, id)"
+        )
+        self._db.commit()
+
+    def _append(self, peer_id, entries):
+        self._db.executemany(
+            "INSERT INTO messages (peer, timestamp, sender, message) VALUES (?, ?, ?, ?)",
+            [
+                (peer_id, e.get("timestamp"), e.get("sender"), e.get("message"))
+                for e in entries
+            ],
+        )
+        self._db.commit()
+
+    def _iter(self, peer_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT timestamp, sender, message FROM messages "
+                "WHERE peer = ? ORDER BY id",
+                (peer_id,),
+            ).fetchall()
+        for timestamp, sender, message in rows:
+            yield {"timestamp": timestamp, "sender": sender, "message": message}
+
+    def _page(self, peer_id, limit, before):
+        """El cursor es el id de fila del mensaje más antiguo devuelto"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, timestamp, sender, message FROM messages "
+                "WHERE peer = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (peer_id, before if before is not None else 2**63 - 1, limit),
+            ).fetchall()
+        if not rows:
+            return [], None
+        rows.reverse()
+        messages = [
+            {"timestamp": timestamp, "sender": sender, "message": message}
+            for _, timestamp, sender, message in rows
+        ]
+        return messages, rows[0][0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+BACKENDS = {"jsonl": JSONLHistoryStore, "sqlite": SQLiteHistoryStore}
+
+
+def open_history_store(directory, backend="jsonl"):
+    """Crea el almacén de historial del backend indicado ("jsonl" o "sqlite")"""
+    try:
+        return BACKENDS[backend](directory)
+    except KeyError:
+        raise ValueError(f"Backend de historial desconocido: {backend}")
@@ -0,0 +1,73 @@
+import hashlib
+import os
+
+# Algoritmos de digest por su identificador en el header (byte 64)
+DIGEST_BLAKE2B = 1
+DIGEST_SHA256 = 2
+DIGEST_NAMES = {"blake2b": DIGEST_BLAKE2B, "sha256": DIGEST_SHA256}
+# Ambos producen 32 bytes, que siguen al contenido en la conexión TCP
+DIGEST_SIZE = 32
+# El emisor envía con sendfile por tramos de HASH_SPAN bytes y calcula el
+# digest de cada uno mientras sale el siguiente, cuando aún está en caché;
+# también es la granularidad con que informa del progreso
+HASH_SPAN = 8 * 1024 * 1024
+HASH_READ_SIZE = 1024 * 1024
+
+
+def new_digest(algorithm):
+    """Objeto hashlib para el identificador algorithm, o None si no se conoce"""
+    if algorithm == DIGEST_BLAKE2B:
+        return hashlib.blake2b(digest_size=DIGEST_SIZE)
+    if algorithm == DIGEST_SHA256:
+        return hashlib.sha256()
+    return None
+
+
+def _hash_span(digest, f, offset, size):
+    """Añade al digest size bytes de f desde offset sin mover su posición"""
+    if hasattr(os, "pread"):
+        fd = f.fileno()
+        while size:
+            data = os.pread(fd, min(HASH_READ_SIZE, size), offset)
+            if not data:
+                raise EOFError("el archivo se acortó durante el envío")
+            digest.update(data)
+            offset += len(data)
+            size -= len(data)
+        return
+    # Sin pread (Windows): un descriptor propio para no tocar el del envío
+    with open(f.name, "rb") as g:
+        g.seek(offset)
+        while size:
+            data = g.read(min(HASH_READ_SIZE, size))
+            if not data:
+                raise EOFError("el archivo se acortó durante el envío")
+            digest.update(data)
+            size -= len(data)
+
+
+async def sendfile_hashed(loop, transport, f, offset, count, digest, on_progress=None):
+    """loop.sendfile de count bytes desde offset, añadiéndolos a digest si no es None
+
+    Cada tramo se lee para el digest justo después de enviarlo, en un hilo y
+    en paralelo con el envío del siguiente: las páginas siguen en la caché
+    del sistema, así que no hay lecturas de disco adicionales. Si se pasa
+    on_progress(n), se llama tras cada tramo enviado.
+    """
+    if digest is None and on_progress is None:
+        await loop.sendfile(transport, f, offset=offset, count=count)
+        return
+    end = offset + count
+    pending = None
+    while offset < end:
+        size = min(HASH_SPAN, end - offset)
+        await loop.sendfile(transport, f, offset=offset, count=size)
+        if on_progress is not None:
+            on_progress(size)
+        if digest is not None:
+            if pending is not None:
+                await pending
+            pending = loop.run_in_executor(None, _hash_span, digest, f, offset, size)
+        offset += size
+    if pending is not None:
+        await pending
@@ -0,0 +1,201 @@
+"""Extensiones de LCP sobre los bytes reservados
+
+LCP v1.0 reserva 50 bytes del header y 4 bytes de la respuesta. Los nodos
+LCPeer usan esos bytes para información adicional; un par v1.0 los ignora,
+así que el formato de cable sigue siendo compatible.
+
+Header (100 bytes):
+    [50]     EXT_MAGIC si el header lleva extensiones
+    [51]     Versión de las extensiones
+    [52:54]  Capacidades del emisor (CAP_*), big endian
+    [54]     Flags del header (HDR_*)
+    [55:59]  Id de sesión (con HDR_SESSION)
+    [59:63]  Número de secuencia en la sesión (con HDR_SESSION)
+    [55:63]  Clave de transferencia reanudable (operación 2 con HDR_RESUMABLE)
+    [63]     Códec del cuerpo o del archivo (con HDR_COMPRESSED), como su CAP_*
+    [64]     Algoritmo del digest del archivo (con HDR_DIGEST)
+
+Respuesta (25 bytes):
+    [21]    BodyId de la transacción que se confirma
+    [22]    Flags de respuesta (RESP_*)
+    [23:25] Capacidades (RESP_CAPS), ACK acumulado de sesión (RESP_SESSION_ACK)
+            o índice del fragmento confirmado (RESP_FRAGMENT_ACK)
+"""
+
+from importlib.util import find_spec
+
+EXT_MAGIC = 0x4C  # "L"
+EXT_VERSION = 1
+
+# Capacidades (bytes 52-53 del header, 23-24 de la respuesta a un Echo)
+CAP_SESSION = 0x0001  # Modo sesión con ventana de mensajes en vuelo
+CAP_FRAGMENT = 0x0002  # Cuerpos de operación 1 fragmentados
+CAP_RESUME = 0x0004  # Transferencias de archivo reanudables
+CAP_STRIPE = 0x0008  # Archivos por rangos en varias conexiones TCP
+CAP_ZLIB = 0x0010  # Cuerpos y archivos comprimidos con zlib
+CAP_BZ2 = 0x0020  # Ídem con bz2
+CAP_LZMA = 0x0040  # Ídem con lzma
+CAP_DIGEST = 0x0080  # Digest de integridad al final de cada archivo o rango
+
+
+def _codec_caps():
+    """Capacidades de compresión de los módulos presentes en este Python"""
+    modules = ((CAP_ZLIB, "zlib"), (CAP_BZ2, "_bz2"), (CAP_LZMA, "_lzma"))
+    return sum(cap for cap, module in modules if find_spec(module) is not None)
+
+
+LOCAL_CAPS = (
+    CAP_SESSION | CAP_FRAGMENT | CAP_RESUME | CAP_STRIPE | CAP_DIGEST | _codec_caps()
+)
+
+# Flags del header (byte 54)
+HDR_SESSION = 0x01  # Mensaje de sesión: el cuerpo va en el mismo datagrama
+HDR_FRAGMENTED = 0x02  # El cuerpo llegará en fragmentos
+HDR_RESUMABLE = 0x04  # Archivo reanudable: el header lleva su clave
+HDR_STRIPED = 0x08  # Archivo enviado por rangos en varias conexiones
+HDR_COMPRESSED = 0x10  # Cuerpo o archivo comprimido: el byte 63 indica el códec
+HDR_DIGEST = 0x20  # Contenido seguido de su digest: el byte 64 indica el algoritmo
+
+# Flags de respuesta (byte 22)
+RESP_BODY_ID = 0x01  # El byte 21 contiene el BodyId confirmado
+RESP_CAPS = 0x02  # Los bytes 23-24 contienen las capacidades del que responde
+RESP_SESSION_ACK = 0x04  # ACK acumulado: byte 21 = sesión, 23-24 = secuencia
+RESP_FRAGMENT_ACK = 0x08  # ACK de un fragmento: byte 21 = BodyId, 23-24 = índice
+
+
+def set_header_ext(header, caps=LOCAL_CAPS, flags=0):
+    """Marca un header con las extensiones y capacidades del emisor"""
+    header[50] = EXT_MAGIC
+    header[51] = EXT_VERSION
+    header[52:54] = caps.to_bytes(2, "big")
+    header[54] = flags
+    return header
+
+
+def header_caps(header):
+    """Capacidades que anuncia un header, o None si viene de un par v1.0"""
+    if len(header) >= 100 and header[50] == EXT_MAGIC:
+        return int.from_bytes(header[52:54], "big")
+    return None
+
+
+def header_flags(header):
+    if len(header) >= 100 and header[50] == EXT_MAGIC:
+        return header[54]
+    return 0
+
+
+def set_session_fields(header, session_id, seq):
+    """Marca un header como mensaje de sesión con su id y número de secuencia"""
+    header[54] |= HDR_SESSION
+    header[55:59] = session_id.to_bytes(4, "big")
+    header[59:63] = seq.to_bytes(4, "big")
+    return header
+
+
+def session_fields(header):
+    """(id de sesión, secuencia) de un mensaje de sesión"""
+    return (
+        int.from_bytes(header[55:59], "big"),
+        int.from_bytes(header[59:63], "big"),
+    )
+
+
+def set_transfer_key(header, key):
+    """Marca un header de archivo como reanudable con la clave key"""
+    header[54] |= HDR_RESUMABLE
+    header[55:63] = key.to_bytes(8, "big")
+    return header
+
+
+def header_transfer_key(header):
+    """Clave de transferencia reanudable del header, o None"""
+    if header_flags(header) & HDR_RESUMABLE:
+        return int.from_bytes(header[55:63], "big")
+    return None
+
+
+def set_compression(header, codec_cap):
+    """Marca un header como comprimido con el códec de capacidad codec_cap"""
+    header[54] |= HDR_COMPRESSED
+    header[63] = codec_cap
+    return header
+
+
+def header_compression(header):
+    """Capacidad del códec con que va comprimido el cuerpo, o None"""
+    if header_flags(header) & HDR_COMPRESSED:
+        return header[63]
+    return None
+
+
+def set_digest(header, algorithm):
+    """Marca un header de archivo para que el contenido lleve digest"""
+    header[54] |= HDR_DIGEST
+    header[64] = algorithm
+    return header
+
+
+def header_digest(header):
+    """Algoritmo del digest que acompaña al archivo, o None"""
+    if header_flags(header) & HDR_DIGEST:
+        return header[64]
+    return None
+
+
+def set_response_body_id(response, body_id):
+    """Marca una respuesta con el BodyId de la transacción que confirma"""
+    response[21] = body_id % 256
+    response[22] |= RESP_BODY_ID
+    return response
+
+
+def response_body_id(response):
+    """Devuelve el BodyId que confirma la respuesta, o None si no lo indica"""
+    if len(response) >= 25 and response[22] & RESP_BODY_ID:
+        return response[21]
+    return None
+
+
+def set_response_caps(response, caps=LOCAL_CAPS):
+    """Anuncia las capacidades propias en una respuesta"""
+    response[22] |= RESP_CAPS
+    response[23:25] = caps.to_bytes(2, "big")
+    return response
+
+
+def response_caps(response):
+    """Capacidades que anuncia una respuesta, o None si no las indica"""
+    if len(response) >= 25 and response[22] & RESP_CAPS:
+        return int.from_bytes(response[23:25], "big")
+    return None
+
+
+def set_session_ack(response, session_id, seq):
+    """Convierte una respuesta en ACK acumulado hasta seq de la sesión"""
+    response[21] = session_id % 256
+    response[22] |= RESP_SESSION_ACK
+    response[23:25] = (seq % 65536).to_bytes(2, "big")
+    return response
+
+
+def session_ack(response):
+    """(byte bajo del id de sesión, secuencia módulo 65536), o None"""
+    if len(response) >= 25 and response[22] & RESP_SESSION_ACK:
+        return response[21], int.from_bytes(response[23:25], "big")
+    return None
+
+
+def set_fragment_ack(response, body_id, index):
+    """Convierte una respuesta en el ACK del fragmento index del cuerpo body_id"""
+    set_response_body_id(response, body_id)
+    response[22] |= RESP_FRAGMENT_ACK
+    response[23:25] = index.to_bytes(2, "big")
+    return response
+
+
+def fragment_ack(response):
+    """(BodyId, índice del fragmento) que confirma la respuesta, o None"""
+    if len(response) >= 25 and response[22] & RESP_FRAGMENT_ACK:
+        return response[21], int.from_bytes(response[23:25], "big")
+    return None
@@ -0,0 +1,133 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import signal
+import sys
+import threading
+from collections import deque
+
+# Todos los loggers del nodo cuelgan de este
+ROOT = "lcp"
+FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+# Registros que guarda el buffer circular de eventos por defecto
+RING_SIZE = 1000
+
+_lock = threading.Lock()
+_listener = None
+_ring = None
+
+# Como biblioteca, el nodo no escribe nada por su cuenta: la salida la decide
+# la aplicación, con su propia configuración de logging o con configure_logging
+logging.getLogger(ROOT).addHandler(logging.NullHandler())
+
+
+def get_logger(name):
+    """Logger de un módulo dentro de la jerarquía "lcp" """
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class EventRing(logging.Handler):
+    """Los últimos capacity registros en memoria, sin formatear hasta volcarlos
+
+    emit solo añade el LogRecord a un deque de tamaño fijo (sin cerrojo:
+    append ya es atómico); el mensaje se compone con sus argumentos cuando
+    alguien pide el volcado.
+    """
+
+    def __init__(self, capacity=RING_SIZE, level=logging.INFO):
+        super().__init__(level)
+        self.records = deque(maxlen=capacity)
+        self.setFormatter(logging.Formatter(FORMAT))
+
+    def handle(self, record):
+        if self.filter(record):
+            self.records.append(record)
+        return record
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self, n=None):
+        """Los últimos n registros (todos si n es None), formateados"""
+        records = list(self.records)
+        if n is not None:
+            records = records[-n:] if n > 0 else []
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                lines.append(f"{record.levelname} {record.msg!r} {record.args!r}")
+        return lines
+
+
+def configure_logging(
+    level=logging.INFO, ring_size=RING_SIZE, ring_level=logging.INFO, stream=None
+):
+    """Configura la salida del logger "lcp"; llamarla de nuevo la reemplaza
+
+    Es para aplicaciones (la interfaz la llama al arrancar): sustituye los
+    handlers del logger "lcp" y deja de propagar sus registros al logger raíz.
+
+    Los registros de nivel level o superior se encolan y un hilo aparte los
+    escribe en stream (stderr por defecto), así que una salida lenta nunca
+    bloquea el event loop. Los de ring_level o level o superior quedan además
+    en un buffer circular de ring_size registros (ninguno con ring_size 0)
+    que se vuelca con dump_events.
+
+    Los eventos de DEBUG (uno por paquete o intento) no se crean siquiera si
+    ni level ni ring_level los piden: cada LogRecord cuesta unos microsegundos.
+    """
+    global _listener, _ring
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        records = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(records)
+        queue_handler.setLevel(level)
+        console = logging.StreamHandler(stream or sys.stderr)
+        console.setFormatter(logging.Formatter(FORMAT))
+        _listener = logging.handlers.QueueListener(records, console)
+        _listener.start()
+        ring_level = min(level, ring_level)
+        _ring = EventRing(ring_size, ring_level) if ring_size else None
+
+        logger = logging.getLogger(ROOT)
+        logger.handlers = [queue_handler] + ([_ring] if _ring else [])
+        logger.setLevel(min(level, ring_level) if _ring else level)
+        logger.propagate = False
+
+
+def dump_events(n=None):
+    """Los últimos n eventos del buffer circular (vacío sin configure_logging)"""
+    ring = _ring
+    return ring.dump(n) if ring is not None else []
+
+
+def dump_on_signal(signum=getattr(signal, "SIGUSR1", None), stream=None):
+    """Vuelca el buffer circular en stream (stderr) al recibir la señal signum
+
+    Solo se puede instalar desde el hilo principal; devuelve False si no es
+    posible (Windows no tiene SIGUSR1).
+    """
+    if signum is None:
+        return False
+
+    def handler(signum, frame):
+        out = stream or sys.stderr
+        out.write("\n".join(dump_events()) + "\n")
+        out.flush()
+
+    try:
+        signal.signal(signum, handler)
+    except ValueError:  # Fuera del hilo principal
+        return False
+    return True
+
+
+@atexit.register
+def _flush():
+    # Escribe lo que quede en la cola antes de salir
+    if _listener is not None:
+        _listener.stop()
@@ -1,5 +1,11 @@
 import threading
 import queue
+import time
+
+from lcp_logging import get_logger
+from metrics import MetricsRegistry
+
+logger = get_logger("callbacks")
 
 
 class MessageHandler:
@@ -7,10 +13,28 @@ class MessageHandler:
     Clase utilitaria para manejar suscripciones a eventos de mensajes
     """
 
-    def __init__(self):
+    def __init__(self, metrics=None):
         self._message_callbacks = []
+        self._event_callbacks = []
+        self._progress_callbacks = []
         self._callback_lock = threading.Lock()
         self._message_queue = queue.Queue()
+
+        metrics = metrics or MetricsRegistry(enabled=False)
+        metrics.gauge(
+            "lcp_handler_queue_depth",
+            "Notificaciones esperando a los callbacks",
+            fn=self._message_queue.qsize,
+        )
+        self._callbacks_run = metrics.counter(
+            "lcp_handler_callbacks_total", "Llamadas a callbacks"
+        )
+        self._callback_errors = metrics.counter(
+            "lcp_handler_callback_errors_total", "Callbacks que lanzaron una excepción"
+        )
+        self._callback_seconds = metrics.histogram(
+            "lcp_handler_callback_seconds", "Duración de cada llamada a un callback"
+        )
         threading.Thread(target=self._process_messages, daemon=True).start()
 
     def register_callback(self, callback):
@@ -24,21 +48,56 @@ class MessageHandler:
             if callback in self._message_callbacks:
                 self._message_callbacks.remove(callback)
 
+    def register_event_callback(self, callback):
+        """Registra una función que recibirá cada evento del historial"""
+        with self._callback_lock:
+            self._event_callbacks.append(callback)
+
+    def unregister_event_callback(self, callback):
+        """Elimina una función de la lista de callbacks de eventos"""
+        with self._callback_lock:
+            if callback in self._event_callbacks:
+                self._event_callbacks.remove(callback)
+
+    def register_progress_callback(self, callback):
+        """Registra una función que recibirá el progreso de cada transferencia"""
+        with self._callback_lock:
+            self._progress_callbacks.append(callback)
+
+    def unregister_progress_callback(self, callback):
+        """Elimina una función de la lista de callbacks de progreso"""
+        with self._callback_lock:
+            if callback in self._progress_callbacks:
+                self._progress_callbacks.remove(callback)
+
     def notify_message(self, sender_id, message):
         """Notifica un nuevo mensaje a todos los callbacks registrados"""
-        self._message_queue.put((sender_id, message))
+        self._message_queue.put((self._message_callbacks, (sender_id, message)))
+
+    def notify_event(self, event):
+        """Notifica un evento del historial a los callbacks de eventos, en orden"""
+        self._message_queue.put((self._event_callbacks, (event,)))
+
+    def notify_progress(self, progress):
+        """Notifica el progreso de una transferencia a los callbacks de progreso"""
+        if self._progress_callbacks:
+            self._message_queue.put((self._progress_callbacks, (progress,)))
 
     def _process_messages(self):
         """Procesa mensajes en la cola y notifica a los callbacks"""
         while True:
             try:
-                sender_id, message = self._message_queue.get()
+                callbacks, args = self._message_queue.get()
                 with self._callback_lock:
-                    for callback in self._message_callbacks:
+                    for callback in callbacks:
+                        started = time.monotonic()
                         try:
-                            callback(sender_id, message)
+                            callback(*args)
                         except Exception as e:
-                            print(f"Error en callback de mensajes: {e}")
+                            self._callback_errors.inc()
+                            logger.exception("Error en callback de mensajes: %s", e)
+                        self._callbacks_run.inc()
+                        self._callback_seconds.observe(time.monotonic() - started)
                 self._message_queue.task_done()
             except Exception as e:
-                print(f"Error en procesador de mensajes: {e}")
+                logger.exception("Error en procesador de mensajes: %s", e)
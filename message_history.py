@@ -0,0 +1,98 @@
+from collections import deque
+from itertools import islice
+
+
+class HistoryRecord:
+    """Un mensaje del historial en memoria
+
+    seq es monotónico por cliente. kind es "received", "sent", "broadcast"
+    (recibido) o "broadcast_sent". peer_id es la conversación a la que
+    pertenece (o "Broadcast") y sender quién lo escribió.
+    """
+
+    __slots__ = ("seq", "kind", "peer_id", "sender", "message", "timestamp")
+
+    def __init__(self, seq, kind, peer_id, sender, message, timestamp):
+        self.seq = seq
+        self.kind = kind
+        self.peer_id = peer_id
+        self.sender = sender
+        self.message = message
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return (
+            f"HistoryRecord(seq={self.seq}, kind={self.kind!r}, "
+            f"peer_id={self.peer_id!r}, sender={self.sender!r})"
+        )
+
+
+class MessageHistory:
+    """Historial en memoria sobre un buffer circular de tamaño fijo
+
+    Añadir un mensaje es O(1) y no copia nada: al llenarse, el registro más
+    antiguo se sobrescribe. Un índice por peer permite consultar una
+    conversación sin recorrer las demás. Con capacity <= 0 no hay límite.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._slots = [None] * capacity if capacity > 0 else []
+        self._first_seq = 1
+        self._next_seq = 1
+        self._by_peer = {}
+
+    def append(self, kind, peer_id, sender, message, timestamp):
+        """Añade un mensaje y devuelve su HistoryRecord"""
+        record = HistoryRecord(
+            self._next_seq, kind, peer_id, sender, message, timestamp
+        )
+        self._next_seq += 1
+
+        if self.capacity > 0:
+            slot = record.seq % self.capacity
+            evicted = self._slots[slot]
+            if evicted is not None:
+                # El más antiguo del buffer es también el más antiguo de su peer
+                peer_records = self._by_peer[evicted.peer_id]
+                peer_records.popleft()
+                if not peer_records:
+                    del self._by_peer[evicted.peer_id]
+                self._first_seq = evicted.seq + 1
+            self._slots[slot] = record
+        else:
+            self._slots.append(record)
+
+        self._by_peer.setdefault(peer_id, deque()).append(record)
+        return record
+
+    def recent(self, peer_id, n):
+        """Últimos n mensajes con peer_id, del más antiguo al más nuevo"""
+        peer_records = self._by_peer.get(peer_id)
+        if not peer_records or n <= 0:
+            return []
+        return list(islice(reversed(peer_records), n))[::-1]
+
+    def since(self, seq):
+        """Mensajes con número de secuencia mayor que seq"""
+        start = max(seq + 1, self._first_seq)
+        return [self._get(s) for s in range(start, self._next_seq)]
+
+    def peers(self):
+        """Conversaciones con mensajes en memoria"""
+        return list(self._by_peer)
+
+    @property
+    def last_seq(self):
+        return self._next_seq - 1
+
+    def _get(self, seq):
+        if self.capacity > 0:
+            return self._slots[seq % self.capacity]
+        return self._slots[seq - 1]
+
+    def __len__(self):
+        return self._next_seq - self._first_seq
+
+    def __iter__(self):
+        return iter(self.since(0))
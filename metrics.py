@@ -0,0 +1,234 @@
+import asyncio
+import math
+from bisect import bisect_left
+
+# Límites (en segundos) de los histogramas de latencia por defecto
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Líneas de cabecera que se aceptan en una petición al endpoint
+MAX_REQUEST_LINES = 100
+
+
+class Counter:
+    """Valor que solo crece"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Gauge:
+    """Valor que sube y baja; con fn, se lee de fn() al consultarlo"""
+
+    __slots__ = ("_value", "_fn")
+
+    def __init__(self, fn=None):
+        self._value = 0
+        self._fn = fn
+
+    @property
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, n=1):
+        self._value += n
+
+    def dec(self, n=1):
+        self._value -= n
+
+
+class Histogram:
+    """Distribución de observaciones en cubetas fijas, más su suma y su número"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # La última es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def value(self):
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += n
+            buckets[bound] = cumulative
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class _NullMetric:
+    """Sustituye a cualquier métrica cuando el registro está desactivado"""
+
+    __slots__ = ()
+    value = None
+
+    def inc(self, n=1):
+        pass
+
+    def dec(self, n=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def labels(self, *values):
+        return self
+
+
+NULL_METRIC = _NullMetric()
+
+
+class _Family:
+    """Una métrica con etiquetas: un hijo por cada combinación de valores"""
+
+    def __init__(self, kind, name, help, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._factory = factory
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._factory()
+        return child
+
+
+class MetricsRegistry:
+    """Contadores, gauges e histogramas de un nodo, con exportación Prometheus
+
+    Desactivado, cada métrica que entrega es NULL_METRIC, cuyos métodos no
+    hacen nada: el código instrumentado no necesita comprobar nada y el
+    coste es el de una llamada vacía. Las métricas no usan cerrojos; se
+    actualizan desde el event loop o, como mucho, desde un hilo más.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._families = {}
+
+    def counter(self, name, help, labels=()):
+        return self._register("counter", name, help, labels, Counter)
+
+    def gauge(self, name, help, labels=(), fn=None):
+        """Gauge; con fn (sin etiquetas), su valor se calcula al consultarlo"""
+        return self._register("gauge", name, help, labels, lambda: Gauge(fn))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(
+            "histogram", name, help, labels, lambda: Histogram(buckets)
+        )
+
+    def _register(self, kind, name, help, labelnames, factory):
+        if not self.enabled:
+            return NULL_METRIC
+        if name in self._families:
+            raise ValueError(f"métrica duplicada: {name}")
+        family = self._families[name] = _Family(
+            kind, name, help, tuple(labelnames), factory
+        )
+        # Sin etiquetas, la métrica es directamente su único hijo
+        return family if family.labelnames else family.labels()
+
+    def snapshot(self):
+        """Valores actuales: por nombre, o por nombre y tupla de etiquetas"""
+        result = {}
+        for family in list(self._families.values()):
+            values = {
+                labels: child.value for labels, child in list(family.children.items())
+            }
+            result[family.name] = values if family.labelnames else values.get(())
+        return result
+
+    def render(self):
+        """Valores actuales en el formato de texto de Prometheus"""
+        lines = []
+        for family in list(self._families.values()):
+            lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in list(family.children.items()):
+                labels = list(zip(family.labelnames, values))
+                if family.kind != "histogram":
+                    lines.append(
+                        f"{family.name}{_labels(labels)} {_number(child.value)}"
+                    )
+                    continue
+                value = child.value
+                for bound, count in value["buckets"].items():
+                    le = labels + [("le", _number(bound))]
+                    lines.append(f"{family.name}_bucket{_labels(le)} {count}")
+                suffix = _labels(labels)
+                lines.append(f"{family.name}_sum{suffix} {_number(value['sum'])}")
+                lines.append(f"{family.name}_count{suffix} {value['count']}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return _escape_help(str(value)).replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(v)}"' for name, v in pairs) + "}"
+
+
+async def serve_metrics(registry, host="127.0.0.1", port=9464):
+    """Servidor HTTP mínimo que entrega registry.render() en GET /metrics"""
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            for _ in range(MAX_REQUEST_LINES):
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request.split()
+            path = parts[1].split(b"?")[0] if len(parts) >= 2 else b""
+            if parts[:1] == [b"GET"] and path in (b"/", b"/metrics"):
+                status, body = "200 OK", registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,206 @@
+import ipaddress
+import platform
+import re
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from lcp_logging import get_logger
+
+logger = get_logger("interfaces")
+
+Interface = namedtuple("Interface", ["name", "address", "netmask", "broadcast"])
+
+# ioctl de Linux para consultar una interfaz (linux/sockios.h)
+SIOCGIFFLAGS = 0x8913
+SIOCGIFADDR = 0x8915
+SIOCGIFBRDADDR = 0x8919
+SIOCGIFNETMASK = 0x891B
+IFF_UP = 0x1
+IFF_BROADCAST = 0x2
+IFF_LOOPBACK = 0x8
+
+
+def _interface(name, address, netmask, broadcast=None):
+    if broadcast is None:
+        network = ipaddress.IPv4Network(f"{address}/{netmask}", strict=False)
+        broadcast = str(network.broadcast_address)
+    return Interface(name, address, netmask, broadcast)
+
+
+def _scan_linux():
+    """Enumera las interfaces IPv4 activas mediante ioctl, sin subprocesos"""
+    import fcntl
+
+    interfaces = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            ifreq = struct.pack("256s", name.encode("utf-8")[:15])
+            try:
+                flags = struct.unpack(
+                    "H", fcntl.ioctl(s.fileno(), SIOCGIFFLAGS, ifreq)[16:18]
+                )[0]
+                if not flags & IFF_UP or flags & IFF_LOOPBACK:
+                    continue
+                address = socket.inet_ntoa(
+                    fcntl.ioctl(s.fileno(), SIOCGIFADDR, ifreq)[20:24]
+                )
+                netmask = socket.inet_ntoa(
+                    fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, ifreq)[20:24]
+                )
+                broadcast = None
+                if flags & IFF_BROADCAST:
+                    broadcast = socket.inet_ntoa(
+                        fcntl.ioctl(s.fileno(), SIOCGIFBRDADDR, ifreq)[20:24]
+                    )
+            except OSError:
+                continue  # Sin dirección IPv4
+            interfaces.append(_interface(name, address, netmask, broadcast))
+    return interfaces
+
+
+def _scan_windows():
+    """Enumera las interfaces IPv4 a partir de la salida de ipconfig"""
+    output = subprocess.run(
+        ["ipconfig"], capture_output=True, text=True, shell=True
+    ).stdout
+
+    interfaces = []
+    name, address = None, None
+    for line in output.split("\n"):
+        if line and not line[0].isspace() and line.rstrip().endswith(":"):
+            name, address = line.strip().rstrip(":"), None
+            continue
+        match = re.search(r": (\d+\.\d+\.\d+\.\d+)", line)
+        if not match:
+            continue
+        if "IPv4" in line:
+            address = match.group(1)
+        elif address and ("Subnet Mask" in line or "scara de subred" in line):
+            interfaces.append(_interface(name, address, match.group(1)))
+            address = None
+    return interfaces
+
+
+def _default_route_address():
+    """IP de la interfaz con la ruta por defecto (no envía ningún paquete)"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect(("8.8.8.8", 80))
+        return s.getsockname()[0]
+
+
+def _fingerprint_windows():
+    """Huella barata de las direcciones locales
+
+    Evita lanzar ipconfig en cada consulta.
+    """
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+        return tuple(sorted({info[4][0] for info in infos}))
+    except OSError:
+        return None
+
+
+class InterfaceInventory:
+    """Inventario en caché de las interfaces IPv4 y sus direcciones broadcast
+
+    La enumeración se hace una vez y se repite como mucho cada
+    check_interval segundos. En Linux la comprobación son unas pocas
+    llamadas ioctl; en Windows se compara primero una huella barata de las
+    direcciones locales y solo se vuelve a ejecutar ipconfig si cambió.
+    version aumenta cada vez que cambia el conjunto de interfaces.
+    """
+
+    def __init__(self, check_interval=10):
+        self.check_interval = check_interval
+        self.version = 0
+        self._interfaces = []
+        self._primary = None
+        self._fingerprint = None
+        self._last_check = None
+        self._lock = threading.Lock()
+        self._system = platform.system()
+
+    def stale(self):
+        """True si toca volver a comprobar las interfaces"""
+        return (
+            self._last_check is None
+            or time.monotonic() - self._last_check >= self.check_interval
+        )
+
+    def refresh(self, force=False):
+        """Vuelve a enumerar las interfaces si cambiaron; devuelve True si cambiaron"""
+        with self._lock:
+            if not force and not self.stale():
+                return False
+            self._last_check = time.monotonic()
+
+            if self._system == "Windows":
+                fingerprint = _fingerprint_windows()
+                if not force and fingerprint == self._fingerprint and self._interfaces:
+                    return False
+                self._fingerprint = fingerprint
+
+            try:
+                interfaces = self._scan()
+            except Exception as e:
+                logger.warning("Error enumerando interfaces de red: %s", e)
+                interfaces = []
+            if not interfaces:
+                interfaces = self._fallback()
+
+            if interfaces == self._interfaces:
+                return False
+            self._interfaces = interfaces
+            self._primary = self._find_primary(interfaces)
+            self.version += 1
+            logger.info(
+                "Interfaces de red: %s",
+                ", ".join(f"{i.name} {i.address}/{i.netmask}" for i in interfaces),
+            )
+            return True
+
+    def interfaces(self):
+        """Interfaces IPv4 activas (sin loopback)"""
+        self.refresh()
+        return list(self._interfaces)
+
+    def broadcast_addresses(self):
+        """Direcciones broadcast de todas las subredes conectadas"""
+        self.refresh()
+        return sorted({i.broadcast for i in self._interfaces})
+
+    def primary(self):
+        """Interfaz con la ruta por defecto, o la primera disponible"""
+        self.refresh()
+        return self._primary
+
+    @staticmethod
+    def _find_primary(interfaces):
+        if not interfaces:
+            return None
+        try:
+            address = _default_route_address()
+        except OSError:
+            address = None
+        for interface in interfaces:
+            if interface.address == address:
+                return interface
+        return interfaces[0]
+
+    def _scan(self):
+        if self._system == "Linux":
+            return _scan_linux()
+        if self._system == "Windows":
+            return _scan_windows()
+        return []
+
+    def _fallback(self):
+        """Sin enumeración disponible: IP de la ruta por defecto con máscara /24"""
+        try:
+            return [_interface("default", _default_route_address(), "255.255.255.0")]
+        except OSError:
+            return []
@@ -0,0 +1,252 @@
+import json
+import os
+import time
+from collections.abc import MutableMapping
+
+from lcp_logging import get_logger
+
+logger = get_logger("peers")
+
+# Timeout de retransmisión (RFC 6298) en segundos: inicial sin muestras de RTT,
+# y límites; el máximo es el timeout fijo de LCP v1.0
+RTO_INITIAL = 1.0
+RTO_MIN = 0.2
+RTO_MAX = 5.0
+CLOCK_GRANULARITY = 0.001
+
+
+class PeerInfo:
+    """Estado conocido de un peer"""
+
+    __slots__ = (
+        "peer_id",
+        "addr",
+        "state",
+        "last_seen",
+        "rtt",
+        "srtt",
+        "rttvar",
+        "rto",
+        "probes",
+        "caps",
+    )
+
+    def __init__(self, peer_id, addr):
+        self.peer_id = peer_id
+        self.addr = addr
+        self.state = "alive"  # "alive", "suspect" o "dead"
+        self.last_seen = time.monotonic()
+        self.rtt = None
+        self.srtt = None
+        self.rttvar = None
+        self.rto = RTO_INITIAL
+        self.probes = 0
+        self.caps = None  # Capacidades LCPeer anunciadas; None = par v1.0
+
+    def as_dict(self):
+        return {
+            "peer_id": self.peer_id,
+            "addr": self.addr,
+            "state": self.state,
+            "last_seen": self.last_seen,
+            "rtt": self.rtt,
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "rto": self.rto,
+            "caps": self.caps,
+        }
+
+
+class PeerRegistry(MutableMapping):
+    """Tabla de peers con vida útil y seguimiento de actividad
+
+    Se comporta como el antiguo dict peer_id -> dirección, pero cada entrada
+    guarda cuándo se oyó por última vez al peer, su RTT y su estado. Un peer
+    que calla más de ttl segundos pasa a "suspect" y se le sondea por
+    unicast; si tampoco responde a max_probes sondeos se elimina, de modo
+    que los envíos a peers que se fueron fallan al instante.
+    """
+
+    def __init__(self, ttl=30, max_probes=2):
+        self.ttl = ttl
+        self.max_probes = max_probes
+        self.version = 0  # Aumenta cuando entra, sale o cambia de dirección un peer
+        self._peers = {}
+        self._by_addr = {}
+
+    def touch(self, peer_id, addr):
+        """Anota que peer_id está vivo en addr; devuelve True si es nuevo o se movió"""
+        info = self._peers.get(peer_id)
+        if info is not None and info.addr == addr:
+            self._mark_alive(info)
+            return False
+
+        if info is not None:
+            self._by_addr.pop(info.addr, None)
+        else:
+            info = self._peers[peer_id] = PeerInfo(peer_id, addr)
+        info.addr = addr
+        self._by_addr[addr] = info
+        self._mark_alive(info)
+        self.version += 1
+        return True
+
+    def seen(self, addr):
+        """Anota actividad de la dirección addr (cualquier datagrama recibido)"""
+        info = self._by_addr.get(addr)
+        if info is not None:
+            self._mark_alive(info)
+
+    def record_rtt(self, peer_id, sample):
+        """Registra una muestra de RTT en segundos y recalcula el RTO (RFC 6298)
+
+        Por el algoritmo de Karn, solo deben llegar aquí muestras de envíos
+        que no se retransmitieron.
+        """
+        info = self._peers.get(peer_id)
+        if info is None:
+            return
+        info.rtt = sample
+        if info.srtt is None:
+            info.srtt = sample
+            info.rttvar = sample / 2
+        else:
+            info.rttvar = 0.75 * info.rttvar + 0.25 * abs(info.srtt - sample)
+            info.srtt = 0.875 * info.srtt + 0.125 * sample
+        self._update_rto(info)
+
+    def rto(self, peer_id):
+        """Timeout de retransmisión actual para peer_id"""
+        info = self._peers.get(peer_id)
+        return RTO_INITIAL if info is None else info.rto
+
+    def backoff(self, peer_id):
+        """Duplica el RTO de peer_id tras un timeout, hasta la próxima muestra"""
+        info = self._peers.get(peer_id)
+        if info is not None:
+            info.rto = min(info.rto * 2, RTO_MAX)
+
+    def set_caps(self, peer_id, caps):
+        """Anota las capacidades que anunció peer_id"""
+        info = self._peers.get(peer_id)
+        if info is not None:
+            info.caps = caps
+
+    def mark_failed(self, peer_id):
+        """Un envío agotó sus reintentos: el peer pasa a sospechoso"""
+        info = self._peers.get(peer_id)
+        if info is not None and info.state == "alive":
+            info.state = "suspect"
+
+    def sweep(self):
+        """Revisa la vida útil de los peers
+
+        Devuelve (a_sondear, eliminados): los peers sospechosos a los que hay
+        que enviar un Echo unicast y los que se dieron por muertos.
+        """
+        now = time.monotonic()
+        to_probe, removed = [], []
+        for info in list(self._peers.values()):
+            if info.state == "alive" and now - info.last_seen < self.ttl:
+                continue
+            if info.probes >= self.max_probes:
+                info.state = "dead"
+                self.remove(info.peer_id)
+                removed.append(info)
+            else:
+                info.state = "suspect"
+                info.probes += 1
+                to_probe.append(info)
+        return to_probe, removed
+
+    def info(self, peer_id):
+        """PeerInfo de peer_id, o None"""
+        return self._peers.get(peer_id)
+
+    def by_addr(self, addr):
+        return self._by_addr.get(addr)
+
+    def remove(self, peer_id):
+        info = self._peers.pop(peer_id, None)
+        if info is not None:
+            if self._by_addr.get(info.addr) is info:
+                del self._by_addr[info.addr]
+            self.version += 1
+        return info
+
+    def snapshot(self):
+        """Estado de todos los peers, para monitorización"""
+        return [info.as_dict() for info in self._peers.values()]
+
+    def save(self, path):
+        """Guarda los peers conocidos para arrancar en caliente la próxima vez"""
+        entries = [
+            {
+                "peer_id": info.peer_id,
+                "addr": list(info.addr),
+                "srtt": info.srtt,
+                "rttvar": info.rttvar,
+            }
+            for info in self._peers.values()
+        ]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Carga los peers guardados como sospechosos hasta que respondan
+
+        Devuelve los PeerInfo cargados, a los que hay que sondear.
+        """
+        try:
+            with open(path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.warning("No se pudo leer la caché de peers %s: %s", path, e)
+            return []
+
+        loaded = []
+        for entry in entries:
+            peer_id, addr = entry["peer_id"], tuple(entry["addr"])
+            if peer_id in self._peers:
+                continue
+            self.touch(peer_id, addr)
+            info = self._peers[peer_id]
+            info.state = "suspect"
+            info.srtt = entry.get("srtt")
+            info.rttvar = entry.get("rttvar")
+            if info.srtt is not None and info.rttvar is not None:
+                self._update_rto(info)
+            loaded.append(info)
+        return loaded
+
+    @staticmethod
+    def _update_rto(info):
+        rto = info.srtt + max(CLOCK_GRANULARITY, 4 * info.rttvar)
+        info.rto = min(max(rto, RTO_MIN), RTO_MAX)
+
+    @staticmethod
+    def _mark_alive(info):
+        info.last_seen = time.monotonic()
+        info.state = "alive"
+        info.probes = 0
+
+    # Interfaz de dict peer_id -> dirección, compatible con el código existente
+    def __getitem__(self, peer_id):
+        return self._peers[peer_id].addr
+
+    def __setitem__(self, peer_id, addr):
+        self.touch(peer_id, addr)
+
+    def __delitem__(self, peer_id):
+        if self.remove(peer_id) is None:
+            raise KeyError(peer_id)
+
+    def __iter__(self):
+        return iter(list(self._peers))
+
+    def __len__(self):
+        return len(self._peers)
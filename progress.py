@@ -0,0 +1,162 @@
+import itertools
+import logging
+import os
+import time
+
+from lcp_logging import get_logger
+
+logger = get_logger("progress")
+
+
+class TransferProgress:
+    """Progreso de una transferencia de archivo
+
+    direction es "in" (entrante) u "out" (saliente). done cuenta los bytes
+    que ya tiene el receptor, incluidos los resumed que tenía de un intento
+    anterior. rate es el throughput del último intervalo y average el de la
+    transferencia, en bytes por segundo. state es "active", "completed" o
+    "failed".
+    """
+
+    __slots__ = (
+        "transfer_id",
+        "direction",
+        "peer",
+        "name",
+        "total",
+        "done",
+        "resumed",
+        "started",
+        "elapsed",
+        "rate",
+        "state",
+        "_mark_time",
+        "_mark_done",
+    )
+
+    def __init__(self, transfer_id, direction, peer, name, total):
+        self.transfer_id = transfer_id
+        self.direction = direction
+        self.peer = peer
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.resumed = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self.rate = 0.0
+        self.state = "active"
+        self._mark_time = self.started
+        self._mark_done = 0
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 1.0
+
+    @property
+    def average(self):
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.done - self.resumed) / self.elapsed
+
+    @property
+    def eta(self):
+        """Segundos que faltan al ritmo actual, o None si aún no se puede estimar"""
+        if self.state != "active":
+            return 0.0
+        rate = self.rate or self.average
+        if rate <= 0:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def copy(self):
+        other = TransferProgress.__new__(TransferProgress)
+        for name in TransferProgress.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def __repr__(self):
+        return (
+            f"TransferProgress(id={self.transfer_id}, {self.direction}, "
+            f"peer={self.peer!r}, {self.done}/{self.total}, state={self.state!r})"
+        )
+
+
+def describe(progress):
+    """Una línea legible con el progreso, el throughput y el tiempo restante"""
+    arrow = "→" if progress.direction == "out" else "←"
+    label = os.path.basename(progress.name or f"archivo {progress.transfer_id}")
+    text = (
+        f"{arrow} {progress.peer}: {label} {progress.fraction:.1%} "
+        f"({progress.done / 1e6:.1f}/{progress.total / 1e6:.1f} MB), "
+        f"{progress.rate / 1e6:.1f} MB/s (media {progress.average / 1e6:.1f} MB/s)"
+    )
+    if progress.state != "active":
+        return f"{text}, {'completado' if progress.state == 'completed' else 'fallido'}"
+    eta = progress.eta
+    return f"{text}, quedan {eta:.0f} s" if eta is not None else text
+
+
+def log_progress(progress):
+    """Callback de progreso para uso sin interfaz: registra cada actualización
+
+    describe solo se llama si el nivel INFO de "lcp.progress" está activo.
+    """
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("%s", describe(progress))
+
+
+class ProgressTracker:
+    """Progreso de las transferencias en curso, notificado por intervalos
+
+    Cada transferencia se notifica como mucho una vez cada interval segundos.
+
+    advance se llama con cada trozo enviado o recibido y solo suma bytes y
+    consulta el reloj; el cálculo del throughput y la copia que se pasa a
+    notify se hacen una vez por intervalo, al empezar y al terminar.
+    """
+
+    def __init__(self, notify, interval=0.5):
+        self._notify = notify
+        self.interval = interval
+        self._active = {}
+        self._ids = itertools.count(1)
+
+    def start(self, direction, peer, total, name=None):
+        """Registra una transferencia nueva y devuelve su TransferProgress"""
+        progress = TransferProgress(next(self._ids), direction, peer, name, total)
+        self._active[progress.transfer_id] = progress
+        self._report(progress, progress.started)
+        return progress
+
+    def rewind(self, progress, done):
+        """Fija los bytes que el receptor ya tiene al empezar (o reintentar) un envío"""
+        progress.done = progress.resumed = done
+        progress._mark_time = time.monotonic()
+        progress._mark_done = done
+
+    def advance(self, progress, nbytes):
+        progress.done += nbytes
+        now = time.monotonic()
+        if now - progress._mark_time >= self.interval:
+            self._report(progress, now)
+
+    def finish(self, progress, ok):
+        if progress.state != "active":
+            return
+        progress.state = "completed" if ok else "failed"
+        del self._active[progress.transfer_id]
+        self._report(progress, time.monotonic())
+
+    def snapshot(self):
+        """Copias del progreso de las transferencias activas"""
+        return [progress.copy() for progress in list(self._active.values())]
+
+    def _report(self, progress, now):
+        span = now - progress._mark_time
+        if span > 0:
+            progress.rate = (progress.done - progress._mark_done) / span
+        progress.elapsed = now - progress.started
+        progress._mark_time = now
+        progress._mark_done = progress.done
+        self._notify(progress.copy())
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+from lcp_extensions import response_body_id
+
+
+class ResponseRouter:
+    """Enruta las respuestas de 25 bytes a la transacción que las espera
+
+    Cada transacción en vuelo se identifica por (dirección del peer, BodyId) y
+    tiene como mucho un future pendiente. Las respuestas que indican su BodyId
+    van directamente a su transacción; las de pares v1.0, que no lo indican y
+    dejan a cero los bytes reservados, solo se entregan si hay exactamente una
+    transacción esperando respuesta con esa dirección (el nodo no abre más de
+    una a la vez con un par v1.0). Una respuesta con extensiones pero sin
+    BodyId (la respuesta a un Echo, que solo lleva capacidades) no es de
+    ninguna transacción.
+
+    Un colector recibe además las respuestas con su BodyId que no pertenecen
+    a ninguna transacción, vengan de donde vengan (respuestas a un broadcast).
+    Los BodyId de los colectores no se reservan para transacciones unicast.
+    """
+
+    def __init__(self):
+        # addr -> OrderedDict[body_id -> Future | None], en orden de apertura
+        self._transactions = {}
+        self._next_id = 0
+        # body_id -> callback(addr, response) -> bool, en orden de registro
+        self._collectors = OrderedDict()
+
+    def allocate(self, addr, preferred=None):
+        """Reserva un BodyId libre para una nueva transacción con addr"""
+        open_ids = self._transactions.setdefault(addr, OrderedDict())
+        if len(open_ids) >= 256:
+            raise RuntimeError(f"Demasiadas transacciones abiertas con {addr}")
+
+        body_id = self._free_id(preferred, lambda i: i in open_ids)
+        open_ids[body_id] = None
+        return body_id
+
+    def allocate_broadcast(self, callback, preferred=None):
+        """Reserva un BodyId libre con cualquier dirección y colecta sus respuestas"""
+        body_id = self._free_id(
+            preferred,
+            lambda i: any(i in ids for ids in self._transactions.values()),
+        )
+        self.collect(body_id, callback)
+        return body_id
+
+    def _free_id(self, preferred, taken):
+        body_id = (self._next_id if preferred is None else preferred) % 256
+        for _ in range(256):
+            if body_id not in self._collectors and not taken(body_id):
+                self._next_id = body_id + 1
+                return body_id
+            body_id = (body_id + 1) % 256
+        raise RuntimeError("No quedan BodyId libres")
+
+    def release(self, addr, body_id):
+        """Cierra la transacción y libera su BodyId"""
+        open_ids = self._transactions.get(addr)
+        if open_ids is None:
+            return
+        future = open_ids.pop(body_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+        if not open_ids:
+            del self._transactions[addr]
+
+    def expect(self, addr, body_id, loop):
+        """Devuelve un future que se resolverá con la próxima respuesta"""
+        future = loop.create_future()
+        self._transactions.setdefault(addr, OrderedDict())[body_id] = future
+        return future
+
+    def collect(self, body_id, callback):
+        """Entrega a callback(addr, response) las respuestas sueltas con body_id"""
+        self._collectors[body_id] = callback
+
+    def stop_collecting(self, body_id):
+        self._collectors.pop(body_id, None)
+
+    def dispatch(self, addr, response):
+        """Entrega una respuesta a su transacción; False si nadie la esperaba"""
+        body_id = response_body_id(response)
+        if body_id is None and any(response[21:25]):
+            # Extensiones sin BodyId: no confirma ninguna transacción
+            return False
+        open_ids = self._transactions.get(addr)
+        if open_ids:
+            if body_id is not None:
+                future = open_ids.get(body_id)
+            else:
+                # Con varias esperando no se sabe de cuál es la respuesta
+                waiting = [
+                    f for f in open_ids.values() if f is not None and not f.done()
+                ]
+                future = waiting[0] if len(waiting) == 1 else None
+            if future is not None and not future.done():
+                future.set_result(bytes(response))
+                return True
+
+        # Sin transacción: puede ser la respuesta de un peer a un broadcast.
+        # Las de pares v1.0 no indican BodyId y van al colector más reciente.
+        if body_id is not None:
+            collector = self._collectors.get(body_id)
+        elif self._collectors:
+            collector = next(reversed(self._collectors.values()))
+        else:
+            collector = None
+        if collector is None:
+            return False
+        return collector(addr, bytes(response))
+
+    def in_flight(self):
+        """Número de transacciones abiertas"""
+        return sum(len(ids) for ids in self._transactions.values())
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from file_stream import preallocate
+
+# Los CRC se calculan por bloques de CHUNK_SIZE; solo los bloques completos
+# cuentan como recibidos al reanudar
+CHUNK_SIZE = 1024 * 1024
+# Bloques finales cuyo CRC comprueba el emisor antes de reanudar
+RESUME_VERIFY_CHUNKS = 4
+# Los parciales guardan su estado cada tantos bloques, por si el proceso muere
+SAVE_EVERY_CHUNKS = 64
+# Parciales abandonados que se borran al usar el directorio por primera vez
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+# Número de CRC de una oferta que indica que el receptor la rechaza por estar
+# ocupado (el parcial se está recibiendo en otra conexión)
+OFFER_BUSY = 0xFF
+
+
+def transfer_key(filepath):
+    """Clave estable de un archivo: la misma mientras no cambie en disco"""
+    stat = os.stat(filepath)
+    identity = f"{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return int.from_bytes(
+        hashlib.blake2b(identity.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def encode_offer(offset, crcs):
+    """Oferta del receptor: bytes que ya tiene + CRC de los últimos bloques"""
+    return (
+        offset.to_bytes(8, "big")
+        + bytes([len(crcs)])
+        + b"".join(crc.to_bytes(4, "big") for crc in crcs)
+    )
+
+
+def encode_busy_offer():
+    """Oferta que rechaza la transferencia: el emisor volverá a intentarlo"""
+    return bytes(8) + bytes([OFFER_BUSY])
+
+
+async def read_offer(reader):
+    """Lee una oferta de reanudación de un StreamReader
+
+    Devuelve (offset, crcs), o "busy" si el receptor rechaza la transferencia.
+    """
+    head = await reader.readexactly(9)
+    count = head[8]
+    if count == OFFER_BUSY:
+        return "busy"
+    raw = await reader.readexactly(4 * count)
+    crcs = [int.from_bytes(raw[i : i + 4], "big") for i in range(0, len(raw), 4)]
+    return int.from_bytes(head[:8], "big"), crcs
+
+
+def verify_offer(filepath, offset, crcs):
+    """Offset desde el que reanudar tras comprobar los CRC de la oferta
+
+    crcs son los de los bloques que terminan en offset. Si alguno no
+    coincide con el archivo local, se reanuda desde ese bloque; si no se
+    puede comprobar nada, desde el principio.
+    """
+    if not crcs or offset % CHUNK_SIZE or offset > os.path.getsize(filepath):
+        return 0
+    first_chunk = offset // CHUNK_SIZE - len(crcs)
+    if first_chunk < 0:
+        return 0
+    with open(filepath, "rb") as f:
+        f.seek(first_chunk * CHUNK_SIZE)
+        for i, expected in enumerate(crcs):
+            if zlib.crc32(f.read(CHUNK_SIZE)) != expected:
+                # Si falla el primero que se puede comprobar, no se confía en nada
+                return 0 if i == 0 else (first_chunk + i) * CHUNK_SIZE
+    return offset
+
+
+def _verified_chunks(path, crcs):
+    """Cuántos bloques iniciales de path coinciden con sus CRC"""
+    if not crcs:
+        return 0
+    buffer = bytearray(CHUNK_SIZE)
+    try:
+        with open(path, "rb", buffering=0) as f:
+            for i, expected in enumerate(crcs):
+                if f.readinto(buffer) != CHUNK_SIZE or zlib.crc32(buffer) != expected:
+                    return i
+    except OSError:
+        return 0
+    return len(crcs)
+
+
+class PartialFile:
+    """Archivo recibido a medias, con el CRC de cada bloque completo"""
+
+    def __init__(self, store, path, length, crcs):
+        self.store = store
+        self.path = path
+        self.length = length
+        self.crcs = crcs
+        self._file = None
+        self._chunk_crc = 0
+        self._chunk_fill = 0
+        self._unsaved = 0
+
+    @property
+    def offset(self):
+        """Bytes recibidos y verificables (solo bloques completos)"""
+        return len(self.crcs) * CHUNK_SIZE
+
+    def offer(self):
+        return encode_offer(self.offset, self.crcs[-RESUME_VERIFY_CHUNKS:])
+
+    def open(self, start):
+        """Prepara la escritura desde start, descartando lo posterior"""
+        start = min(start, self.offset)
+        del self.crcs[start // CHUNK_SIZE :]
+        mode = "r+b" if os.path.exists(self.path) else "w+b"
+        self._file = open(self.path, mode)
+        self._file.truncate(start)
+        self._file.seek(start)
+        preallocate(self._file.fileno(), self.length)
+        self._chunk_crc = 0
+        self._chunk_fill = 0
+        return start
+
+    def write(self, data):
+        """Escribe datos en orden y va cerrando los CRC de cada bloque"""
+        self._file.write(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), CHUNK_SIZE - self._chunk_fill)
+            self._chunk_crc = zlib.crc32(view[:take], self._chunk_crc)
+            self._chunk_fill += take
+            view = view[take:]
+            if self._chunk_fill == CHUNK_SIZE:
+                self.crcs.append(self._chunk_crc)
+                self._chunk_crc = 0
+                self._chunk_fill = 0
+                self._unsaved += 1
+        if self._unsaved >= SAVE_EVERY_CHUNKS:
+            self.save()
+
+    def reset(self):
+        """Olvida lo recibido: el próximo intento empieza desde cero"""
+        del self.crcs[:]
+
+    def save(self):
+        """Guarda el estado para poder reanudar más tarde"""
+        if self._file is not None:
+            self._file.flush()
+        self.store._save_meta(self)
+        self._unsaved = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.store._release(self)
+
+    def complete(self, filename):
+        """Mueve el archivo terminado a filename y olvida el parcial"""
+        self._file.close()
+        self._file = None
+        os.replace(self.path, filename)
+        self.store._discard(self)
+
+
+class PartialStore:
+    """Directorio con las transferencias entrantes a medias
+
+    Cada parcial se identifica por (remitente, clave de transferencia) y
+    consta del archivo de datos y un .json con su tamaño y los CRC de los
+    bloques recibidos. Solo puede haber una conexión escribiendo en cada uno.
+    El directorio no se crea hasta que llega el primer archivo reanudable.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._in_use = set()
+        self._ready = False
+
+    def acquire(self, sender, key, length):
+        """Abre (o crea) el parcial de sender/key; None si ya está en uso"""
+        if not self._ready:
+            os.makedirs(self.directory, exist_ok=True)
+            self._cleanup()
+            self._ready = True
+        path = os.path.join(self.directory, f"{sender}-{key:016x}.part")
+        if path in self._in_use:
+            return None
+        crcs = []
+        try:
+            with open(path + ".json", "r") as f:
+                meta = json.load(f)
+            if meta["length"] == length:
+                crcs = meta["crcs"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        # Los datos en disco pueden ir por detrás del estado si el proceso
+        # murió: solo cuentan los bloques cuyo contenido sigue cuadrando
+        crcs = crcs[: _verified_chunks(path, crcs)]
+        self._in_use.add(path)
+        return PartialFile(self, path, length, crcs)
+
+    def _save_meta(self, partial):
+        tmp_path = partial.path + ".json.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"length": partial.length, "crcs": partial.crcs}, f)
+        os.replace(tmp_path, partial.path + ".json")
+
+    def _release(self, partial):
+        self._in_use.discard(partial.path)
+
+    def _discard(self, partial):
+        self._in_use.discard(partial.path)
+        try:
+            os.remove(partial.path + ".json")
+        except FileNotFoundError:
+            pass
+
+    def _cleanup(self):
+        limit = time.time() - PARTIAL_MAX_AGE
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,213 @@
+import random
+import time
+from collections import OrderedDict, deque
+
+from lcp_extensions import set_compression, set_session_fields
+from lcp_logging import get_logger
+
+logger = get_logger("sessions")
+
+# Mensajes de sesión en vuelo por peer antes de esperar ACKs
+SESSION_WINDOW = 64
+# ACKs duplicados que disparan la retransmisión rápida del más antiguo
+DUP_ACK_THRESHOLD = 3
+
+
+class SessionSender:
+    """Extremo emisor de una sesión de mensajes con un peer
+
+    Cada mensaje viaja en un solo datagrama (header + cuerpo) con un número de
+    secuencia; el receptor confirma de forma acumulada, así que pueden estar
+    en vuelo hasta window mensajes a la vez. Ante un timeout se retransmite el
+    más antiguo sin confirmar; tras max_retries timeouts seguidos la sesión
+    se cierra y todos sus envíos fallan.
+    """
+
+    def __init__(
+        self,
+        loop,
+        sendto,
+        addr,
+        header,
+        rto,
+        on_rtt=None,
+        window=SESSION_WINDOW,
+        max_retries=5,
+    ):
+        self.loop = loop
+        self.addr = addr
+        self.session_id = random.getrandbits(32)
+        self.window = window
+        self.max_retries = max_retries
+        self.closed = False
+        self._sendto = sendto
+        self._header = header  # Plantilla de header con las extensiones
+        self._rto = rto  # Callable que devuelve el timeout de retransmisión
+        self._on_rtt = on_rtt
+        self._next_seq = 1
+        self._acked = 0
+        # seq -> [datagrama, future, instante de envío, retransmitido]
+        self._outstanding = OrderedDict()
+        self._waiters = deque()
+        self._granted = 0  # Huecos cedidos a envíos que aún no han salido
+        self._timer = None
+        self._retries = 0
+        self._dup_acks = 0
+        self._recover_seq = 0
+
+    async def send(self, payload, codec_cap=None):
+        """Envía un cuerpo de mensaje; devuelve True cuando el peer lo confirma
+
+        codec_cap indica el códec si payload va comprimido.
+        """
+        if len(self._outstanding) + len(self._waiters) + self._granted >= self.window:
+            # Ventana llena: esperar turno en orden de llegada
+            waiter = self.loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter.done() and not waiter.cancelled():
+                    self._granted -= 1
+        if self.closed:
+            return False
+
+        seq = self._next_seq
+        self._next_seq += 1
+        header = set_session_fields(bytearray(self._header), self.session_id, seq)
+        header[41] = seq % 256
+        header[42:50] = len(payload).to_bytes(8, "big")
+        if codec_cap is not None:
+            set_compression(header, codec_cap)
+        datagram = bytes(header) + payload
+
+        future = self.loop.create_future()
+        self._outstanding[seq] = [datagram, future, time.monotonic(), False]
+        self._sendto(datagram, self.addr)
+        if self._timer is None:
+            self._arm()
+        return await future
+
+    def on_ack(self, session_low, ack16):
+        """Procesa un ACK acumulado (secuencia módulo 65536)"""
+        if self.closed or session_low != self.session_id % 256:
+            return
+        advance = (ack16 - self._acked) % 65536
+        if advance >= 32768 or self._acked + advance >= self._next_seq:
+            return  # ACK antiguo o fuera de rango
+
+        if advance == 0:
+            self._dup_acks += 1
+            if self._dup_acks == DUP_ACK_THRESHOLD and self._outstanding:
+                self._retransmit_oldest()
+            return
+
+        self._acked += advance
+        self._dup_acks = 0
+        self._retries = 0
+        now = time.monotonic()
+        while self._outstanding:
+            seq, entry = next(iter(self._outstanding.items()))
+            if seq > self._acked:
+                break
+            del self._outstanding[seq]
+            if not entry[3] and self._on_rtt is not None:
+                # Algoritmo de Karn: solo se miden los no retransmitidos
+                self._on_rtt(now - entry[2])
+            if not entry[1].done():
+                entry[1].set_result(True)
+        self._wake_waiters()
+
+        self._cancel_timer()
+        if self._outstanding:
+            if self._acked < self._recover_seq:
+                # ACK parcial tras un timeout: el siguiente hueco también se perdió
+                self._retransmit_oldest()
+            self._arm()
+
+    def close(self):
+        """Cierra la sesión y hace fallar los envíos pendientes"""
+        if self.closed:
+            return
+        self.closed = True
+        self._cancel_timer()
+        for entry in self._outstanding.values():
+            if not entry[1].done():
+                entry[1].set_result(False)
+        self._outstanding.clear()
+        self._wake_waiters()
+
+    @property
+    def in_flight(self):
+        return len(self._outstanding)
+
+    def _retransmit_oldest(self):
+        entry = next(iter(self._outstanding.values()))
+        entry[3] = True
+        self._sendto(entry[0], self.addr)
+
+    def _on_timeout(self):
+        self._timer = None
+        if not self._outstanding:
+            return
+        self._retries += 1
+        if self._retries > self.max_retries:
+            logger.warning("Sesión con %s sin respuesta, cerrada", self.addr)
+            self.close()
+            return
+        self._recover_seq = self._next_seq - 1
+        self._retransmit_oldest()
+        self._arm()
+
+    def _arm(self):
+        # Backoff exponencial mientras se repitan los timeouts
+        self._timer = self.loop.call_later(
+            self._rto() * (2 ** self._retries), self._on_timeout
+        )
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _wake_waiters(self):
+        """Cede los huecos libres de la ventana a los que esperan
+
+        Si la sesión se cerró, despierta a todos.
+        """
+        free = self.window - len(self._outstanding) - self._granted
+        while self._waiters and (free > 0 or self.closed):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._granted += 1
+                free -= 1
+
+
+class SessionReceiver:
+    """Extremo receptor de una sesión: entrega en orden y sin duplicados
+
+    Los mensajes que llegan adelantados se guardan (como mucho window) hasta
+    que se rellena el hueco.
+    """
+
+    def __init__(self, window=SESSION_WINDOW):
+        self.window = window
+        self.expected = 1
+        self._buffer = {}
+
+    @property
+    def acked(self):
+        """Última secuencia entregada en orden"""
+        return self.expected - 1
+
+    def receive(self, seq, item):
+        """Registra el mensaje seq y devuelve los que quedan listos para entregar"""
+        if seq < self.expected or seq >= self.expected + self.window:
+            return []  # Duplicado o fuera de ventana
+        self._buffer[seq] = item
+        ready = []
+        while self.expected in self._buffer:
+            ready.append(self._buffer.pop(self.expected))
+            self.expected += 1
+        return ready
@@ -0,0 +1,129 @@
+import os
+import time
+from collections import deque
+
+from file_stream import preallocate
+
+# Los archivos se reparten en rangos de STRIPE_RANGE bytes entre las conexiones
+STRIPE_RANGE = 8 * 1024 * 1024
+# Por debajo de este tamaño una sola conexión basta
+STRIPE_MIN_SIZE = 32 * 1024 * 1024
+# Mejora mínima de throughput para seguir añadiendo conexiones
+STRIPE_GAIN = 1.1
+
+
+def encode_range(offset, length):
+    """Cabecera de rango: offset (8) + longitud (8); longitud 0 = fin"""
+    return offset.to_bytes(8, "big") + length.to_bytes(8, "big")
+
+
+def decode_range(data):
+    return int.from_bytes(data[:8], "big"), int.from_bytes(data[8:16], "big")
+
+
+class StripeScheduler:
+    """Reparte los rangos de un archivo entre conexiones paralelas
+
+    Empieza con pocas conexiones y añade otra mientras el throughput total
+    mejore al menos STRIPE_GAIN; cuando deja de mejorar, se queda con las
+    que tiene. Los rangos de una conexión caída vuelven a la cola.
+    """
+
+    def __init__(self, file_size, max_streams, range_size=STRIPE_RANGE):
+        self.max_streams = max_streams
+        self.streams = min(2, max_streams)
+        self._pending = deque(
+            (offset, min(range_size, file_size - offset))
+            for offset in range(0, file_size, range_size)
+        )
+        self._remaining = len(self._pending)
+        self._growing = self.streams < max_streams
+        self._best_rate = 0.0
+        self._mark = (time.monotonic(), 0)
+        self._bytes_done = 0
+        self._ranges_since_change = 0
+
+    def next_range(self):
+        """Siguiente rango por enviar, o None si no queda ninguno en cola"""
+        return self._pending.popleft() if self._pending else None
+
+    def requeue(self, stripe):
+        self._pending.appendleft(stripe)
+
+    @property
+    def finished(self):
+        return self._remaining == 0
+
+    def range_done(self, stripe):
+        """Anota un rango confirmado; devuelve True si conviene abrir otra conexión"""
+        self._remaining -= 1
+        self._bytes_done += stripe[1]
+        self._ranges_since_change += 1
+        if not self._growing or self._ranges_since_change < self.streams:
+            return False
+
+        # Cada conexión ha completado al menos un rango: medir
+        now = time.monotonic()
+        started, bytes_at_mark = self._mark
+        rate = (self._bytes_done - bytes_at_mark) / max(now - started, 1e-6)
+        self._mark = (now, self._bytes_done)
+        self._ranges_since_change = 0
+        if rate < self._best_rate * STRIPE_GAIN or not self._pending:
+            self._growing = False
+            return False
+        self._best_rate = rate
+        self.streams += 1
+        self._growing = self.streams < self.max_streams
+        return True
+
+
+class StripedFile:
+    """Archivo que se recibe por rangos desde varias conexiones a la vez
+
+    Cada rango se escribe en su posición con escrituras posicionales, sin
+    mover un puntero compartido, sobre un archivo con todo su espacio
+    reservado de antemano. Solo cuentan los rangos recibidos enteros.
+    """
+
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length
+        self.bytes_done = 0
+        self._done_ranges = set()
+        self._writers = set()
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o666)
+        preallocate(self._fd, length)
+
+    def fileno(self):
+        return self._fd
+
+    def range_done(self, offset, length):
+        if (offset, length) not in self._done_ranges:
+            self._done_ranges.add((offset, length))
+            self.bytes_done += length
+
+    @property
+    def complete(self):
+        return self.bytes_done >= self.length
+
+    def add_writer(self, writer):
+        self._writers.add(writer)
+
+    def remove_writer(self, writer):
+        self._writers.discard(writer)
+
+    def abort(self):
+        """Cierra todas las conexiones y descarta lo recibido"""
+        for writer in list(self._writers):
+            writer.close()
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
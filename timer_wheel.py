@@ -0,0 +1,83 @@
+from lcp_logging import get_logger
+
+logger = get_logger("timers")
+
+
+class TimerWheel:
+    """Rueda de temporizadores con resolución fija
+
+    Programar y cancelar cuestan O(1) y cada tick solo revisa una ranura, así
+    que miles de expiraciones (cuerpos pendientes, transferencias, peers) no
+    llenan el heap del event loop. Solo hace ticks mientras hay temporizadores.
+    """
+
+    def __init__(self, tick=0.1, slots=512):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._position = 0
+        self._timers = {}  # key -> ranura donde está programado
+        self._loop = None
+        self._handle = None
+
+    def start(self, loop):
+        self._loop = loop
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for slot in self._slots:
+            slot.clear()
+        self._timers.clear()
+
+    def schedule(self, key, delay, callback, *args):
+        """Programa callback(*args) dentro de delay segundos; reemplaza key"""
+        self.cancel(key)
+        ticks = max(1, -(-delay // self.tick))
+        ticks = int(ticks)
+        slot = (self._position + ticks) % len(self._slots)
+        rounds = (ticks - 1) // len(self._slots)
+        self._slots[slot][key] = [rounds, callback, args]
+        self._timers[key] = slot
+        if self._handle is None and self._loop is not None:
+            self._handle = self._loop.call_later(self.tick, self._advance)
+
+    def cancel(self, key):
+        """Cancela el temporizador key; devuelve False si no existía"""
+        slot = self._timers.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def __len__(self):
+        return len(self._timers)
+
+    def _advance(self):
+        self._position = (self._position + 1) % len(self._slots)
+        slot = self._slots[self._position]
+        expired = []
+        for key, entry in slot.items():
+            if entry[0] > 0:
+                entry[0] -= 1
+            else:
+                expired.append((key, entry))
+
+        for key, entry in expired:
+            # Un callback anterior pudo cancelar o reprogramar este temporizador
+            if slot.get(key) is not entry:
+                continue
+            _, callback, args = slot.pop(key)
+            del self._timers[key]
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.exception("Error en temporizador %s: %s", key, e)
+
+        if self._timers:
+            self._handle = self._loop.call_later(self.tick, self._advance)
+        else:
+            self._handle = None
@@ -0,0 +1,246 @@
+import asyncio
+import time
+
+from lcp_logging import get_logger
+
+logger = get_logger("transfers")
+
+
+class IncomingTransfer:
+    """Estado de una transferencia de archivo entrante"""
+
+    __slots__ = (
+        "sender",
+        "file_id",
+        "file_length",
+        "user_from",
+        "state",
+        "bytes_received",
+        "created",
+        "on_expire",
+        "resume_key",
+        "striped",
+        "sink",
+        "codec",
+        "digest",
+        "progress",
+    )
+
+    def __init__(
+        self,
+        sender,
+        file_id,
+        file_length,
+        user_from,
+        resume_key=None,
+        striped=False,
+        codec=None,
+        digest=None,
+    ):
+        self.sender = sender
+        self.file_id = file_id
+        self.file_length = file_length
+        self.user_from = user_from
+        self.state = "announced"
+        self.bytes_received = 0
+        self.created = time.time()
+        self.on_expire = None
+        self.resume_key = resume_key  # Clave para reanudar, si el emisor la envía
+        self.striped = striped  # Llega por rangos en varias conexiones
+        self.sink = None  # Destino compartido por las conexiones de un envío por rangos
+        self.codec = codec  # Códec (CAP_*) si el contenido llega comprimido
+        self.digest = digest  # Algoritmo del digest que sigue al contenido
+        self.progress = None  # TransferProgress mientras está activa
+
+    @property
+    def key(self):
+        return (self.sender, self.file_id)
+
+
+class TransferRegistry:
+    """Registro de transferencias entrantes indexado por (remitente, FileId)
+
+    Cada header de operación 2 anuncia una transferencia que espera su
+    conexión TCP; varias pueden estar en curso a la vez, incluso desde el
+    mismo peer. Los anuncios que nunca se conectan y las transferencias que
+    dejan de recibir datos expiran mediante la rueda de temporizadores.
+    Una transferencia por rangos admite más conexiones mientras está activa.
+    Como mucho max_transfers pueden estar anunciadas o activas a la vez. Con
+    un ProgressTracker, el progreso de las activas se notifica a través de él.
+    """
+
+    def __init__(
+        self, timers, announce_ttl=30, idle_ttl=60, max_transfers=None, tracker=None
+    ):
+        self._timers = timers
+        self.tracker = tracker
+        self.announce_ttl = announce_ttl
+        self.idle_ttl = idle_ttl
+        self.max_transfers = max_transfers
+        self._announced = {}
+        self._active = set()
+        self._joinable = {}  # Transferencias por rangos activas, por clave
+        self._withdrawn = {}  # Transferencias por rangos rechazadas, por clave
+        self._waiters = {}
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.refused = 0
+
+    def announce(
+        self,
+        sender,
+        file_id,
+        file_length,
+        user_from,
+        resume_key=None,
+        striped=False,
+        codec=None,
+        digest=None,
+    ):
+        """Registra el header de una transferencia; reemplaza uno anterior igual
+
+        Devuelve None si ya hay max_transfers en curso.
+        """
+        transfer = IncomingTransfer(
+            sender, file_id, file_length, user_from, resume_key, striped, codec, digest
+        )
+        if (
+            self.max_transfers is not None
+            and transfer.key not in self._announced
+            and len(self) >= self.max_transfers
+        ):
+            self.refused += 1
+            return None
+        previous = self._announced.pop(transfer.key, None)
+        if previous is not None:
+            self._timers.cancel(previous)
+        self._announced[transfer.key] = transfer
+        self._timers.schedule(transfer, self.announce_ttl, self._expire, transfer)
+
+        waiter = self._waiters.pop(transfer.key, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(transfer)
+        return transfer
+
+    async def claim(self, sender, file_id, loop, timeout=2):
+        """Asocia una conexión TCP a su anuncio y la marca como activa
+
+        El header UDP puede llegar un poco después que la conexión TCP, así
+        que se espera hasta timeout segundos a que aparezca.
+        """
+        key = (sender, file_id)
+        if key in self._joinable:
+            return self._joinable[key]
+        if key in self._withdrawn:
+            # Otra conexión de la misma transferencia ya se rechazó
+            return self._withdrawn[key]
+        transfer = self._announced.pop(key, None)
+        if transfer is None:
+            waiter = self._waiters.get(key)
+            if waiter is None:
+                waiter = self._waiters[key] = loop.create_future()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                if self._waiters.get(key) is waiter:
+                    del self._waiters[key]
+            transfer = self._announced.pop(key, None)
+            if transfer is None:
+                return None
+
+        transfer.state = "active"
+        self._active.add(transfer)
+        if transfer.striped:
+            self._joinable[key] = transfer
+        if self.tracker is not None:
+            peer = transfer.user_from.decode("utf-8", errors="replace").strip()
+            transfer.progress = self.tracker.start("in", peer, transfer.file_length)
+        self.touch(transfer)
+        return transfer
+
+    def touch(self, transfer, nbytes=0):
+        """Anota actividad en una transferencia activa y aplaza su expiración"""
+        transfer.bytes_received += nbytes
+        if nbytes and transfer.progress is not None:
+            self.tracker.advance(transfer.progress, nbytes)
+        self._timers.schedule(transfer, self.idle_ttl, self._expire, transfer)
+
+    def resume(self, transfer, offset):
+        """Anota los bytes que ya se tenían de un intento anterior"""
+        transfer.bytes_received += offset
+        if transfer.progress is not None:
+            self.tracker.rewind(transfer.progress, offset)
+        self.touch(transfer)
+
+    def withdraw(self, sender, file_id):
+        """Descarta un anuncio cuya conexión se rechazó; devuelve la transferencia
+
+        Libera su hueco entre las max_transfers sin esperar a announce_ttl.
+        Las transferencias ya activas no se tocan. Las conexiones de rangos
+        que lleguen después para una transferencia por rangos retirada la
+        reciben de claim con state "refused" durante announce_ttl.
+        """
+        key = (sender, file_id)
+        transfer = self._announced.pop(key, None)
+        if transfer is not None:
+            self._timers.cancel(transfer)
+            transfer.state = "refused"
+            self.refused += 1
+            if transfer.striped:
+                self._withdrawn[key] = transfer
+                self._timers.schedule(
+                    transfer, self.announce_ttl, self._withdrawn.pop, key, None
+                )
+        return transfer
+
+    def finish(self, transfer, ok):
+        """Cierra una transferencia como completada o fallida"""
+        if transfer.state != "active":
+            return
+        self._active.discard(transfer)
+        self._joinable.pop(transfer.key, None)
+        self._timers.cancel(transfer)
+        transfer.state = "completed" if ok else "failed"
+        if transfer.progress is not None:
+            self.tracker.finish(transfer.progress, ok)
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def _expire(self, transfer):
+        if self._announced.get(transfer.key) is transfer:
+            del self._announced[transfer.key]
+        self._active.discard(transfer)
+        if self._joinable.get(transfer.key) is transfer:
+            del self._joinable[transfer.key]
+        transfer.state = "expired"
+        self.expired += 1
+        if transfer.progress is not None:
+            self.tracker.finish(transfer.progress, False)
+        logger.warning(
+            "Transferencia %d de %s expirada (%d/%d bytes)",
+            transfer.file_id,
+            transfer.sender,
+            transfer.bytes_received,
+            transfer.file_length,
+        )
+        if transfer.on_expire is not None:
+            transfer.on_expire()
+
+    def stats(self):
+        """Contadores para dimensionar la capacidad del nodo"""
+        return {
+            "announced": len(self._announced),
+            "active": len(self._active),
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "refused": self.refused,
+        }
+
+    def __len__(self):
+        return len(self._announced) + len(self._active)